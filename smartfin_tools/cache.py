@@ -0,0 +1,291 @@
+'''Content-addressed decode cache
+'''
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools import __version__
+from smartfin_tools.config import get_cache_path
+from smartfin_tools.schema import TEXT_DATA_TYPE, schema_fingerprint
+
+DEFAULT_CACHE_SIZE = 1 << 30
+CACHE_SUFFIX = '.npz'
+TEMP_SUFFIX = '.tmp'
+# Temporary files older than this were left behind by a crashed writer
+STALE_TEMP_AGE_S = 3600
+
+
+def file_digest(path: Path) -> str:
+    """Hashes a file's contents
+
+    Args:
+        path (Path): File path
+
+    Returns:
+        str: Hex digest
+    """
+    with open(path, 'rb') as handle:
+        return hashlib.file_digest(handle, 'blake2b').hexdigest()
+
+
+def _pack(ensembles: scd.ColumnarEnsembles) -> Dict[str, np.ndarray]:
+    """Flattens a decode result into plain arrays
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Decode result
+
+    Returns:
+        Dict[str, np.ndarray]: Arrays by name, free of Python objects
+    """
+    arrays = {
+        'data_type': ensembles.data_type,
+        'timestamp_ds': ensembles.timestamp_ds,
+        'offsets': ensembles.offsets,
+        'skipped': ensembles.skipped,
+    }
+    for data_type, table in ensembles.tables.items():
+        if data_type == TEXT_DATA_TYPE:
+            encoded = [text.encode() for text in table['text']]
+            text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(text) for text in encoded], out=text_offsets[1:])
+            arrays['text'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            arrays['text_offsets'] = text_offsets
+        else:
+            arrays[f'table_{data_type}'] = table
+    return arrays
+
+
+def _unpack(arrays: Dict[str, np.ndarray]) -> scd.ColumnarEnsembles:
+    """Rebuilds a decode result flattened by `_pack`
+
+    Args:
+        arrays (Dict[str, np.ndarray]): Arrays by name
+
+    Returns:
+        scd.ColumnarEnsembles: Decode result
+    """
+    tables = {int(name.removeprefix('table_')): array
+              for name, array in arrays.items()
+              if name.startswith('table_')}
+    if 'text' in arrays:
+        data = arrays['text'].tobytes()
+        text_offsets = arrays['text_offsets'].tolist()
+        table = np.empty(len(text_offsets) - 1, dtype=[('text', object)])
+        table['text'] = [data[start:stop].decode()
+                         for start, stop in zip(text_offsets,
+                                                text_offsets[1:])]
+        tables[TEXT_DATA_TYPE] = table
+    return scd.ColumnarEnsembles(
+        tables=dict(sorted(tables.items())),
+        data_type=arrays['data_type'],
+        timestamp_ds=arrays['timestamp_ds'],
+        offsets=arrays['offsets'],
+        skipped=arrays['skipped']
+    )
+
+
+@dataclass
+class CacheInfo:
+    """Cache usage summary
+    """
+    path: Path
+    entries: int
+    size: int
+    max_size: int
+
+
+class DecodeCache:
+    """On-disk cache of columnar decode results
+
+    Entries are keyed by the input's content hash, the decoder and schema
+    versions and the decode variant (e.g. record encoding and filter), so a
+    changed file or decoder never hits a stale entry.  The total size is
+    bounded by evicting the least recently used entries.  Every lookup hashes
+    the whole input.
+
+    Several processes (e.g. batch workers) may share a cache.  Entries are
+    written to a temporary file and renamed into place, so readers only ever
+    see complete entries, and concurrent writers of the same key just
+    replace one complete entry with another.
+    """
+
+    def __init__(self,
+                 path: Optional[Path] = None,
+                 *,
+                 max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.path = path if path is not None else get_cache_path()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def key(self, input_path: Path, variant: str = '') -> str:
+        """Computes the cache key for decoding a file
+
+        Args:
+            input_path (Path): Input file
+            variant (str, optional): Anything else the decode depends on.
+            Defaults to ''.
+
+        Returns:
+            str: Cache key
+        """
+        identity = json.dumps([file_digest(input_path), __version__,
+                               scd.DECODER_VERSION, schema_fingerprint(),
+                               variant])
+        return hashlib.blake2b(identity.encode(), digest_size=20).hexdigest()
+
+    def __entry(self, key: str) -> Path:
+        return self.path / f'{key}{CACHE_SUFFIX}'
+
+    def entries(self) -> List[Path]:
+        """Lists the cache entries, least recently used first
+
+        Returns:
+            List[Path]: Entry paths
+        """
+        stats = []
+        for entry in self.path.glob(f'*{CACHE_SUFFIX}'):
+            try:
+                stats.append((entry.stat().st_mtime_ns, entry))
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+        return [entry for _, entry in sorted(stats)]
+
+    def get(self, key: str) -> Optional[scd.ColumnarEnsembles]:
+        """Looks up a decode result, marking it as recently used
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            Optional[scd.ColumnarEnsembles]: Decode result, or None on a miss
+        """
+        entry = self.__entry(key)
+        try:
+            handle = open(entry, 'rb')
+        except FileNotFoundError:
+            return None
+        with handle:
+            inode = os.fstat(handle.fileno()).st_ino
+            try:
+                with np.load(handle, allow_pickle=False) as archive:
+                    arrays = {name: archive[name] for name in archive.files}
+            except (OSError, ValueError, KeyError, EOFError,
+                    zipfile.BadZipFile):
+                # Unreadable, so decode again.  Only evict this very file, not
+                # an entry another process has just renamed into its place.
+                try:
+                    if entry.stat().st_ino == inode:
+                        entry.unlink()
+                except FileNotFoundError:
+                    pass
+                return None
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            pass
+        return _unpack(arrays)
+
+    def put(self, key: str, ensembles: scd.ColumnarEnsembles) -> None:
+        """Stores a decode result, evicting old entries to stay within size
+
+        Args:
+            key (str): Cache key
+            ensembles (scd.ColumnarEnsembles): Decode result
+        """
+        with tempfile.NamedTemporaryFile(dir=self.path, suffix=TEMP_SUFFIX,
+                                         delete=False) as handle:
+            try:
+                np.savez(handle, **_pack(ensembles))
+            except BaseException:
+                handle.close()
+                os.unlink(handle.name)
+                raise
+        os.replace(handle.name, self.__entry(key))
+        self.purge(self.max_size)
+
+    def purge(self, max_size: int = 0) -> int:
+        """Evicts least recently used entries until the cache fits
+
+        Args:
+            max_size (int, optional): Size to shrink to in bytes. Defaults to
+            0, which empties the cache.
+
+        Returns:
+            int: Number of entries evicted
+        """
+        stale = time.time() - STALE_TEMP_AGE_S
+        for temp in self.path.glob(f'*{TEMP_SUFFIX}'):
+            try:
+                if temp.stat().st_mtime < stale:
+                    temp.unlink()
+            except FileNotFoundError:
+                continue
+        entries = self.entries()
+        sizes = []
+        for entry in entries:
+            try:
+                sizes.append(entry.stat().st_size)
+            except FileNotFoundError:
+                sizes.append(0)
+        total = sum(sizes)
+        evicted = 0
+        for entry, size in zip(entries, sizes):
+            if total <= max_size:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        return evicted
+
+    def info(self) -> CacheInfo:
+        """Summarizes the cache contents
+
+        Returns:
+            CacheInfo: Usage summary
+        """
+        entries = self.entries()
+        return CacheInfo(path=self.path,
+                         entries=len(entries),
+                         size=sum(entry.stat().st_size for entry in entries),
+                         max_size=self.max_size)
+
+
+def cached_decode(cache: Optional[DecodeCache],
+                  input_path: Path,
+                  decode: Callable[[], scd.ColumnarEnsembles],
+                  variant: str = '') -> scd.ColumnarEnsembles:
+    """Decodes a file through the cache
+
+    Args:
+        cache (Optional[DecodeCache]): Cache to consult, or None to always
+        decode
+        input_path (Path): Input file
+        decode (Callable[[], scd.ColumnarEnsembles]): Decodes the file on a
+        miss
+        variant (str, optional): Anything else the decode depends on.
+        Defaults to ''.
+
+    Returns:
+        scd.ColumnarEnsembles: Decode result
+    """
+    if cache is None:
+        return decode()
+    key = cache.key(input_path, variant)
+    ensembles = cache.get(key)
+    if ensembles is None:
+        ensembles = decode()
+        cache.put(key, ensembles)
+    return ensembles
@@ -0,0 +1,349 @@
+'''Archive checksums
+
+Files are checksummed in fixed size chunks, so memory use does not grow with
+file size, and many files are checksummed over worker processes.  SFR files
+also get a CRC32 per record, so a corrupted record can be located by line.
+'''
+import base64
+import json
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from smartfin_tools.common import FileFormats
+
+CHECKSUM_MANIFEST = 'sfverify_checksums.json'
+CHECKSUM_VERSION = 1
+CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class FileChecksum:
+    """Checksums of one file
+
+    `records` holds the CRC32 of each line of an SFR file, without its line
+    terminator.
+    """
+    size: int
+    crc32: int
+    records: Optional[List[int]] = None
+
+
+class VerifyStatus(Enum):
+    """Outcome of verifying a file against the manifest
+    """
+    OK = 'ok'
+    NEW = 'new'
+    CHANGED = 'changed'
+    MISSING = 'missing'
+    ERROR = 'error'
+
+    def __str__(self) -> str:
+        return self.value
+
+
+@dataclass
+class VerifyResult:
+    """Verification of one file
+
+    `bad_records` are the 1-based line numbers of SFR records that differ
+    from the manifest, including lines added or removed at the end.
+    """
+    path: Path
+    status: VerifyStatus
+    checksum: Optional[FileChecksum] = None
+    bad_records: List[int] = field(default_factory=list)
+    error: Optional[str] = None
+    duration: float = 0.0
+
+
+def __chunks(path: Path, chunk_size: int) -> Iterator[memoryview]:
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as handle:
+        while n_read := handle.readinto(buffer):
+            yield view[:n_read]
+
+
+def file_crc32(path: Path, *, chunk_size: int = CHUNK_SIZE) -> int:
+    """Computes the CRC32 of a file, reading it in chunks
+
+    Args:
+        path (Path): File path
+        chunk_size (int, optional): Bytes read at a time. Defaults to
+        CHUNK_SIZE.
+
+    Returns:
+        int: CRC32
+    """
+    crc = 0
+    for chunk in __chunks(path, chunk_size):
+        crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def checksum_file(path: Path, *, chunk_size: int = CHUNK_SIZE
+                  ) -> FileChecksum:
+    """Checksums a file, and each record of an SFR file, in one pass
+
+    Args:
+        path (Path): File path
+        chunk_size (int, optional): Bytes read at a time. Defaults to
+        CHUNK_SIZE.
+
+    Returns:
+        FileChecksum: Checksums
+    """
+    size = path.stat().st_size
+    if path.suffix.lower() != FileFormats.SFR.value:
+        return FileChecksum(size=size,
+                            crc32=file_crc32(path, chunk_size=chunk_size))
+    crc = 0
+    records: List[int] = []
+    with open(path, 'rb') as sfr:
+        while text := sfr.read(chunk_size):
+            text += sfr.readline()
+            crc = zlib.crc32(text, crc)
+            lines = text.split(b'\n')
+            if lines[-1] == b'':
+                # Text ends on a line terminator
+                lines.pop()
+            records.extend(zlib.crc32(line.rstrip(b'\r')) for line in lines)
+    return FileChecksum(size=size, crc32=crc, records=records)
+
+
+def _checksum_one(path: Path, chunk_size: int
+                  ) -> Tuple[Optional[FileChecksum], Optional[str], float]:
+    start = time.perf_counter()
+    try:
+        checksum = checksum_file(path, chunk_size=chunk_size)
+    except OSError as exc:
+        return None, f'{type(exc).__name__}: {exc}', \
+            time.perf_counter() - start
+    return checksum, None, time.perf_counter() - start
+
+
+def changed_records(expected: FileChecksum,
+                    actual: FileChecksum) -> List[int]:
+    """Locates the SFR records that differ between two checksums
+
+    Args:
+        expected (FileChecksum): Recorded checksums
+        actual (FileChecksum): Current checksums
+
+    Returns:
+        List[int]: 1-based line numbers of differing, added or removed
+        records
+    """
+    if expected.records is None or actual.records is None:
+        return []
+    common = min(len(expected.records), len(actual.records))
+    bad = [idx + 1 for idx, (old, new) in
+           enumerate(zip(expected.records, actual.records)) if old != new]
+    bad.extend(range(common + 1, max(len(expected.records),
+                                     len(actual.records)) + 1))
+    return bad
+
+
+class ChecksumManifest:
+    """Stored checksums of an archive
+
+    Files are keyed by their path relative to the manifest's directory, so
+    the archive can be moved or copied with its manifest.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.root = path.absolute().parent
+        self.__entries: Dict[str, FileChecksum] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as handle:
+                manifest = json.load(handle)
+            if manifest.get('version') == CHECKSUM_VERSION:
+                self.__entries = {key: self.__load_entry(entry) for key, entry
+                                  in manifest['files'].items()}
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @staticmethod
+    def __load_entry(entry: Dict) -> FileChecksum:
+        records = entry.get('records')
+        if records is not None:
+            # Packed as little endian uint32, which is a fraction of the size
+            # of a JSON list
+            records = np.frombuffer(base64.b64decode(records),
+                                    dtype='<u4').tolist()
+        return FileChecksum(size=entry['size'], crc32=entry['crc32'],
+                            records=records)
+
+    @staticmethod
+    def __dump_entry(checksum: FileChecksum) -> Dict:
+        entry = {'size': checksum.size, 'crc32': checksum.crc32}
+        if checksum.records is not None:
+            entry['records'] = base64.b64encode(
+                np.array(checksum.records, dtype='<u4').tobytes()).decode()
+        return entry
+
+    def key(self, path: Path) -> str:
+        """Gets the manifest key of a file
+
+        Args:
+            path (Path): File path
+
+        Returns:
+            str: Path relative to the manifest directory, in POSIX form
+        """
+        return Path(os.path.relpath(path.absolute(), self.root)).as_posix()
+
+    def get(self, path: Path) -> Optional[FileChecksum]:
+        """Gets the recorded checksums of a file
+
+        Args:
+            path (Path): File path
+
+        Returns:
+            Optional[FileChecksum]: Recorded checksums, None if not recorded
+        """
+        return self.__entries.get(self.key(path))
+
+    def record(self, path: Path, checksum: FileChecksum) -> None:
+        """Records the checksums of a file
+
+        Args:
+            path (Path): File path
+            checksum (FileChecksum): Checksums
+        """
+        self.__entries[self.key(path)] = checksum
+
+    def remove(self, path: Path) -> None:
+        """Forgets a file
+
+        Args:
+            path (Path): File path
+        """
+        self.__entries.pop(self.key(path), None)
+
+    def paths(self) -> List[Path]:
+        """Lists the recorded files
+
+        Returns:
+            List[Path]: Recorded file paths
+        """
+        return [self.root / key for key in sorted(self.__entries)]
+
+    def save(self) -> None:
+        """Writes the manifest atomically
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8',
+                                         dir=self.path.parent,
+                                         suffix='.tmp',
+                                         delete=False) as handle:
+            json.dump({'version': CHECKSUM_VERSION,
+                       'files': {key: self.__dump_entry(entry) for key, entry
+                                 in sorted(self.__entries.items())}},
+                      handle)
+        os.replace(handle.name, self.path)
+
+
+def verify_files(paths: List[Path],
+                 manifest: ChecksumManifest,
+                 *,
+                 workers: Optional[int] = None,
+                 update: bool = False,
+                 roots: Optional[List[Path]] = None,
+                 chunk_size: int = CHUNK_SIZE,
+                 progress: bool = True) -> List[VerifyResult]:
+    """Verifies files against a checksum manifest in parallel
+
+    Files not yet in the manifest are recorded.  Changed files are only
+    re-recorded, and missing files forgotten, when updating.  Recorded files
+    under `roots` that no longer exist are reported as missing.
+
+    Args:
+        paths (List[Path]): Files to verify
+        manifest (ChecksumManifest): Stored checksums, updated in memory
+        workers (Optional[int], optional): Worker processes. Defaults to the
+        CPU count. A single worker checksums in process.
+        update (bool, optional): Accept changed files and forget missing
+        ones. Defaults to False.
+        roots (Optional[List[Path]], optional): Directories whose recorded
+        files are checked for missing files. Defaults to every recorded
+        file.
+        chunk_size (int, optional): Bytes read at a time. Defaults to
+        CHUNK_SIZE.
+        progress (bool, optional): Show a progress bar. Defaults to True.
+
+    Returns:
+        List[VerifyResult]: Results for `paths` in order, followed by the
+        missing files
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    results: List[Optional[VerifyResult]] = [None] * len(paths)
+
+    def finish(idx: int,
+               checksum: Optional[FileChecksum],
+               error: Optional[str],
+               duration: float) -> None:
+        path = paths[idx]
+        expected = manifest.get(path)
+        if checksum is None:
+            result = VerifyResult(path, VerifyStatus.ERROR, error=error)
+        elif expected is None:
+            result = VerifyResult(path, VerifyStatus.NEW, checksum)
+            manifest.record(path, checksum)
+        elif (expected.size, expected.crc32) == (checksum.size,
+                                                 checksum.crc32):
+            result = VerifyResult(path, VerifyStatus.OK, checksum)
+        else:
+            result = VerifyResult(path, VerifyStatus.CHANGED, checksum,
+                                  bad_records=changed_records(expected,
+                                                              checksum))
+            if update:
+                manifest.record(path, checksum)
+        result.duration = duration
+        results[idx] = result
+        pbar.update(1)
+
+    with tqdm(total=len(paths), unit='file', disable=not progress) as pbar:
+        if workers <= 1 or len(paths) <= 1:
+            for idx, path in enumerate(paths):
+                finish(idx, *_checksum_one(path, chunk_size))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_checksum_one, path, chunk_size): idx
+                           for idx, path in enumerate(paths)}
+                for future in as_completed(futures):
+                    # pylint: disable=broad-exception-caught
+                    # A dead worker fails its file, not the run
+                    try:
+                        outcome = future.result()
+                    except Exception as exc:
+                        outcome = None, f'{type(exc).__name__}: {exc}', 0.
+                    finish(futures[future], *outcome)
+
+    if roots is not None:
+        roots = [Path(os.path.abspath(root)) for root in roots]
+    for path in manifest.paths():
+        if roots is not None and not any(
+                Path(os.path.abspath(path)).is_relative_to(root)
+                for root in roots):
+            continue
+        if not path.exists():
+            results.append(VerifyResult(path, VerifyStatus.MISSING))
+            if update:
+                manifest.remove(path)
+    return results
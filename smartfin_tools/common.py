@@ -1,8 +1,10 @@
 '''Common definitions
 '''
+import base64
+import glob
 from enum import Enum
 from pathlib import Path
-from typing import Protocol
+from typing import Callable, Dict, List, Protocol
 
 
 class Encoding(Enum):
@@ -16,12 +18,69 @@ class Encoding(Enum):
         return self.value
 
 
+# Record Ascii to binary decoder for each encoding
+DECODERS: Dict[Encoding, Callable[[str], bytes]] = {
+    Encoding.BASE64: base64.b64decode,
+    Encoding.BASE64URL: base64.urlsafe_b64decode,
+    Encoding.BASE85: base64.b85decode,
+}
+
+# Binary to record Ascii encoder for each encoding
+ENCODERS: Dict[Encoding, Callable[[bytes], bytes]] = {
+    Encoding.BASE64: base64.b64encode,
+    Encoding.BASE64URL: base64.urlsafe_b64encode,
+    Encoding.BASE85: base64.b85encode,
+}
+
+
 class FileFormats(Enum):
     """File formats (and extensions)
     """
     SFP = '.sfp'
     SFR = '.sfr'
+    SFZ = '.sfz'
     CSV = '.csv'
+    NPZ = '.npz'
+    PARQUET = '.parquet'
+    FEATHER = '.feather'
+
+
+def expand_inputs(source: Path,
+                  input_type: FileFormats | None = None,
+                  *,
+                  recursive: bool = False) -> List[Path]:
+    """Expands a batch source into the list of files to convert
+
+    A source may be a directory, a glob pattern or a `.txt` file listing one
+    path per line. Anything else is treated as a single input file.
+
+    Args:
+        source (Path): Directory, glob pattern, file list or file
+        input_type (FileFormats | None, optional): Only select files of this
+        format from directories and globs. Defaults to SFR, SFP and SFZ
+        files.
+        recursive (bool, optional): Include subdirectories of a directory
+        source. Defaults to False.
+
+    Returns:
+        List[Path]: Sorted input files
+    """
+    suffixes = {input_type.value} if input_type is not None \
+        else {FileFormats.SFR.value, FileFormats.SFP.value,
+              FileFormats.SFZ.value}
+    if source.is_dir():
+        candidates = list(source.rglob('*') if recursive
+                          else source.iterdir())
+    elif glob.has_magic(str(source)):
+        candidates = [Path(match)
+                      for match in glob.glob(str(source), recursive=True)]
+    elif source.suffix.lower() == '.txt':
+        with open(source, 'r', encoding='utf-8') as handle:
+            return [Path(line.strip()) for line in handle if line.strip()]
+    else:
+        return [source]
+    return sorted(path for path in candidates
+                  if path.is_file() and path.suffix.lower() in suffixes)
 
 
 class ConverterType(Protocol):
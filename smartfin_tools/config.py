@@ -51,6 +51,16 @@ def get_cache_path() -> Path:
     return cache_path
 
 
+def get_ingest_path() -> Path:
+    """Get ingestion output path
+
+    Returns:
+        Path: Path to ingestion output directory
+    """
+    ingest_path = Path('volumes/ingest')
+    ingest_path.mkdir(parents=True, exist_ok=True)
+    return ingest_path
+
 
 def configure_logging():
     """Configures logging
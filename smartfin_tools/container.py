@@ -0,0 +1,369 @@
+'''Compressed, block-seekable SFP container
+
+An `.sfz` file holds the bytes of an SFP file as independently compressed
+blocks, each starting on an ensemble boundary, so any block decodes on its
+own.  The block index at the end of the file records each block's position
+in the SFP byte stream, its CRC32 and the timestamp range of its ensembles,
+so readers can seek to a time range and decompress only the blocks they
+need.
+
+Layout:
+    header: magic, version, codec
+    compressed blocks
+    block index: one `BLOCK_DTYPE` row per block
+    trailer: index offset, block count, magic
+'''
+from __future__ import annotations
+
+import binascii
+import lzma
+import os
+import struct
+import tempfile
+import zlib
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.profiling import stage
+
+SFZ_MAGIC = b'\x89SFZ\r\n\x1a\n'
+SFZ_VERSION = 1
+DEFAULT_BLOCK_SIZE = 1 << 18
+
+BLOCK_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('size', '<u4'),
+    ('file_offset', '<u8'),
+    ('compressed_size', '<u4'),
+    ('crc32', '<u4'),
+    ('ensembles', '<u4'),
+    ('min_ds', '<u4'),
+    ('max_ds', '<u4'),
+])
+
+SFZ_HEADER = struct.Struct('<8sBB')
+SFZ_TRAILER = struct.Struct('<QQ8s')
+
+# Codec name and its id in the header
+CODECS: Dict[str, int] = {'zlib': 1, 'lzma': 2}
+
+__compressors: Dict[str, Callable[[bytes, Optional[int]], bytes]] = {
+    'zlib': lambda data, level: zlib.compress(
+        data, -1 if level is None else level),
+    'lzma': lambda data, level: lzma.compress(data, preset=level),
+}
+
+DECOMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    'zlib': zlib.decompress,
+    'lzma': lzma.decompress,
+}
+
+
+def is_compressed(path: Path) -> bool:
+    """Checks whether a file is an SFZ container, whatever its extension
+
+    Args:
+        path (Path): File path
+
+    Returns:
+        bool: True if the file starts with the container magic
+    """
+    with open(path, 'rb') as handle:
+        return handle.read(len(SFZ_MAGIC)) == SFZ_MAGIC
+
+
+def block_bounds(index: np.ndarray, size: int, block_size: int) -> np.ndarray:
+    """Picks block boundaries on ensemble boundaries
+
+    Args:
+        index (np.ndarray): Ensemble index of the data
+        size (int): Data size in bytes
+        block_size (int): Target uncompressed block size in bytes
+
+    Returns:
+        np.ndarray: Block start offsets followed by the data size
+    """
+    offsets = index['offset'].astype(np.int64)
+    targets = np.arange(block_size, size, block_size)
+    starts = offsets[np.minimum(np.searchsorted(offsets, targets),
+                                len(offsets) - 1)] if len(offsets) else []
+    return np.unique(np.concatenate(([0], starts, [size]))).astype(np.int64)
+
+
+def write_sfz(data: bytes | Iterable[bytes],
+              path: Path,
+              *,
+              codec: str = 'zlib',
+              level: Optional[int] = None,
+              block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Compresses SFP bytes into a container
+
+    Chunks are indexed as they arrive and each block is compressed and
+    written as soon as the ensemble that ends it is complete, so only about
+    one block of SFP bytes is held at a time.  Blocks are cut as by
+    `block_bounds`, whichever way the data is chunked.
+
+    Args:
+        data (bytes | Iterable[bytes]): SFP bytes, or chunks of them in order
+        path (Path): Output path, written atomically
+        codec (str, optional): One of `CODECS`. Defaults to 'zlib'.
+        level (Optional[int], optional): Compression level or preset.
+        Defaults to the codec's default.
+        block_size (int, optional): Target uncompressed block size in bytes.
+        Defaults to DEFAULT_BLOCK_SIZE.
+
+    Raises:
+        ValueError: Unknown codec
+
+    Returns:
+        np.ndarray: Block index
+    """
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}')
+    compress = __compressors[codec]
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = [data]
+    indexer = scd.StreamIndexer()
+    pending = bytearray()
+    # Index rows of the ensembles in `pending`
+    rows = np.zeros(0, dtype=scd.INDEX_DTYPE)
+    begin = 0
+    target = block_size
+    blocks: List[tuple] = []
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, suffix='.tmp',
+                                     delete=False) as handle:
+        handle.write(SFZ_HEADER.pack(SFZ_MAGIC, SFZ_VERSION, CODECS[codec]))
+
+        def write_block(end: int) -> None:
+            nonlocal begin, rows, target
+            raw = bytes(pending[:end - begin])
+            del pending[:end - begin]
+            with stage('compress_block') as timer:
+                compressed = compress(raw, level)
+                timer.add(items=1, nbytes=len(raw))
+            split = int(np.searchsorted(rows['offset'], end))
+            timestamps = rows['timestamp_ds'][:split]
+            blocks.append((
+                begin, len(raw), handle.tell(), len(compressed),
+                binascii.crc32(raw), len(timestamps),
+                timestamps.min() if len(timestamps)
+                else np.iinfo(np.uint32).max,
+                timestamps.max() if len(timestamps) else 0))
+            handle.write(compressed)
+            rows = rows[split:]
+            begin = end
+            target = (end // block_size + 1) * block_size
+
+        def cut_blocks(new_rows: np.ndarray) -> None:
+            nonlocal rows
+            rows = np.concatenate((rows, new_rows))
+            offsets = rows['offset'].astype(np.int64)
+            # Each block ends at the first ensemble at or after its target
+            while (idx := int(np.searchsorted(offsets, target))) < len(rows):
+                write_block(int(offsets[idx]))
+                offsets = rows['offset'].astype(np.int64)
+
+        size = 0
+        n_indexed = 0
+        for chunk in data:
+            pending += chunk
+            size += len(chunk)
+            new_rows = indexer.feed(chunk)
+            n_indexed += len(new_rows)
+            cut_blocks(new_rows)
+        cut_blocks(indexer.close()[n_indexed:])
+        if target < size and len(rows) and int(rows['offset'][-1]) > begin:
+            # No ensemble after the target, so end at the last ensemble
+            write_block(int(rows['offset'][-1]))
+        if size > begin:
+            write_block(size)
+
+        index_offset = handle.tell()
+        block_index = np.array(blocks, dtype=BLOCK_DTYPE)
+        handle.write(block_index.tobytes())
+        handle.write(SFZ_TRAILER.pack(index_offset, len(blocks), SFZ_MAGIC))
+    os.replace(handle.name, path)
+    return block_index
+
+
+class SfzFile(AbstractContextManager):
+    """Reader for SFZ containers
+
+    Blocks are decompressed on demand and checked against their CRC32.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.__path = path
+        self.__handle = open(path, 'rb')  # pylint: disable=consider-using-with
+        try:
+            magic, version, codec_id = SFZ_HEADER.unpack(
+                self.__handle.read(SFZ_HEADER.size))
+            self.__handle.seek(-SFZ_TRAILER.size, os.SEEK_END)
+            index_offset, n_blocks, trailer_magic = SFZ_TRAILER.unpack(
+                self.__handle.read(SFZ_TRAILER.size))
+        except (struct.error, OSError) as exc:
+            self.__handle.close()
+            raise ValueError(f'{path} is not an SFZ container') from exc
+        codecs = {value: name for name, value in CODECS.items()}
+        if magic != SFZ_MAGIC or trailer_magic != SFZ_MAGIC or \
+                version != SFZ_VERSION or codec_id not in codecs:
+            self.__handle.close()
+            raise ValueError(f'{path} is not a readable SFZ container')
+        self.codec = codecs[codec_id]
+        self.__decompress = DECOMPRESSORS[self.codec]
+        self.__handle.seek(index_offset)
+        self.blocks = np.frombuffer(
+            self.__handle.read(n_blocks * BLOCK_DTYPE.itemsize),
+            dtype=BLOCK_DTYPE)
+        if len(self.blocks) != n_blocks:
+            self.__handle.close()
+            raise ValueError(f'{path} has a truncated block index')
+
+    def __enter__(self) -> SfzFile:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the file
+        """
+        self.__handle.close()
+
+    @property
+    def size(self) -> int:
+        """Size of the uncompressed SFP data in bytes
+        """
+        if len(self.blocks) == 0:
+            return 0
+        return int(self.blocks['offset'][-1] + self.blocks['size'][-1])
+
+    def read_block(self, block: int) -> bytes:
+        """Decompresses one block
+
+        Args:
+            block (int): Block number
+
+        Raises:
+            ValueError: The block does not match its CRC32
+
+        Returns:
+            bytes: SFP bytes of the block
+        """
+        row = self.blocks[block]
+        self.__handle.seek(int(row['file_offset']))
+        try:
+            with stage('decompress_block') as timer:
+                data = self.__decompress(
+                    self.__handle.read(int(row['compressed_size'])))
+                timer.add(items=1, nbytes=len(data))
+        except (zlib.error, lzma.LZMAError) as exc:
+            raise ValueError(
+                f'Block {block} of {self.__path} is corrupt') from exc
+        if len(data) != row['size'] or binascii.crc32(data) != row['crc32']:
+            raise ValueError(f'Block {block} of {self.__path} is corrupt')
+        return data
+
+    def iter_blocks(self, blocks: Optional[Iterable[int]] = None
+                    ) -> Iterator[bytes]:
+        """Decompresses blocks in order
+
+        Args:
+            blocks (Optional[Iterable[int]], optional): Block numbers.
+            Defaults to every block.
+
+        Yields:
+            bytes: SFP bytes of each block
+        """
+        if blocks is None:
+            blocks = range(len(self.blocks))
+        for block in blocks:
+            yield self.read_block(block)
+
+    def read(self) -> bytes:
+        """Decompresses the whole file
+
+        Returns:
+            bytes: SFP bytes
+        """
+        return b''.join(self.iter_blocks())
+
+    def blocks_between(self,
+                       start: Optional[float] = None,
+                       end: Optional[float] = None) -> np.ndarray:
+        """Finds the blocks that may hold ensembles in a time range
+
+        Args:
+            start (Optional[float], optional): Inclusive start timestamp (s).
+            Defaults to unbounded.
+            end (Optional[float], optional): Exclusive end timestamp (s).
+            Defaults to unbounded.
+
+        Returns:
+            np.ndarray: Block numbers in file order
+        """
+        mask = self.blocks['ensembles'] > 0
+        if start is not None:
+            mask &= self.blocks['max_ds'] >= start * 10
+        if end is not None:
+            mask &= self.blocks['min_ds'] < end * 10
+        return np.flatnonzero(mask)
+
+    def read_window(self,
+                    *,
+                    data_types: Optional[Iterable[int]] = None,
+                    start: Optional[float] = None,
+                    end: Optional[float] = None) -> scd.ColumnarEnsembles:
+        """Decodes only the ensembles matching a data type and time selection
+
+        Only the blocks overlapping the time range are decompressed.
+
+        Args:
+            data_types (Optional[Iterable[int]], optional): Data types to
+            keep. Defaults to all.
+            start (Optional[float], optional): Inclusive start timestamp (s).
+            Defaults to unbounded.
+            end (Optional[float], optional): Exclusive end timestamp (s).
+            Defaults to unbounded.
+
+        Returns:
+            scd.ColumnarEnsembles: Selected ensembles, with offsets into the
+            uncompressed SFP data
+        """
+        if data_types is not None:
+            data_types = list(data_types)
+        parts = []
+        blocks = self.blocks_between(start, end)
+        for block, data in zip(blocks, self.iter_blocks(blocks)):
+            index = scd.build_index(data)
+            mask = np.ones(len(index), dtype=bool)
+            if data_types is not None:
+                mask &= np.isin(index['dataType'], data_types)
+            if start is not None:
+                mask &= index['timestamp_ds'] >= start * 10
+            if end is not None:
+                mask &= index['timestamp_ds'] < end * 10
+            part = scd.decode_at(data, index['offset'][mask].astype(np.int64))
+            part.offsets += int(self.blocks['offset'][block])
+            parts.append(part)
+        return scd.ColumnarEnsembles.concat(parts)
+
+
+def read_sfp(path: Path) -> bytes:
+    """Reads the SFP bytes of a raw or compressed SFP file
+
+    Args:
+        path (Path): SFP or SFZ path
+
+    Returns:
+        bytes: SFP bytes
+    """
+    if is_compressed(path):
+        with SfzFile(path) as sfz:
+            return sfz.read()
+    return path.read_bytes()
@@ -2,111 +2,156 @@
 '''
 import logging
 import struct
-from typing import Callable, Dict, List, Tuple, Union
+from dataclasses import dataclass, field
+from typing import (Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
 
+import numpy as np
 import pandas as pd
 
-__parserTable = {
-    1: {
-        'fmt': '<hb',
-        'names': ['temp', 'water']
-    },
-    2: {
-        'fmt': '<bbb',
-        'names': ['rawXAcc', 'rawYAcc', 'rawZAcc']
-    },
-    3: {
-        'fmt': '',
-        'names': []
-    },
-    4: {
-        'fmt': '<hbbbb',
-        'names': ['temp', 'water', 'rawXAcc', 'rawYAcc', 'rawZAcc']
-    },
-    5: {
-        'fmt': '',
-        'names': []
-    },
-    6: {
-        'fmt': '<hbbbbii',
-        'names': ['temp', 'water', 'rawXAcc', 'rawYAcc', 'rawZAcc', 'lat', 'lon']
-    },
-    7: {
-        'fmt': '<H',
-        'names': ['battery']
-    },
-    8: {
-        'fmt': '<hbI',
-        'names': ['temp', 'water', 'time']
-    },
-    9: {
-        'fmt': '<hhhhhhhhh',
-        'names': ['xAcc', 'yAcc', 'zAcc', 'xGyro', 'yGyro', 'zGyro', 'xMag', 'yMag', 'zMag']
-    },
-    10: {
-        'fmt': '<hbhhhhhhhhh',
-        'names': ['temp', 'water', 'xAcc', 'yAcc', 'zAcc', 'xGyro', 'yGyro',
-                  'zGyro', 'xMag', 'yMag', 'zMag']
-    },
-    11: {
-        'fmt': '<hbhhhhhhhhhii',
-        'names': ['temp', 'water', 'xAcc', 'yAcc', 'zAcc', 'xGyro', 'yGyro',
-                  'zGyro', 'xMag', 'yMag', 'zMag', 'lat', 'lon']
-    },
-    0x0C: {
-        'fmt': '<hhhhhhhhh',
-        'names': ['xAccQ10', 'yAccQ10', 'zAccQ10', 'xAngQ7', 'yAngQ7', 'zAngQ7',
-                  'xMagQ3', 'yMagQ3', 'zMagQ3']
-    }
-}
-
-
-def strip_padding(packet: bytes) -> bytes:
+from smartfin_tools.profiling import stage
+# si_conversions is re-exported
+from smartfin_tools.schema import (  # pylint: disable=unused-import
+    TEXT_DATA_TYPE, ensemble_steps, get_schema, get_unit, max_ensemble_size,
+    schemas, si_conversions, valid_types)
+
+__SCAN_BLOCK = 1 << 16
+
+# Bump whenever decoded output changes, to invalidate persisted decodes
+DECODER_VERSION = 1
+
+COUNTER_PERIOD_DS = 1 << 20
+# Largest timestamp step between consecutive ensembles that resync trusts
+RESYNC_MAX_GAP_DS = 600
+# Number of chained headers that must agree before resuming after damage
+RESYNC_CONFIRM = 4
+
+
+@dataclass
+class StripStats:
+    """Statistics for a padding strip pass
+    """
+    bytes_removed: int = 0
+    ensembles_kept: int = 0
+    unknown_types: Dict[int, int] = field(default_factory=dict)
+
+    def update(self, other: 'StripStats') -> None:
+        """Accumulates the statistics of another pass
+
+        Args:
+            other (StripStats): Statistics to add
+        """
+        self.bytes_removed += other.bytes_removed
+        self.ensembles_kept += other.ensembles_kept
+        for data_type, count in other.unknown_types.items():
+            self.unknown_types[data_type] = \
+                self.unknown_types.get(data_type, 0) + count
+
+
+def _strip_runs(buf: np.ndarray,
+                *,
+                stop_at_padding: bool,
+                resync: bool = False
+                ) -> Tuple[List[Tuple[int, int]], StripStats]:
+    """Finds the byte runs to keep when stripping padding
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        stop_at_padding (bool): Treat everything from the first padding byte
+        onwards as padding
+        resync (bool, optional): Jump over damaged regions. Defaults to False.
+
+    Returns:
+        Tuple[List[Tuple[int, int]], StripStats]: Contiguous `[start, stop)`
+        runs of valid ensembles, and pass statistics
+    """
+    offsets, end, _ = _scan_headers(buf, resync=resync)
+    data_types = buf[offsets] & 0x0F
+    stops = np.minimum(np.append(offsets[1:], end), len(buf))
+    if stop_at_padding:
+        padding = np.flatnonzero(data_types == 0)
+        if len(padding) > 0:
+            offsets = offsets[:padding[0]]
+            data_types = data_types[:padding[0]]
+            stops = stops[:padding[0]]
+    valid = valid_types()[data_types]
+    unknown_types, unknown_counts = np.unique(
+        data_types[~valid & (data_types != 0)], return_counts=True)
+    stats = StripStats(
+        ensembles_kept=int(valid.sum()),
+        unknown_types=dict(zip(unknown_types.tolist(),
+                               unknown_counts.tolist()))
+    )
+    offsets = offsets[valid]
+    stops = stops[valid]
+
+    # Merge back to back ensembles into runs so each run is copied once
+    breaks = np.flatnonzero(offsets[1:] != stops[:-1]) + 1
+    run_starts = offsets[np.concatenate(([0], breaks))] if len(offsets) \
+        else offsets
+    run_stops = stops[np.append(breaks - 1, len(stops) - 1)] if len(stops) \
+        else stops
+    runs = list(zip(run_starts.tolist(), run_stops.tolist()))
+    stats.bytes_removed = len(buf) - int((run_stops - run_starts).sum())
+    return runs, stats
+
+
+def strip_padding(packet: bytes, *, stats: StripStats | None = None) -> bytes:
     """Strips any padding from the packet.
 
     This padding is defined to be any bytes after the end of valid ensembles. Do
     not run this on packets with bridged ensembles (i.e. ensembles that cross
-    packet boundaries)
+    packet boundaries).  Headers of unknown data types are dropped.
 
     Args:
         packet (bytes): Binary packet blob of multiple ensembles
+        stats (StripStats | None, optional): Statistics to accumulate this pass
+        into. Defaults to None.
 
     Returns:
         bytes: Stripped packet of ensembles
     """
-    logger = logging.getLogger('Smartfin Decoder')
-    stripped_data = b''
-    idx = 0
-    while idx < len(packet):
-        start_idx = idx
-        if len(packet) - idx < 3:
-            break
-        datetime_byte = packet[idx]
-        idx += 1
-        # time_msb: int = struct.unpack('<H', packet[idx:idx + 2])[0]
-        idx += 2
-        # time_ds = ((datetime_byte & 0xF0) >> 4) | (time_msb << 4)
-        data_type = datetime_byte & 0x0F
-        if data_type in __parserTable:
-            # can use from parser table
-            parse_params = __parserTable[data_type]
-            expected_len = struct.calcsize(parse_params['fmt'])
-            idx += expected_len
-            stripped_data += packet[start_idx:idx]
-        elif data_type == 0:
-            # Padding
-            logger.warning('Unknown data type: 0 at index %d', idx)
-            stripped_data += packet[start_idx:idx-3]
-            return stripped_data
-        elif data_type == 0x0F:
-            # text
-            text_len = packet[idx]
-            idx += 1
-            idx += text_len
-            stripped_data += packet[start_idx:idx]
-        else:
-            logger.warning('Unknown data type: %d', data_type)
-    return stripped_data
+    view = memoryview(packet)
+    runs, pass_stats = _strip_runs(np.frombuffer(view, dtype=np.uint8),
+                                   stop_at_padding=True)
+    if pass_stats.unknown_types:
+        logger = logging.getLogger('Smartfin Decoder')
+        logger.warning('Unknown data types: %s', pass_stats.unknown_types)
+    if stats is not None:
+        stats.update(pass_stats)
+    return b''.join(view[start:stop] for start, stop in runs)
+
+
+def strip_padding_inplace(buffer: bytearray,
+                          *,
+                          resync: bool = False) -> StripStats:
+    """Strips padding runs and unknown headers from a whole stream in place
+
+    Unlike `strip_padding`, padding does not end the stream, so this can be
+    run over a whole SFP file's worth of concatenated packets.  Runs in linear
+    time and without copying the buffer.
+
+    Args:
+        buffer (bytearray): Stream of ensembles, compacted and truncated in
+        place
+        resync (bool, optional): Also drop damaged regions, see
+        `decode_columns`. Defaults to False.
+
+    Returns:
+        StripStats: Pass statistics
+    """
+    runs, stats = _strip_runs(np.frombuffer(buffer, dtype=np.uint8),
+                              stop_at_padding=False,
+                              resync=resync)
+    view = memoryview(buffer)
+    write_idx = 0
+    for start, stop in runs:
+        # Runs only ever move towards the front
+        view[write_idx:write_idx + stop - start] = view[start:stop]
+        write_idx += stop - start
+    view.release()
+    del buffer[write_idx:]
+    return stats
 
 
 def decode_packet(packet: bytes) -> List[Dict[str, Union[int, float]]]:
@@ -119,57 +164,46 @@ def decode_packet(packet: bytes) -> List[Dict[str, Union[int, float]]]:
         List[Dict[str, Union[int, float]]]: List of data blobs
     """
     logger = logging.getLogger("Smartfin Decoder")
+    parsers = schemas()
     packet_list = []
-    blob_list: List[bytes] = []
-    packet_counter = 0
     idx = 0
-    start_idx = 0
-    while idx < len(packet):
-        start_idx = idx
-        if len(packet) - idx < 3:
-            break
-        next_candidate = packet[idx:]
-        timestamp, data_type = extract_header(next_candidate)
-        idx += 3
-        if data_type in __parserTable:
-            # can use from parser table
-            parse_params = __parserTable[data_type]
-            expected_len = struct.calcsize(parse_params['fmt'])
-            assert len(packet) - idx >= expected_len
-            ens_payload = packet[idx:idx + expected_len]
-            idx += expected_len
-            ens_fields = struct.unpack(parse_params['fmt'], ens_payload)
-            ensemble = {}
-            assert (len(parse_params['names']) == len(ens_fields))
-            for i in range(len(parse_params['names'])):
-                ensemble[parse_params['names'][i]] = ens_fields[i]
-            ensemble['timestamp'] = timestamp
-            ensemble['dataType'] = data_type
-            packet_list.append(ensemble)
-            binary_ensemble = packet[start_idx:idx]
-            blob_list.append(binary_ensemble)
-            packet_counter += 1
-        elif data_type == 0:
-            # Padding
-            # logger.warning('Unknown data type: 0 at index %d', idx)
-            idx -= 2
-            continue
-        elif data_type == 0x0F:
-            # text
-            text_len = packet[idx]
-            assert len(packet) - idx >= text_len
-            idx += 1
-            text = packet[idx:idx + text_len].decode()
-            idx += text_len
-            ensemble = {}
-            ensemble['text'] = text
-            ensemble['timestamp'] = timestamp
-            ensemble['dataType'] = data_type
-            packet_list.append(ensemble)
-            blob_list.append(packet[start_idx:idx])
-            packet_counter += 1
-        else:
-            logger.warning('Unknown data type: %d', data_type)
+    with stage('decode_packet') as timer:
+        while idx < len(packet):
+            if len(packet) - idx < 3:
+                break
+            next_candidate = packet[idx:]
+            timestamp, data_type = extract_header(next_candidate)
+            idx += 3
+            if data_type in parsers:
+                # can use from schema registry
+                schema = parsers[data_type]
+                expected_len = schema.size
+                assert len(packet) - idx >= expected_len
+                ens_fields = schema.struct.unpack_from(packet, idx)
+                idx += expected_len
+                ensemble = dict(zip(schema.names, ens_fields))
+                ensemble['timestamp'] = timestamp
+                ensemble['dataType'] = data_type
+                packet_list.append(ensemble)
+            elif data_type == 0:
+                # Padding
+                idx -= 2
+                continue
+            elif data_type == 0x0F:
+                # text
+                text_len = packet[idx]
+                assert len(packet) - idx >= text_len
+                idx += 1
+                text = packet[idx:idx + text_len].decode()
+                idx += text_len
+                ensemble = {}
+                ensemble['text'] = text
+                ensemble['timestamp'] = timestamp
+                ensemble['dataType'] = data_type
+                packet_list.append(ensemble)
+            else:
+                logger.warning('Unknown data type: %d', data_type)
+        timer.add(items=len(packet_list), nbytes=len(packet))
     return packet_list
 
 
@@ -190,43 +224,965 @@ def extract_header(packet: bytes) -> Tuple[float, int]:
     return timestamp, data_type
 
 
-si_conversions: Dict[str, Tuple[str, Callable]] = {
-    'timestamp': ('Timestamp (s)', lambda x: x),
-    'temp': ('Temperature (C)', lambda x: x / 128),
-    'water': ('Water Detect', lambda x: x > 0),
-    'xAcc': ('X Acceleration (m/s^2)', lambda x: x / 16384),
-    'yAcc': ('Y Acceleration (m/s^2)', lambda x: x / 16384),
-    'zAcc': ('Z Acceleration (m/s^2)', lambda x: x / 16384),
-    'xGyro': ('X Angular Velocity (deg/s)', lambda x: x / 131.072),
-    'yGyro': ('Y Angular Velocity (deg/s)', lambda x: x / 131.072),
-    'zGyro': ('Z Angular Velocity (deg/s)', lambda x: x / 131.072),
-    'xMag': ('X Magnetic Field (uT)', lambda x: x * 0.15),
-    'yMag': ('Y Magnetic Field (uT)', lambda x: x * 0.15),
-    'zMag': ('Z Magnetic Field (uT)', lambda x: x * 0.15),
-    'xAccQ10': ('X Acceleration (m/s^2)', lambda x: x / 1024),
-    'yAccQ10': ('Y Acceleration (m/s^2)', lambda x: x / 1024),
-    'zAccQ10': ('Z Acceleration (m/s^2)', lambda x: x / 1024),
-    'xGyroQ7': ('X Angular Velocity (deg/s)', lambda x: x / 128),
-    'yGyroQ7': ('Y Angular Velocity (deg/s)', lambda x: x / 128),
-    'zGyroQ7': ('Z Angular Velocity (deg/s)', lambda x: x / 128),
-    'xMagQ3': ('X Magnetic Field (uT)', lambda x: x / 8),
-    'yMagQ3': ('Y Magnetic Field (uT)', lambda x: x / 8),
-    'zMagQ3': ('Z Magnetic Field (uT)', lambda x: x / 8),
-}
-
-def convert_to_si(df: pd.DataFrame) -> pd.DataFrame:
+@dataclass(frozen=True)
+class EnsembleFilter:
+    """Ensemble selection pushed down into the decoder
+
+    Data type and timestamp predicates are evaluated on the headers, so
+    filtered out ensembles are never unpacked.  Column projection only
+    gathers the selected payload fields, and unless `data_types` is given,
+    drops data types that carry none of them.
+    """
+    data_types: Optional[FrozenSet[int]] = None
+    columns: Optional[Tuple[str, ...]] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        if self.data_types is not None:
+            object.__setattr__(self, 'data_types', frozenset(self.data_types))
+        if self.columns is not None:
+            object.__setattr__(self, 'columns', tuple(self.columns))
+
+    def type_mask(self) -> np.ndarray:
+        """Computes which data type nibbles are kept
+
+        Returns:
+            np.ndarray: True for kept data types, indexed by data type
+        """
+        mask = np.ones(16, dtype=bool)
+        if self.data_types is not None:
+            mask[:] = False
+            mask[list(self.data_types)] = True
+        elif self.columns is not None:
+            mask[:] = False
+            for data_type, schema in schemas().items():
+                mask[data_type] = any(name in self.columns
+                                      for name in schema.names)
+            mask[TEXT_DATA_TYPE] = 'text' in self.columns
+        return mask
+
+    def header_mask(self, data_types: np.ndarray,
+                    timestamp_ds: np.ndarray) -> np.ndarray:
+        """Evaluates the header predicates
+
+        Args:
+            data_types (np.ndarray): Ensemble data types
+            timestamp_ds (np.ndarray): Ensemble timestamps (ds)
+
+        Returns:
+            np.ndarray: True for kept ensembles
+        """
+        mask = self.type_mask()[data_types]
+        if self.start is not None:
+            mask &= timestamp_ds >= self.start * 10
+        if self.end is not None:
+            mask &= timestamp_ds < self.end * 10
+        return mask
+
+    def project(self, dtype: np.dtype) -> np.dtype:
+        """Projects a payload dtype onto the selected columns
+
+        Args:
+            dtype (np.dtype): Full payload dtype
+
+        Returns:
+            np.dtype: Packed dtype of the selected fields
+        """
+        if self.columns is None:
+            return dtype
+        names = [name for name in dtype.names or () if name in self.columns]
+        return np.dtype({'names': names,
+                         'formats': [dtype[name] for name in names]})
+
+
+@dataclass
+class ColumnarEnsembles:
+    """Columnar decode result
+
+    Ensembles are grouped by data type.  `tables` holds one structured array of
+    payload fields per data type, with rows in decode order.  Text ensembles
+    are stored under `TEXT_DATA_TYPE` with a single `text` field.  The
+    remaining arrays have one entry per ensemble in decode order, except
+    `skipped`, which holds the `[start, stop)` byte spans jumped over when
+    decoding in resync mode.
+    """
+    tables: Dict[int, np.ndarray]
+    data_type: np.ndarray
+    timestamp_ds: np.ndarray
+    offsets: np.ndarray
+    skipped: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 2), dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.data_type)
+
+    @classmethod
+    def empty(cls) -> 'ColumnarEnsembles':
+        """Creates a result with no ensembles
+
+        Returns:
+            ColumnarEnsembles: Empty result
+        """
+        return cls(
+            tables={},
+            data_type=np.zeros(0, dtype=np.uint8),
+            timestamp_ds=np.zeros(0, dtype=np.uint32),
+            offsets=np.zeros(0, dtype=np.int64)
+        )
+
+    @classmethod
+    def concat(cls, parts: Iterable['ColumnarEnsembles']
+               ) -> 'ColumnarEnsembles':
+        """Concatenates results in order
+
+        Args:
+            parts (Iterable[ColumnarEnsembles]): Results to join
+
+        Returns:
+            ColumnarEnsembles: Joined result
+        """
+        parts = [part for part in parts
+                 if len(part) > 0 or len(part.skipped) > 0]
+        if not parts:
+            return cls.empty()
+        data_types = sorted({data_type
+                             for part in parts for data_type in part.tables})
+        return cls(
+            tables={
+                data_type: np.concatenate([part.tables[data_type]
+                                           for part in parts
+                                           if data_type in part.tables])
+                for data_type in data_types
+            },
+            data_type=np.concatenate([part.data_type for part in parts]),
+            timestamp_ds=np.concatenate(
+                [part.timestamp_ds for part in parts]),
+            offsets=np.concatenate([part.offsets for part in parts]),
+            skipped=np.concatenate([part.skipped for part in parts])
+        )
+
+    def select(self, mask: np.ndarray) -> 'ColumnarEnsembles':
+        """Selects a subset of ensembles, keeping decode order
+
+        Args:
+            mask (np.ndarray): Boolean mask with one entry per ensemble
+
+        Returns:
+            ColumnarEnsembles: Selected ensembles
+        """
+        tables = {}
+        for data_type, table in self.tables.items():
+            type_mask = mask[self.data_type == data_type]
+            if type_mask.any():
+                tables[data_type] = table[type_mask]
+        return ColumnarEnsembles(
+            tables=tables,
+            data_type=self.data_type[mask],
+            timestamp_ds=self.timestamp_ds[mask],
+            offsets=self.offsets[mask],
+            skipped=self.skipped
+        )
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        """Ensemble timestamps in seconds, as reported by `extract_header`
+        """
+        return self.timestamp_ds / 10.
+
+    def column_names(self) -> List[str]:
+        """Column names in the order `decode_packet` would produce them
+
+        Returns:
+            List[str]: Column names
+        """
+        names: List[str] = []
+        for data_type in pd.unique(self.data_type):
+            fields = self.tables[int(data_type)].dtype.names or ()
+            for name in (*fields, 'timestamp', 'dataType'):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def to_dataframe(self, *, compact: bool = False) -> pd.DataFrame:
+        """Builds the wide DataFrame without going through a list of dicts
+
+        By default the result is identical to
+        `pd.DataFrame(decode_packet(packet))`.  In compact mode, columns keep
+        their schema dtypes (e.g. int16 temperature, uint8 data type),
+        columns missing for some data types use nullable extension dtypes
+        instead of being upcast to float64, and timestamps are kept as uint32
+        deciseconds in `timestamp_ds` instead of float64 seconds.
+
+        Args:
+            compact (bool, optional): Use the smallest correct dtypes.
+            Defaults to False.
+
+        Returns:
+            pd.DataFrame: One row per ensemble
+        """
+        with stage('build_dataframe') as timer:
+            columns: Dict[str, Union[np.ndarray,
+                                     pd.api.extensions.ExtensionArray]] = {
+                'timestamp': self.timestamp_ds.copy() if compact
+                else self.timestamp,
+                'dataType': self.data_type.copy() if compact
+                else self.data_type.astype(np.int64),
+            }
+            for name in self.column_names():
+                if name not in columns:
+                    columns[name] = self.__wide_column(name, compact)
+            time_column = 'timestamp_ds' if compact else 'timestamp'
+            df = pd.DataFrame({time_column if name == 'timestamp' else name:
+                               columns[name]
+                               for name in self.column_names()})
+            timer.add(items=len(df))
+        return df
+
+    def __wide_column(self, name: str, compact: bool
+                      ) -> Union[np.ndarray, pd.api.extensions.ExtensionArray]:
+        owners = [data_type for data_type, table in self.tables.items()
+                  if name in (table.dtype.names or ())]
+        present = np.isin(self.data_type, owners)
+        field_dtype = np.result_type(*(self.tables[data_type].dtype[name]
+                                       for data_type in owners)
+                                     ).newbyteorder('=')
+        kind = field_dtype.kind
+        if kind in 'OS':
+            # Text and byte strings
+            dtype = np.dtype(object)
+        elif compact:
+            dtype = field_dtype
+        else:
+            dtype = np.dtype({'b': bool, 'f': np.float64}.get(kind, np.int64))
+        complete = present.all()
+        if complete or compact:
+            column = np.zeros(len(self), dtype=dtype)
+        else:
+            column = np.full(len(self), np.nan,
+                             dtype=object if dtype.kind in 'Ob'
+                             else np.float64)
+        for data_type in owners:
+            column[self.data_type == data_type] = \
+                self.tables[data_type][name]
+        if compact and not complete:
+            if kind in 'iu':
+                return pd.arrays.IntegerArray(column, ~present)
+            if kind == 'b':
+                return pd.arrays.BooleanArray(column, ~present)
+            column[~present] = np.nan
+        return column
+
+
+def _next_offsets_at(buf: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Computes the offset of the following ensemble for each candidate
+    header position
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        positions (np.ndarray): Candidate header positions
+
+    Returns:
+        np.ndarray: Next header offset for each candidate position
+    """
+    data_types = buf[positions] & 0x0F
+    steps = ensemble_steps()[data_types]
+    text_idx = np.flatnonzero(data_types == TEXT_DATA_TYPE)
+    if len(text_idx) > 0:
+        len_pos = positions[text_idx] + 3
+        in_buf = len_pos < len(buf)
+        steps[text_idx[in_buf]] += buf[len_pos[in_buf]]
+    next_offsets = steps + positions
+    if len(text_idx) > 0:
+        # Length byte is missing, so the ensemble is cut off
+        next_offsets[text_idx[~in_buf]] = len(buf) + 1
+    return next_offsets
+
+
+def _next_offsets(buf: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Computes the offset of the following ensemble for every candidate
+    header position in `[start, stop)`
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        start (int): First candidate position
+        stop (int): End of candidate positions
+
+    Returns:
+        np.ndarray: Next header offset for each candidate position
+    """
+    return _next_offsets_at(buf, np.arange(start, stop, dtype=np.int64))
+
+
+def _timestamps_at(buf: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Reads the header timestamps at the given positions
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        positions (np.ndarray): Header positions
+
+    Returns:
+        np.ndarray: Timestamps (ds)
+    """
+    time_msb = buf[positions + 1].astype(np.int64) | \
+        (buf[positions + 2].astype(np.int64) << 8)
+    return (buf[positions] >> 4).astype(np.int64) | (time_msb << 4)
+
+
+def _counter_gaps(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Computes timestamp distances, allowing for counter rollover
+
+    Args:
+        left (np.ndarray): Timestamps (ds)
+        right (np.ndarray): Timestamps (ds)
+
+    Returns:
+        np.ndarray: Distances (ds)
+    """
+    gaps = np.abs(left - right)
+    return np.minimum(gaps, COUNTER_PERIOD_DS - gaps)
+
+
+def _resync_candidates(buf: np.ndarray,
+                       start: int,
+                       stop: int,
+                       *,
+                       final: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the headers in `[start, stop)` that decoding can resume at
+    after damage
+
+    A header is confirmed when it and the `RESYNC_CONFIRM - 1` headers
+    chained after it all have valid data types, with each timestamp within
+    `RESYNC_MAX_GAP_DS` of the one before.  A chain that runs off the end of
+    the buffer first is unresolved.  Unresolved chains are accepted at the
+    end of the data, but could still fail once more of a stream arrives.
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        start (int): First candidate position
+        stop (int): End of candidate positions
+        final (bool): No data follows the buffer
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Candidate positions, and whether each
+        is unresolved
+    """
+    last_header = len(buf) - 2
+    # Chains from candidates before `stop` stay within `reach` unless they
+    # run off the end of the buffer
+    reach = min(stop + RESYNC_CONFIRM * max_ensemble_size(), last_header)
+    positions = np.arange(start, reach, dtype=np.int64)
+    next_offsets = _next_offsets_at(buf, positions)
+    timestamp_ds = _timestamps_at(buf, positions)
+    valid = valid_types()[buf[start:reach] & 0x0F]
+
+    chain = np.arange(stop - start)
+    confirmed = valid[chain].copy()
+    ended = np.zeros(len(chain), dtype=bool)
+    for _ in range(RESYNC_CONFIRM - 1):
+        following = next_offsets[chain]
+        ended |= following >= last_header
+        following = np.where(ended, chain, following - start)
+        continuous = _counter_gaps(timestamp_ds[following],
+                                   timestamp_ds[chain]) <= RESYNC_MAX_GAP_DS
+        confirmed &= ended | (valid[following] & continuous)
+        chain = following
+    unresolved = ended & confirmed & (not final)
+    return positions[:len(chain)][confirmed], unresolved[confirmed]
+
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> np.ndarray:
+    """Merges back to back skipped spans
+
+    Args:
+        spans (List[Tuple[int, int]]): `[start, stop)` spans in order
+
+    Returns:
+        np.ndarray: Merged spans, shape (n, 2)
+    """
+    merged: List[List[int]] = []
+    for span_start, span_stop in spans:
+        if merged and merged[-1][1] == span_start:
+            merged[-1][1] = span_stop
+        elif span_stop > span_start:
+            merged.append([span_start, span_stop])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+
+@dataclass
+class _ResyncState:
+    """Resync progress carried from one scan of a stream to the next
+    """
+    last_ds: Optional[int] = None
+    damaged: bool = True
+
+
+def _scan_headers(buf: np.ndarray,
+                  start: int = 0,
+                  *,
+                  resync: bool = False,
+                  final: bool = True,
+                  state: Optional[_ResyncState] = None
+                  ) -> Tuple[np.ndarray, int, np.ndarray]:
+    """Walks the ensemble chain the same way `decode_packet` does
+
+    Every visited header position is returned, including padding and unknown
+    types.  Ensemble lengths are computed in bulk, so only the chain walk
+    itself happens in Python.
+
+    In resync mode, a header is only followed if it has a valid data type and
+    its timestamp is within `RESYNC_MAX_GAP_DS` of the previous ensemble.
+    Anything else is damage, and decoding resumes at the next header
+    confirmed by `_resync_candidates`, as it also does at the start of a
+    stream.  The jumped over bytes are reported as skipped spans.
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        start (int, optional): Starting offset. Defaults to 0.
+        resync (bool, optional): Jump over damaged regions. Defaults to False.
+        final (bool, optional): No data follows the buffer.  Otherwise, a
+        resync search that reaches headers which cannot be confirmed yet stops
+        there. Defaults to True.
+        state (Optional[_ResyncState], optional): Resync progress from the
+        scan of the preceding data, updated in place. Defaults to the start of
+        a stream.
+
+    Returns:
+        Tuple[np.ndarray, int, np.ndarray]: Visited header offsets, offset
+        following the last visited ensemble, and skipped `[start, stop)`
+        spans.  The offset exceeds `len(buf)` if the last ensemble is cut off.
+    """
+    with stage('scan_headers') as timer:
+        last_header = len(buf) - 2
+        valid = valid_types()
+        chunks: List[np.ndarray] = []
+        spans: List[Tuple[int, int]] = []
+        if state is None:
+            state = _ResyncState()
+        last_ds = state.last_ds
+        damage_start = start if resync and state.damaged else None
+        idx = start
+        while idx < last_header:
+            block_start = idx
+            block_stop = min(idx + __SCAN_BLOCK, last_header)
+            next_idx = _next_offsets(buf, block_start, block_stop).tolist()
+            visited: List[int] = []
+            append = visited.append
+            if not resync:
+                while idx < block_stop:
+                    append(idx)
+                    idx = next_idx[idx - block_start]
+                chunks.append(np.array(visited, dtype=np.int64))
+                continue
+
+            positions = np.arange(block_start, block_stop, dtype=np.int64)
+            is_valid = valid[buf[block_start:block_stop] & 0x0F].tolist()
+            block_ds = _timestamps_at(buf, positions).tolist()
+            candidates: Optional[np.ndarray] = None
+            unresolved = np.zeros(0, dtype=bool)
+            while idx < block_stop:
+                if damage_start is None and is_valid[idx - block_start]:
+                    ensemble_ds = block_ds[idx - block_start]
+                    gap = abs(ensemble_ds - last_ds) if last_ds is not None \
+                        else 0
+                    if min(gap, COUNTER_PERIOD_DS - gap) <= \
+                            RESYNC_MAX_GAP_DS:
+                        append(idx)
+                        last_ds = ensemble_ds
+                        idx = next_idx[idx - block_start]
+                        continue
+                if damage_start is None:
+                    damage_start = idx
+                if candidates is None:
+                    candidates, unresolved = _resync_candidates(
+                        buf, block_start, block_stop, final=final)
+                first = int(np.searchsorted(candidates, idx))
+                if first == len(candidates):
+                    # Keep searching in the next block
+                    idx = block_stop
+                elif unresolved[first]:
+                    # Wait for more of the stream to confirm this header
+                    idx = int(candidates[first])
+                    break
+                else:
+                    idx = int(candidates[first])
+                    spans.append((damage_start, idx))
+                    damage_start = None
+                    last_ds = None
+            chunks.append(np.array(visited, dtype=np.int64))
+            if damage_start is not None and idx < block_stop:
+                break
+        if damage_start is not None:
+            if final:
+                idx = max(idx, len(buf))
+            spans.append((damage_start, min(idx, len(buf))))
+        state.last_ds = last_ds
+        state.damaged = damage_start is not None and not final
+        offsets = np.concatenate(chunks) if chunks \
+            else np.zeros(0, dtype=np.int64)
+        timer.add(items=len(offsets), nbytes=min(idx, len(buf)) - start)
+    return offsets, idx, _merge_spans(spans)
+
+
+def _gather_payload(buf: np.ndarray,
+                    positions: np.ndarray,
+                    dtype: np.dtype) -> np.ndarray:
+    """Gathers fixed size payloads into a structured array
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        positions (np.ndarray): Payload start offsets
+        dtype (np.dtype): Payload dtype
+
+    Returns:
+        np.ndarray: Structured array with one row per payload
+    """
+    if dtype.itemsize == 0:
+        return np.zeros(len(positions), dtype=dtype)
+    byte_idx = positions[:, np.newaxis] + np.arange(dtype.itemsize)
+    return buf[byte_idx].view(dtype).reshape(-1)
+
+
+def _parse_headers(buf: np.ndarray,
+                   offsets: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parses the headers at the given offsets, dropping padding and unknown
+    data types
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        offsets (np.ndarray): Header offsets from `_scan_headers`
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Offsets, data types and
+        timestamps (ds) of the valid ensembles
+    """
+    logger = logging.getLogger('Smartfin Decoder')
+    data_types = buf[offsets] & 0x0F
+    valid = valid_types()[data_types]
+    unknown_types, unknown_counts = np.unique(
+        data_types[~valid & (data_types != 0)], return_counts=True)
+    for data_type, count in zip(unknown_types, unknown_counts):
+        logger.warning('Unknown data type: %d (%d occurrences)',
+                       data_type, count)
+    offsets = offsets[valid]
+    data_types = data_types[valid]
+
+    time_msb = buf[offsets + 1].astype(np.uint32) | \
+        (buf[offsets + 2].astype(np.uint32) << 8)
+    timestamp_ds = ((buf[offsets] >> 4).astype(np.uint32)) | (time_msb << 4)
+    return offsets, data_types, timestamp_ds
+
+
+def _gather_fields(buf: np.ndarray,
+                   positions: np.ndarray,
+                   dtype: np.dtype,
+                   projection: np.dtype) -> np.ndarray:
+    """Gathers only the projected fields of fixed size payloads
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        positions (np.ndarray): Payload start offsets
+        dtype (np.dtype): Full payload dtype
+        projection (np.dtype): Projected payload dtype
+
+    Returns:
+        np.ndarray: Structured array of the projected fields
+    """
+    if projection == dtype:
+        return _gather_payload(buf, positions, dtype)
+    table = np.empty(len(positions), dtype=projection)
+    for name in projection.names:
+        field_dtype, field_offset = dtype.fields[name][:2]
+        table[name] = _gather_payload(buf, positions + field_offset,
+                                      field_dtype)
+    return table
+
+
+def _gather_ensembles(buf: np.ndarray,
+                      offsets: np.ndarray,
+                      ensemble_filter: Optional[EnsembleFilter] = None,
+                      *,
+                      text_errors: str = 'strict'
+                      ) -> ColumnarEnsembles:
+    """Decodes the ensembles at the given header offsets
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        offsets (np.ndarray): Header offsets from `_scan_headers`
+        ensemble_filter (Optional[EnsembleFilter], optional): Selection to
+        apply before unpacking payloads. Defaults to None.
+        text_errors (str, optional): `bytes.decode` error handling for text
+        ensembles. Defaults to 'strict'.
+
+    Returns:
+        ColumnarEnsembles: Decoded ensembles
+    """
+    with stage('gather_ensembles') as timer:
+        offsets, data_types, timestamp_ds = _parse_headers(buf, offsets)
+        if ensemble_filter is not None:
+            keep = ensemble_filter.header_mask(data_types, timestamp_ds)
+            offsets = offsets[keep]
+            data_types = data_types[keep]
+            timestamp_ds = timestamp_ds[keep]
+
+        tables: Dict[int, np.ndarray] = {}
+        for data_type in np.unique(data_types):
+            data_type = int(data_type)
+            type_offsets = offsets[data_types == data_type]
+            if data_type == TEXT_DATA_TYPE:
+                table = np.empty(len(type_offsets), dtype=[('text', object)])
+                text_lens = buf[type_offsets + 3].tolist()
+                table['text'] = [
+                    bytes(buf[offset + 4:offset + 4 + text_len]).decode(
+                        errors=text_errors)
+                    for offset, text_len in zip(type_offsets.tolist(),
+                                                text_lens)
+                ]
+            else:
+                dtype = get_schema(data_type).dtype
+                projection = dtype if ensemble_filter is None \
+                    else ensemble_filter.project(dtype)
+                table = _gather_fields(buf, type_offsets + 3, dtype,
+                                       projection)
+            tables[data_type] = table
+        timer.add(items=len(offsets))
+    return ColumnarEnsembles(
+        tables=tables,
+        data_type=data_types,
+        timestamp_ds=timestamp_ds,
+        offsets=offsets
+    )
+
+
+def decode_columns(packet: bytes,
+                   *,
+                   ensemble_filter: Optional[EnsembleFilter] = None,
+                   resync: bool = False
+                   ) -> ColumnarEnsembles:
+    """Decodes a packet of ensembles into per data type columns
+
+    This walks the packet with the same rules as `decode_packet`, but decodes
+    each data type in bulk instead of one ensemble at a time.
+
+    In resync mode, padding runs and corrupted regions are jumped over in
+    bulk to the next header confirmed by a chain of continuous timestamps
+    rather than rescanned byte by byte, and reported as `skipped` spans
+    instead of per byte warnings.
+
+    Args:
+        packet (bytes): Packet of binary ensembles
+        ensemble_filter (Optional[EnsembleFilter], optional): Data types,
+        columns and timestamp range to decode. Defaults to everything.
+        resync (bool, optional): Jump over damaged regions. Defaults to False.
+
+    Raises:
+        ValueError: Last ensemble is cut off, outside of resync mode
+
+    Returns:
+        ColumnarEnsembles: Decoded ensembles
+    """
+    buf = np.frombuffer(packet, dtype=np.uint8)
+    offsets, end, skipped = _scan_headers(buf, resync=resync)
+    if end > len(buf):
+        if not resync:
+            raise ValueError(f'Truncated ensemble at index {offsets[-1]}')
+        skipped = _merge_spans([*map(tuple, skipped.tolist()),
+                                (int(offsets[-1]), len(buf))])
+        offsets = offsets[:-1]
+    result = _gather_ensembles(buf, offsets, ensemble_filter,
+                               text_errors='replace' if resync else 'strict')
+    result.skipped = skipped
+    if len(skipped) > 0:
+        logger = logging.getLogger('Smartfin Decoder')
+        logger.warning('Skipped %d damaged regions totalling %d bytes',
+                       len(skipped), int((skipped[:, 1] - skipped[:, 0]).sum()))
+    return result
+
+
+def decode_at(packet: bytes,
+              offsets: np.ndarray,
+              *,
+              ensemble_filter: Optional[EnsembleFilter] = None
+              ) -> ColumnarEnsembles:
+    """Decodes the ensembles whose headers start at the given offsets
+
+    Args:
+        packet (bytes): Packet of binary ensembles
+        offsets (np.ndarray): Header offsets into `packet`, e.g. from an
+        ensemble index
+        ensemble_filter (Optional[EnsembleFilter], optional): Data types,
+        columns and timestamp range to decode. Defaults to everything.
+
+    Returns:
+        ColumnarEnsembles: Decoded ensembles
+    """
+    buf = np.frombuffer(packet, dtype=np.uint8)
+    return _gather_ensembles(buf, np.asarray(offsets, dtype=np.int64),
+                             ensemble_filter)
+
+
+class StreamDecoder:
+    """Incremental ensemble decoder
+
+    Byte chunks (SFR records, serial reads, file blocks) are fed in order.
+    Ensembles bridged across chunk boundaries are carried over until they
+    complete, so at most one partial ensemble is ever held.  In resync mode,
+    headers that cannot be confirmed until more data arrives are held too.
+    """
+
+    def __init__(self,
+                 *,
+                 ensemble_filter: Optional[EnsembleFilter] = None,
+                 resync: bool = False) -> None:
+        self.__pending = b''
+        self.__position = 0
+        self.__filter = ensemble_filter
+        self.__resync = resync
+        self.__state = _ResyncState()
+
+    @property
+    def pending(self) -> int:
+        """Number of bytes held back waiting for the rest of an ensemble
+        """
+        return len(self.__pending)
+
+    def __decode(self, chunk: bytes, final: bool) -> ColumnarEnsembles:
+        data = self.__pending + bytes(chunk)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        offsets, end, skipped = _scan_headers(buf, resync=self.__resync,
+                                              final=final, state=self.__state)
+        if end > len(buf):
+            # Last ensemble is bridged into the next chunk
+            end = int(offsets[-1])
+            offsets = offsets[:-1]
+        end = min(end, len(buf))
+        result = _gather_ensembles(
+            buf, offsets, self.__filter,
+            text_errors='replace' if self.__resync else 'strict')
+        result.offsets += self.__position
+        result.skipped = skipped + self.__position
+        self.__pending = data[end:]
+        self.__position += end
+        return result
+
+    def feed(self, chunk: bytes) -> ColumnarEnsembles:
+        """Decodes all ensembles completed by the next chunk
+
+        Args:
+            chunk (bytes): Next chunk of the stream
+
+        Returns:
+            ColumnarEnsembles: Completed ensembles, with offsets relative to
+            the start of the stream
+        """
+        return self.__decode(chunk, final=False)
+
+    def close(self) -> ColumnarEnsembles:
+        """Ends the stream, discarding any incomplete trailing ensemble
+
+        Returns:
+            ColumnarEnsembles: Ensembles that were waiting on resync
+            confirmation
+        """
+        result = self.__decode(b'', final=True)
+        if len(self.__pending) >= 3:
+            logger = logging.getLogger('Smartfin Decoder')
+            logger.warning('Discarding %d bytes of truncated ensemble at '
+                           'index %d', len(self.__pending), self.__position)
+        self.__position += len(self.__pending)
+        self.__pending = b''
+        return result
+
+
+def decode_stream(chunks: Iterable[bytes],
+                  *,
+                  ensemble_filter: Optional[EnsembleFilter] = None,
+                  resync: bool = False
+                  ) -> Iterator[ColumnarEnsembles]:
+    """Decodes a stream of byte chunks, yielding ensembles as they complete
+
+    Args:
+        chunks (Iterable[bytes]): Stream chunks in order
+        ensemble_filter (Optional[EnsembleFilter], optional): Data types,
+        columns and timestamp range to decode. Defaults to everything.
+        resync (bool, optional): Jump over damaged regions, see
+        `decode_columns`. Defaults to False.
+
+    Yields:
+        Iterator[ColumnarEnsembles]: Non-empty batches of completed ensembles
+    """
+    stream = StreamDecoder(ensemble_filter=ensemble_filter, resync=resync)
+    for chunk in chunks:
+        batch = stream.feed(chunk)
+        if len(batch) > 0 or len(batch.skipped) > 0:
+            yield batch
+    batch = stream.close()
+    if len(batch) > 0 or len(batch.skipped) > 0:
+        yield batch
+
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('dataType', 'u1'),
+    ('timestamp_ds', '<u4'),
+])
+
+
+def build_index(packet: bytes, *, resync: bool = False) -> np.ndarray:
+    """Builds an ensemble index without decoding any payloads
+
+    Args:
+        packet (bytes): Packet of binary ensembles
+        resync (bool, optional): Jump over damaged regions, see
+        `decode_columns`. Defaults to False.
+
+    Returns:
+        np.ndarray: One `INDEX_DTYPE` row per ensemble, in file order
+    """
+    buf = np.frombuffer(packet, dtype=np.uint8)
+    offsets, end, _ = _scan_headers(buf, resync=resync)
+    if end > len(buf):
+        # Partial trailing ensemble is not addressable
+        offsets = offsets[:-1]
+    return _index_rows(buf, offsets)
+
+
+def _index_rows(buf: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Builds the index rows for the given header offsets
+
+    Args:
+        buf (np.ndarray): Packet bytes
+        offsets (np.ndarray): Header offsets from `_scan_headers`
+
+    Returns:
+        np.ndarray: One `INDEX_DTYPE` row per valid ensemble
+    """
+    offsets, data_types, timestamp_ds = _parse_headers(buf, offsets)
+    index = np.empty(len(offsets), dtype=INDEX_DTYPE)
+    index['offset'] = offsets
+    index['dataType'] = data_types
+    index['timestamp_ds'] = timestamp_ds
+    return index
+
+
+class StreamIndexer:
+    """Incremental ensemble index builder
+
+    Byte chunks are fed in order as a file is written, so its index is built
+    in the same pass instead of rescanning the file afterwards.  As in
+    `StreamDecoder`, ensembles bridged across chunk boundaries are carried
+    over until they complete.
+    """
+
+    def __init__(self, *, resync: bool = False) -> None:
+        self.__pending = b''
+        self.__position = 0
+        self.__resync = resync
+        self.__state = _ResyncState()
+        self.__parts: List[np.ndarray] = []
+
+    def __index(self, chunk: bytes, final: bool) -> np.ndarray:
+        data = self.__pending + bytes(chunk)
+        buf = np.frombuffer(data, dtype=np.uint8)
+        offsets, end, _ = _scan_headers(buf, resync=self.__resync,
+                                        final=final, state=self.__state)
+        if end > len(buf):
+            # Last ensemble is bridged into the next chunk
+            end = int(offsets[-1])
+            offsets = offsets[:-1]
+        end = min(end, len(buf))
+        rows = _index_rows(buf, offsets)
+        rows['offset'] += self.__position
+        self.__parts.append(rows)
+        self.__pending = data[end:]
+        self.__position += end
+        return rows
+
+    def feed(self, chunk: bytes) -> np.ndarray:
+        """Indexes all ensembles completed by the next chunk
+
+        Args:
+            chunk (bytes): Next chunk of the stream
+
+        Returns:
+            np.ndarray: Index rows of the ensembles completed by the chunk
+        """
+        return self.__index(chunk, final=False)
+
+    def close(self) -> np.ndarray:
+        """Ends the stream, dropping any incomplete trailing ensemble
+
+        Returns:
+            np.ndarray: One `INDEX_DTYPE` row per ensemble, in stream order
+        """
+        self.__index(b'', final=True)
+        self.__pending = b''
+        if not self.__parts:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.concatenate(self.__parts)
+
+
+def convert_to_si(df: pd.DataFrame,
+                  *,
+                  compact: bool = False,
+                  replace: bool = False) -> pd.DataFrame:
     """Converts columns to SI units
 
+    All scaled columns are converted in a single vectorized pass using the
+    schema registry's units.  Identity conversions (e.g. timestamp) keep the
+    raw dtype.  In compact mode, `timestamp_ds` is kept as is rather than
+    converted, since float32 cannot hold every timestamp exactly.
+
     Args:
         df (pd.DataFrame): Raw column dataframe
+        compact (bool, optional): Produce float32 SI columns instead of
+        float64. Defaults to False.
+        replace (bool, optional): Drop the raw columns that were converted
+        instead of keeping them alongside the SI columns. Defaults to False.
 
     Returns:
         pd.DataFrame: SI Columned dataframe
     """
-    columns = df.columns.to_list()
-    for col in columns:
-        if col not in si_conversions:
-            continue
-        mapping = si_conversions[col]
-        df[mapping[0]] = mapping[1](df[col])
+    with stage('convert_to_si') as timer:
+        units = [(col, unit) for col, unit in
+                 ((col, get_unit(col)) for col in df.columns.to_list())
+                 if unit is not None and
+                 not (compact and col == 'timestamp_ds')]
+        scaled = [(col, unit) for col, unit in units
+                  if not unit.flag and (unit.scale, unit.divisor) != (1, 1)]
+        dtype = np.float32 if compact else np.float64
+        si_values = np.zeros((len(df), 0), dtype=dtype)
+        if scaled:
+            raw = np.column_stack([
+                df[col].to_numpy(dtype=dtype, na_value=np.nan)
+                for col, _ in scaled
+            ]) if len(df) > 0 else np.zeros((0, len(scaled)), dtype=dtype)
+            scales = np.array([unit.scale for _, unit in scaled], dtype=dtype)
+            divisors = np.array([unit.divisor for _, unit in scaled],
+                                dtype=dtype)
+            si_values = raw * scales / divisors
+        si_idx = {col: idx for idx, (col, _) in enumerate(scaled)}
+
+        converted = set()
+        for col, unit in units:
+            if unit.flag:
+                df[unit.label] = unit.convert(
+                    df[col].to_numpy(dtype=dtype, na_value=np.nan))
+            elif col not in si_idx:
+                # Identity conversion keeps the raw dtype
+                df[unit.label] = df[col].copy()
+            elif compact and unit.label in converted:
+                # Several raw columns share this label (e.g. xAcc and xAccQ10),
+                # so merge rather than overwrite
+                values = si_values[:, si_idx[col]]
+                df[unit.label] = np.where(np.isnan(values),
+                                          df[unit.label].to_numpy(), values)
+            else:
+                df[unit.label] = si_values[:, si_idx[col]]
+            converted.add(unit.label)
+        timer.add(items=len(df))
+    if replace:
+        df = df.drop(columns=[col for col, unit in units
+                              if col != unit.label])
     return df
@@ -0,0 +1,388 @@
+'''Ensemble encoder
+
+Packs columnar data back into binary ensembles, the inverse of
+`decoder.decode_columns`.  Each data type's payloads are written in one
+array operation through its schema dtype, so sessions can be re-packed after
+filtering or correcting them, built as test fixtures, or replayed into
+ingestion.
+'''
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.common import ENCODERS, Encoding, FileFormats
+from smartfin_tools.container import write_sfz
+from smartfin_tools.profiling import stage
+from smartfin_tools.schema import (HEADER_SIZE, TEXT_DATA_TYPE, get_schema,
+                                   schemas)
+from smartfin_tools.tables import TIME_INDEX
+
+# Particle publishes are at most 622 bytes, and records are base64 encoded
+DEFAULT_RECORD_SIZE = 464
+
+__MAX_TEXT = 0xFF
+
+
+def __ensemble_sizes(ensembles: scd.ColumnarEnsembles,
+                     texts: Dict[int, bytes]) -> np.ndarray:
+    """Computes the encoded size of every ensemble
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Ensembles to encode
+        texts (Dict[int, bytes]): Encoded text by ensemble row
+
+    Raises:
+        ValueError: Unregistered data type
+
+    Returns:
+        np.ndarray: Size in bytes, header included
+    """
+    step = np.full(16, -1, dtype=np.int64)
+    for data_type, schema in schemas().items():
+        step[data_type] = HEADER_SIZE + schema.size
+    step[TEXT_DATA_TYPE] = HEADER_SIZE + 1
+    sizes = step[ensembles.data_type]
+    if (sizes < 0).any():
+        unknown = np.unique(ensembles.data_type[sizes < 0]).tolist()
+        raise ValueError(f'Cannot encode unregistered data types {unknown}')
+    for row, text in texts.items():
+        sizes[row] += len(text)
+    return sizes
+
+
+def __encode(ensembles: scd.ColumnarEnsembles) -> Tuple[bytes, np.ndarray]:
+    """Encodes ensembles into a packet
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Ensembles in packet order
+
+    Raises:
+        ValueError: Unregistered data type, timestamp outside the 20-bit
+        counter, missing field, or text longer than 255 bytes
+
+    Returns:
+        Tuple[bytes, np.ndarray]: Packet, and the ensemble start offsets
+        followed by the packet size
+    """
+    data_types = np.asarray(ensembles.data_type, dtype=np.uint8)
+    timestamp_ds = np.asarray(ensembles.timestamp_ds, dtype=np.int64)
+    if ((timestamp_ds < 0) | (timestamp_ds >= scd.COUNTER_PERIOD_DS)).any():
+        raise ValueError('Timestamps must be within the 20-bit decisecond '
+                         'counter')
+    text_rows = np.flatnonzero(data_types == TEXT_DATA_TYPE)
+    texts: Dict[int, bytes] = {}
+    if len(text_rows) > 0:
+        for row, text in zip(text_rows.tolist(),
+                             ensembles.tables[TEXT_DATA_TYPE]['text']):
+            texts[row] = text.encode()
+            if len(texts[row]) > __MAX_TEXT:
+                raise ValueError(f'Text at ensemble {row} is longer than '
+                                 f'{__MAX_TEXT} bytes')
+
+    sizes = __ensemble_sizes(ensembles, texts)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    starts = offsets[:-1]
+    out = np.zeros(int(offsets[-1]), dtype=np.uint8)
+    out[starts] = data_types | ((timestamp_ds & 0xF) << 4).astype(np.uint8)
+    out[starts + 1] = (timestamp_ds >> 4) & 0xFF
+    out[starts + 2] = (timestamp_ds >> 12) & 0xFF
+
+    for data_type in np.unique(data_types).tolist():
+        if data_type == TEXT_DATA_TYPE:
+            continue
+        schema = get_schema(data_type)
+        if schema.size == 0:
+            continue
+        table = ensembles.tables[data_type]
+        missing = set(schema.names) - set(table.dtype.names or ())
+        if missing:
+            raise ValueError(f'Data type {data_type} is missing fields '
+                             f'{sorted(missing)}')
+        # Zeroed, so pad bytes are written as zeros
+        payload = np.zeros(len(table), dtype=schema.dtype)
+        for name in schema.names:
+            payload[name] = table[name]
+        type_starts = starts[data_types == data_type] + HEADER_SIZE
+        out[type_starts[:, np.newaxis] + np.arange(schema.size)] = \
+            payload.view(np.uint8).reshape(-1, schema.size)
+
+    for row, text in texts.items():
+        start = int(starts[row]) + HEADER_SIZE
+        out[start] = len(text)
+        out[start + 1:start + 1 + len(text)] = np.frombuffer(text,
+                                                             dtype=np.uint8)
+    return out.tobytes(), offsets
+
+
+def encode_columns(ensembles: scd.ColumnarEnsembles) -> bytes:
+    """Encodes ensembles into a packet
+
+    Headers are written as `extract_header` reads them, and payloads through
+    their schema dtype, so `decode_columns` and `decode_packet` give back
+    the same values.
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Ensembles in packet order.  Every
+        schema field must be present in each data type's table.
+
+    Raises:
+        ValueError: Unregistered data type, timestamp outside the 20-bit
+        counter, missing field, or text longer than 255 bytes
+
+    Returns:
+        bytes: Packet of ensembles, without padding
+    """
+    with stage('encode_columns') as timer:
+        packet, _ = __encode(ensembles)
+        timer.add(items=len(ensembles), nbytes=len(packet))
+    return packet
+
+
+def __field_values(values: np.ndarray,
+                   dtype: np.dtype,
+                   name: str,
+                   data_type: int) -> np.ndarray:
+    """Casts column values to a schema field, checking they fit exactly
+
+    Args:
+        values (np.ndarray): Values as float64, NaN where missing
+        dtype (np.dtype): Field dtype
+        name (str): Field name
+        data_type (int): Data type
+
+    Raises:
+        ValueError: Missing values, or values the field cannot hold
+
+    Returns:
+        np.ndarray: Field values
+    """
+    if np.isnan(values).any():
+        raise ValueError(f'{name} is missing for data type {data_type}')
+    if dtype.kind == 'f':
+        fits = np.isfinite(values.astype(dtype)) == np.isfinite(values)
+    elif dtype.kind == 'b':
+        fits = (values == 0) | (values == 1)
+    else:
+        info = np.iinfo(dtype)
+        fits = (values >= info.min) & (values <= info.max) & \
+            (values == np.floor(values))
+    if not fits.all():
+        raise ValueError(f'{name} values of data type {data_type} do not '
+                         f'fit {dtype}')
+    return values.astype(dtype)
+
+
+def __from_rows(data_types: np.ndarray,
+                timestamp: np.ndarray,
+                frames: Dict[int, pd.DataFrame]) -> scd.ColumnarEnsembles:
+    """Builds ensembles from per data type rows
+
+    Args:
+        data_types (np.ndarray): Data type of each ensemble
+        timestamp (np.ndarray): Timestamp (s) of each ensemble
+        frames (Dict[int, pd.DataFrame]): Each data type's rows, in order
+
+    Raises:
+        ValueError: Timestamps not on whole deciseconds
+
+    Returns:
+        scd.ColumnarEnsembles: Ensembles
+    """
+    timestamp_ds = np.rint(np.asarray(timestamp, dtype=np.float64) * 10)
+    if not np.allclose(timestamp_ds / 10, timestamp):
+        raise ValueError('Timestamps must be whole deciseconds')
+    tables: Dict[int, np.ndarray] = {}
+    for data_type, frame in frames.items():
+        if data_type == TEXT_DATA_TYPE:
+            table = np.empty(len(frame), dtype=[('text', object)])
+            table['text'] = frame['text'].fillna('').astype(str).to_numpy()
+        else:
+            dtype = get_schema(data_type).dtype
+            table = np.empty(len(frame), dtype=dtype)
+            for name in dtype.names or ():
+                if name not in frame:
+                    raise ValueError(f'{name} is missing for data type '
+                                     f'{data_type}')
+                table[name] = __field_values(
+                    frame[name].to_numpy(dtype=np.float64, na_value=np.nan),
+                    dtype[name], name, data_type)
+        tables[data_type] = table
+    return scd.ColumnarEnsembles(
+        tables=tables,
+        data_type=np.asarray(data_types, dtype=np.uint8),
+        timestamp_ds=timestamp_ds.astype(np.uint32),
+        offsets=np.zeros(len(data_types), dtype=np.int64))
+
+
+def columns_from_dataframe(df: pd.DataFrame) -> scd.ColumnarEnsembles:
+    """Converts a wide frame back to ensembles
+
+    The frame is one row per ensemble with `dataType`, `timestamp` (s), or
+    `timestamp_ds` in compact frames, and the raw columns, as from
+    `pd.DataFrame(decode_packet(packet))`, `ColumnarEnsembles.to_dataframe`
+    or an exported CSV.  SI columns are ignored.
+
+    Args:
+        df (pd.DataFrame): Wide frame, rows in packet order
+
+    Returns:
+        scd.ColumnarEnsembles: Ensembles
+    """
+    data_types = df['dataType'].to_numpy(dtype=np.int64)
+    frames = {data_type: df[data_types == data_type]
+              for data_type in np.unique(data_types).tolist()}
+    if 'timestamp_ds' in df:
+        timestamp = df['timestamp_ds'].to_numpy(dtype=np.float64) / 10
+    else:
+        timestamp = df['timestamp'].to_numpy()
+    return __from_rows(data_types, timestamp, frames)
+
+
+def columns_from_tables(tables: Dict[int, pd.DataFrame]
+                        ) -> scd.ColumnarEnsembles:
+    """Converts per data type tables back to ensembles
+
+    Tables are as in `SessionTables`, indexed or keyed by `timestamp` (s),
+    with text messages under `TEXT_DATA_TYPE`.  Ensembles are ordered by
+    the `ensemble` column if every table has one, otherwise by timestamp.
+
+    Args:
+        tables (Dict[int, pd.DataFrame]): Rows of each data type
+
+    Returns:
+        scd.ColumnarEnsembles: Ensembles
+    """
+    tables = {data_type: table.reset_index() if TIME_INDEX not in table
+              else table for data_type, table in tables.items()}
+    data_types = np.concatenate(
+        [np.full(len(table), data_type, dtype=np.uint8)
+         for data_type, table in tables.items()] +
+        [np.zeros(0, dtype=np.uint8)])
+    timestamp = np.concatenate(
+        [table[TIME_INDEX].to_numpy(dtype=np.float64)
+         for table in tables.values()] + [np.zeros(0)])
+    if tables and all('ensemble' in table for table in tables.values()):
+        key = np.concatenate([table['ensemble'].to_numpy()
+                              for table in tables.values()])
+    else:
+        key = timestamp
+    order = np.argsort(key, kind='stable')
+    data_types = data_types[order]
+    frames = {}
+    first_row = 0
+    for data_type, table in tables.items():
+        # Each table's rows, in the order they appear in the packet
+        rows = order[data_types == data_type] - first_row
+        frames[data_type] = table.iloc[rows]
+        first_row += len(table)
+    return __from_rows(data_types, timestamp[order], frames)
+
+
+def __split_records(packet: bytes,
+                    offsets: np.ndarray,
+                    record_size: int,
+                    bridged: bool) -> List[bytes]:
+    """Splits a packet into records
+
+    Args:
+        packet (bytes): Packet of ensembles
+        offsets (np.ndarray): Ensemble start offsets followed by the packet
+        size
+        record_size (int): Record size in bytes
+        bridged (bool): Fill each record and let ensembles span records,
+        rather than zero padding records at ensemble boundaries
+
+    Returns:
+        List[bytes]: Records
+    """
+    if bridged:
+        return [packet[idx:idx + record_size]
+                for idx in range(0, len(packet), record_size)]
+    cuts = [0]
+    previous = 0
+    for boundary in offsets[1:].tolist():
+        if boundary - cuts[-1] > record_size and previous > cuts[-1]:
+            cuts.append(previous)
+        previous = boundary
+    cuts.append(len(packet))
+    return [packet[begin:end].ljust(record_size, b'\x00')
+            for begin, end in zip(cuts[:-1], cuts[1:]) if end > begin]
+
+
+def pack_records(ensembles: scd.ColumnarEnsembles,
+                 *,
+                 record_size: int = DEFAULT_RECORD_SIZE,
+                 bridged: bool = False) -> List[bytes]:
+    """Encodes ensembles into records, as the device publishes them
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Ensembles in packet order
+        record_size (int, optional): Record size in bytes. Defaults to
+        DEFAULT_RECORD_SIZE.
+        bridged (bool, optional): Fill each record and let ensembles span
+        records, rather than zero padding records at ensemble boundaries.
+        An ensemble larger than a record gets a record of its own. Defaults
+        to False.
+
+    Returns:
+        List[bytes]: Records
+    """
+    with stage('encode_columns') as timer:
+        packet, offsets = __encode(ensembles)
+        timer.add(items=len(ensembles), nbytes=len(packet))
+    return __split_records(packet, offsets, record_size, bridged)
+
+
+def encode_records(records: List[bytes], encoding: Encoding) -> bytes:
+    """Encodes records as SFR text
+
+    Args:
+        records (List[bytes]): Records
+        encoding (Encoding): Record encoding
+
+    Returns:
+        bytes: SFR content, one record per line
+    """
+    encode = ENCODERS[encoding]
+    return b''.join(encode(record) + b'\n' for record in records)
+
+
+def write_session(ensembles: scd.ColumnarEnsembles,
+                  path: Path,
+                  *,
+                  encoding: Encoding = Encoding.BASE64URL,
+                  record_size: int = DEFAULT_RECORD_SIZE,
+                  bridged: bool = False,
+                  codec: str = 'zlib') -> None:
+    """Encodes ensembles and writes them as SFP, SFR or SFZ, by the path's
+    suffix
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Ensembles in packet order
+        path (Path): Output path
+        encoding (Encoding, optional): Record encoding for SFR outputs.
+        Defaults to Encoding.BASE64URL.
+        record_size (int, optional): Record size for SFR outputs. Defaults to
+        DEFAULT_RECORD_SIZE.
+        bridged (bool, optional): Let ensembles span SFR records. Defaults to
+        False.
+        codec (str, optional): Block compression codec for SFZ outputs.
+        Defaults to 'zlib'.
+
+    Raises:
+        ValueError: Unsupported suffix
+    """
+    suffix = FileFormats(path.suffix.lower())
+    if suffix == FileFormats.SFP:
+        path.write_bytes(encode_columns(ensembles))
+    elif suffix == FileFormats.SFZ:
+        write_sfz(encode_columns(ensembles), path, codec=codec)
+    elif suffix == FileFormats.SFR:
+        path.write_bytes(encode_records(
+            pack_records(ensembles, record_size=record_size, bridged=bridged),
+            encoding))
+    else:
+        raise ValueError(f'Cannot write a session as {path.suffix}')
@@ -0,0 +1,219 @@
+'''Bounded memory CSV export
+'''
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, FrozenSet, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.container import SfzFile, is_compressed
+from smartfin_tools.profiling import stage
+from smartfin_tools.records import iter_records
+from smartfin_tools.schema import HEADER_SIZE, TEXT_DATA_TYPE, get_schema
+
+DEFAULT_MEMORY_BUDGET = 64 << 20
+
+# Approximate peak bytes per CSV cell while converting and formatting a
+# chunk, measured with tracemalloc
+CSV_CELL_BYTES = 96
+
+
+@dataclass(frozen=True)
+class CsvLayout:
+    """Stable CSV column layout for a session
+
+    The raw columns are in the order `scd.ColumnarEnsembles.to_dataframe`
+    would produce for the whole session, and `complete` holds the columns
+    every present data type carries, which are written as integers rather
+    than floats.
+    """
+    columns: List[str]
+    complete: FrozenSet[str]
+
+    @classmethod
+    def from_types(cls,
+                   data_types: Iterable[int],
+                   ensemble_filter: Optional[scd.EnsembleFilter] = None
+                   ) -> CsvLayout:
+        """Computes the layout from the data types present in a session
+
+        Args:
+            data_types (Iterable[int]): Data types in order of first
+            appearance
+            ensemble_filter (Optional[scd.EnsembleFilter], optional): Column
+            projection applied when decoding. Defaults to None.
+
+        Returns:
+            CsvLayout: Column layout
+        """
+        columns: List[str] = []
+        complete: Optional[FrozenSet[str]] = None
+        for data_type in data_types:
+            if data_type == TEXT_DATA_TYPE:
+                fields = ('text',)
+            else:
+                dtype = get_schema(data_type).dtype
+                if ensemble_filter is not None:
+                    dtype = ensemble_filter.project(dtype)
+                fields = dtype.names or ()
+            for name in (*fields, 'timestamp', 'dataType'):
+                if name not in columns:
+                    columns.append(name)
+            complete = frozenset(fields) if complete is None \
+                else complete & frozenset(fields)
+        return cls(columns=columns,
+                   complete=(complete or frozenset()) |
+                   {'timestamp', 'dataType'})
+
+    def rows_per_chunk(self, memory_budget: int) -> int:
+        """Estimates how many rows can be converted and written at once
+
+        Args:
+            memory_budget (int): Peak memory budget in bytes
+
+        Returns:
+            int: Rows per chunk
+        """
+        # Roughly one SI column is added per raw column
+        cells = max(2 * len(self.columns), 1)
+        return max(memory_budget // (cells * CSV_CELL_BYTES), 1)
+
+    def frame(self, ensembles: scd.ColumnarEnsembles, start: int
+              ) -> pd.DataFrame:
+        """Builds the raw DataFrame for a chunk of the session
+
+        Args:
+            ensembles (scd.ColumnarEnsembles): Chunk of ensembles
+            start (int): Row number of the first ensemble in the session
+
+        Returns:
+            pd.DataFrame: Raw DataFrame with every layout column, typed as
+            for the whole session
+        """
+        df = ensembles.to_dataframe()
+        for name in self.columns:
+            if name not in df:
+                df[name] = np.full(len(df), np.nan,
+                                   dtype=object if name == 'text'
+                                   else np.float64)
+            elif name not in self.complete and df[name].dtype.kind in 'iu':
+                df[name] = df[name].astype(np.float64)
+        df = df[self.columns]
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+
+def write_csv(batches: Callable[[], Iterator[scd.ColumnarEnsembles]],
+              layout: CsvLayout,
+              output_path: Path) -> int:
+    """Converts and appends ensembles to a CSV one batch at a time
+
+    Args:
+        batches (Callable[[], Iterator[scd.ColumnarEnsembles]]): Produces
+        the session's ensembles in order, in bounded batches
+        layout (CsvLayout): Session column layout
+        output_path (Path): Output path
+
+    Returns:
+        int: Number of rows written
+    """
+    rows = 0
+    with open(output_path, 'w', encoding='utf-8', newline='') as handle:
+        for batch in batches():
+            df = scd.convert_to_si(layout.frame(batch, rows))
+            with stage('write_csv') as timer:
+                position = handle.tell()
+                df.to_csv(handle, header=rows == 0)
+                timer.add(items=len(df), nbytes=handle.tell() - position)
+            rows += len(df)
+        if rows == 0:
+            empty = scd.ColumnarEnsembles.empty()
+            scd.convert_to_si(layout.frame(empty, 0)).to_csv(handle)
+    return rows
+
+
+def export_csv(chunks: Callable[[int], Iterable[bytes]],
+               output_path: Path,
+               *,
+               ensemble_filter: Optional[scd.EnsembleFilter] = None,
+               memory_budget: int = DEFAULT_MEMORY_BUDGET) -> int:
+    """Exports a stream of ensembles to CSV with bounded peak memory
+
+    The stream is read twice: once to find the data types present, which
+    fix the column layout, and once to decode, convert and append each
+    chunk.  The output is identical to converting the whole session at once.
+
+    Args:
+        chunks (Callable[[int], Iterable[bytes]]): Opens the stream, split
+        into chunks of about the given number of bytes
+        output_path (Path): Output path
+        ensemble_filter (Optional[scd.EnsembleFilter], optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        memory_budget (int, optional): Peak memory budget in bytes. Defaults
+        to DEFAULT_MEMORY_BUDGET.
+
+    Returns:
+        int: Number of rows written
+    """
+    # Columnar batches take at most a few times their input size, and the
+    # smallest ensemble is a bare header
+    scan_size = max(memory_budget // 16, HEADER_SIZE)
+    data_types: List[int] = []
+    for batch in scd.decode_stream(chunks(scan_size),
+                                   ensemble_filter=ensemble_filter):
+        for data_type in pd.unique(batch.data_type).tolist():
+            if data_type not in data_types:
+                data_types.append(data_type)
+
+    layout = CsvLayout.from_types(data_types, ensemble_filter)
+    chunk_size = layout.rows_per_chunk(memory_budget) * HEADER_SIZE
+    return write_csv(
+        lambda: scd.decode_stream(chunks(chunk_size),
+                                  ensemble_filter=ensemble_filter),
+        layout, output_path)
+
+
+def file_chunks(path: Path) -> Callable[[int], Iterator[bytes]]:
+    """Reads a binary file in fixed size chunks
+
+    Args:
+        path (Path): SFP path, or SFZ container
+
+    Returns:
+        Callable[[int], Iterator[bytes]]: Opens the file and yields chunks
+        of the given size
+    """
+    def chunks(size: int) -> Iterator[bytes]:
+        if is_compressed(path):
+            with SfzFile(path) as sfz:
+                for block in sfz.iter_blocks():
+                    for idx in range(0, len(block), size):
+                        yield block[idx:idx + size]
+            return
+        with open(path, 'rb') as handle:
+            while chunk := handle.read(size):
+                yield chunk
+    return chunks
+
+
+def record_chunks(path: Path, decoder: Callable[[str], bytes]
+                  ) -> Callable[[int], Iterator[bytes]]:
+    """Decodes a record file, grouping records into chunks
+
+    Args:
+        path (Path): SFR path
+        decoder (Callable[[str], bytes]): Record Ascii to binary decoder
+
+    Returns:
+        Callable[[int], Iterator[bytes]]: Opens the file and yields chunks
+        of about the given size
+    """
+    def chunks(size: int) -> Iterator[bytes]:
+        for packets in iter_records(path, decoder, size):
+            if packets.data:
+                yield packets.data
+    return chunks
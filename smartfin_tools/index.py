@@ -0,0 +1,196 @@
+'''Ensemble Index
+
+Sidecar `.sfi` files hold one row per ensemble of an `.sfp` file, allowing
+readers to seek straight to a time range or set of data types.  SFZ
+containers are accepted wherever an `.sfp` path is.
+'''
+import logging
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.container import SfzFile, is_compressed, read_sfp
+from smartfin_tools.schema import max_ensemble_size
+
+INDEX_SUFFIX = '.sfi'
+__indexMagic = b'SFI\x01'
+__indexHeader = struct.Struct('<4sQQ')
+
+
+def index_path(sfp_path: Path) -> Path:
+    """Gets the sidecar index path for an SFP file
+
+    Args:
+        sfp_path (Path): Path to SFP file
+
+    Returns:
+        Path: Path to sidecar index
+    """
+    return sfp_path.with_suffix(INDEX_SUFFIX)
+
+
+def write_index(path: Path, index: np.ndarray, sfp_path: Path) -> None:
+    """Writes an ensemble index
+
+    Args:
+        path (Path): Index path
+        index (np.ndarray): Ensemble index from `build_index`
+        sfp_path (Path): Indexed SFP file, used to detect stale indices
+    """
+    stat = sfp_path.stat()
+    with open(path, 'wb') as handle:
+        handle.write(__indexHeader.pack(
+            __indexMagic, stat.st_size, stat.st_mtime_ns))
+        handle.write(np.ascontiguousarray(
+            index, dtype=scd.INDEX_DTYPE).tobytes())
+
+
+def save_index(path: Path, index: np.ndarray, sfp_path: Path) -> bool:
+    """Writes an ensemble index if the location is writable
+
+    Indices are only a cache, so read-only media and archives are read
+    without one rather than failing.
+
+    Args:
+        path (Path): Index path
+        index (np.ndarray): Ensemble index from `build_index`
+        sfp_path (Path): Indexed SFP file
+
+    Returns:
+        bool: True if the index was written
+    """
+    try:
+        write_index(path, index, sfp_path)
+    except OSError as exc:
+        logger = logging.getLogger('Smartfin Decoder')
+        logger.debug('Not writing index %s: %s', path.as_posix(), exc)
+        return False
+    return True
+
+
+def read_index(path: Path, sfp_path: Path) -> Optional[np.ndarray]:
+    """Reads an ensemble index
+
+    Args:
+        path (Path): Index path
+        sfp_path (Path): Indexed SFP file
+
+    Returns:
+        Optional[np.ndarray]: Ensemble index, or None if the index is missing,
+        malformed or older than the SFP file
+    """
+    if not path.is_file():
+        return None
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    if len(data) < __indexHeader.size:
+        return None
+    magic, size, mtime_ns = __indexHeader.unpack_from(data)
+    stat = sfp_path.stat()
+    if magic != __indexMagic or \
+            (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    if (len(data) - __indexHeader.size) % scd.INDEX_DTYPE.itemsize != 0:
+        return None
+    return np.frombuffer(data, dtype=scd.INDEX_DTYPE,
+                         offset=__indexHeader.size)
+
+
+def load_index(sfp_path: Path) -> np.ndarray:
+    """Loads the sidecar index for an SFP file, building it if needed
+
+    A built index is saved as the sidecar where the directory is writable.
+
+    Args:
+        sfp_path (Path): Path to SFP file
+
+    Returns:
+        np.ndarray: Ensemble index
+    """
+    sidecar = index_path(sfp_path)
+    index = read_index(sidecar, sfp_path)
+    if index is None:
+        index = np.zeros(0, dtype=scd.INDEX_DTYPE)
+        if is_compressed(sfp_path):
+            index = scd.build_index(read_sfp(sfp_path))
+        else:
+            with open(sfp_path, 'rb') as handle:
+                if sfp_path.stat().st_size > 0:
+                    with mmap.mmap(handle.fileno(), 0,
+                                   access=mmap.ACCESS_READ) as data:
+                        index = scd.build_index(data)
+        save_index(sidecar, index, sfp_path)
+    return index
+
+
+def select(index: np.ndarray,
+           *,
+           data_types: Optional[Iterable[int]] = None,
+           start: Optional[float] = None,
+           end: Optional[float] = None) -> np.ndarray:
+    """Selects index rows by data type and timestamp range
+
+    Args:
+        index (np.ndarray): Ensemble index
+        data_types (Optional[Iterable[int]], optional): Data types to keep.
+        Defaults to all.
+        start (Optional[float], optional): Inclusive start timestamp (s).
+        Defaults to unbounded.
+        end (Optional[float], optional): Exclusive end timestamp (s).
+        Defaults to unbounded.
+
+    Returns:
+        np.ndarray: Selected index rows
+    """
+    mask = np.ones(len(index), dtype=bool)
+    if data_types is not None:
+        mask &= np.isin(index['dataType'], list(data_types))
+    if start is not None:
+        mask &= index['timestamp_ds'] >= start * 10
+    if end is not None:
+        mask &= index['timestamp_ds'] < end * 10
+    return index[mask]
+
+
+def read_window(sfp_path: Path,
+                *,
+                data_types: Optional[Iterable[int]] = None,
+                start: Optional[float] = None,
+                end: Optional[float] = None) -> scd.ColumnarEnsembles:
+    """Decodes only the ensembles matching a data type and time selection
+
+    Only the byte range spanning the selected ensembles is read, or for SFZ
+    containers, only the blocks overlapping the time range.
+
+    Args:
+        sfp_path (Path): Path to SFP file
+        data_types (Optional[Iterable[int]], optional): Data types to keep.
+        Defaults to all.
+        start (Optional[float], optional): Inclusive start timestamp (s).
+        Defaults to unbounded.
+        end (Optional[float], optional): Exclusive end timestamp (s).
+        Defaults to unbounded.
+
+    Returns:
+        scd.ColumnarEnsembles: Selected ensembles
+    """
+    if is_compressed(sfp_path):
+        with SfzFile(sfp_path) as sfz:
+            return sfz.read_window(data_types=data_types, start=start,
+                                   end=end)
+    rows = select(load_index(sfp_path),
+                  data_types=data_types, start=start, end=end)
+    if len(rows) == 0:
+        return scd.decode_at(b'', np.zeros(0, dtype=np.int64))
+    first = int(rows['offset'][0])
+    last = int(rows['offset'][-1])
+    with open(sfp_path, 'rb') as handle:
+        handle.seek(first)
+        window = handle.read(last - first + max_ensemble_size())
+    result = scd.decode_at(window, rows['offset'].astype(np.int64) - first)
+    result.offsets += first
+    return result
@@ -0,0 +1,125 @@
+'''Incremental conversion manifest
+'''
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Sequence, Union
+
+import smartfin_tools.decoder as scd
+from smartfin_tools import __version__
+from smartfin_tools.cache import file_digest
+from smartfin_tools.schema import schema_fingerprint
+
+MANIFEST_NAME = 'sfconvert_manifest.json'
+MANIFEST_VERSION = 2
+
+
+def decoder_identity() -> str:
+    """Identifies the decoder that produced an output
+
+    Returns:
+        str: Package, decoder and schema versions
+    """
+    return f'{__version__}:{scd.DECODER_VERSION}:{schema_fingerprint()}'
+
+
+class BuildManifest:
+    """Record of converted inputs, used to skip up to date outputs
+
+    Each input is recorded with its content hash, size and modification
+    time, the decoder identity, the conversion settings and its output paths.
+    The outputs are up to date if all of these still match.  Inputs whose size
+    and modification time are unchanged are trusted without rehashing, so
+    checking an unchanged archive only needs a `stat` per file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.__entries: Dict[str, Dict] = {}
+        self.__decoder = decoder_identity()
+        try:
+            with open(path, 'r', encoding='utf-8') as handle:
+                manifest = json.load(handle)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.__entries = manifest['entries']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            # Missing or unreadable, so everything is rebuilt
+            pass
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @staticmethod
+    def __outputs(output_files: Union[Path, Sequence[Path]]) -> List[str]:
+        if isinstance(output_files, Path):
+            output_files = [output_files]
+        return [str(output_file.resolve()) for output_file in output_files]
+
+    def is_current(self,
+                   input_file: Path,
+                   output_files: Union[Path, Sequence[Path]],
+                   settings: str) -> bool:
+        """Checks whether an input's outputs are up to date with it
+
+        Args:
+            input_file (Path): Input path
+            output_files (Union[Path, Sequence[Path]]): Output path, or every
+            output path of the input
+            settings (str): Conversion settings, e.g. output type, encoding
+            and filter
+
+        Returns:
+            bool: True if the outputs need not be rebuilt
+        """
+        entry = self.__entries.get(str(input_file.resolve()))
+        if entry is None or entry['decoder'] != self.__decoder \
+                or entry['settings'] != settings \
+                or entry['outputs'] != self.__outputs(output_files) \
+                or not all(Path(output).exists()
+                           for output in entry['outputs']):
+            return False
+        stat = input_file.stat()
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        # Touched but possibly unchanged
+        if file_digest(input_file) != entry['hash']:
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def record(self,
+               input_file: Path,
+               output_files: Union[Path, Sequence[Path]],
+               settings: str) -> None:
+        """Records a completed conversion
+
+        Args:
+            input_file (Path): Input path
+            output_files (Union[Path, Sequence[Path]]): Output path, or every
+            output path of the input
+            settings (str): Conversion settings
+        """
+        stat = input_file.stat()
+        self.__entries[str(input_file.resolve())] = {
+            'hash': file_digest(input_file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'decoder': self.__decoder,
+            'settings': settings,
+            'outputs': self.__outputs(output_files),
+        }
+
+    def save(self) -> None:
+        """Writes the manifest atomically
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8',
+                                         dir=self.path.parent,
+                                         suffix='.tmp',
+                                         delete=False) as handle:
+            json.dump({'version': MANIFEST_VERSION,
+                       'entries': self.__entries}, handle, indent=1)
+        os.replace(handle.name, self.path)
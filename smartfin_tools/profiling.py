@@ -0,0 +1,193 @@
+'''Pipeline stage profiling
+
+Pipeline stages are wrapped in `stage`, which records wall time, calls,
+items and bytes into the active `Profiler`.  Without an active profiler,
+`stage` returns a shared no-op, so instrumented code pays one global lookup
+and an empty context manager per stage.
+
+Stages are aggregated by name.  Nested stages are timed inclusively, e.g.
+`decode_sfr` includes `decode_records`.  Only the current process is
+profiled; stages run in worker processes are covered by the enclosing stage
+of the parent process.
+'''
+from __future__ import annotations
+
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+REPORT_VERSION = 1
+
+
+@dataclass
+class StageStats:
+    """Aggregate of every run of a stage
+    """
+    calls: int = 0
+    seconds: float = 0
+    items: int = 0
+    bytes: int = 0
+
+
+class StageTimer:
+    """Times one run of a stage
+    """
+    __slots__ = ('stats', 'start')
+
+    def __init__(self, stats: StageStats) -> None:
+        self.stats = stats
+        self.start = 0.
+
+    def __enter__(self) -> StageTimer:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stats.seconds += time.perf_counter() - self.start
+        self.stats.calls += 1
+
+    def add(self, *, items: int = 0, nbytes: int = 0) -> None:
+        """Counts items and bytes processed by the stage
+
+        Args:
+            items (int, optional): Items, e.g. records or ensembles.
+            Defaults to 0.
+            nbytes (int, optional): Bytes. Defaults to 0.
+        """
+        self.stats.items += items
+        self.stats.bytes += nbytes
+
+
+class NullTimer:
+    """Stage timer used while profiling is off
+    """
+    __slots__ = ()
+
+    def __enter__(self) -> NullTimer:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+    def add(self, *, items: int = 0, nbytes: int = 0) -> None:
+        """Ignores counts
+
+        Args:
+            items (int, optional): Items. Defaults to 0.
+            nbytes (int, optional): Bytes. Defaults to 0.
+        """
+
+
+class Profiler:
+    """Collects stage statistics
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, StageStats] = {}
+        self.__start = time.perf_counter()
+
+    def stage(self, name: str) -> StageTimer:
+        """Starts a run of a stage
+
+        Args:
+            name (str): Stage name
+
+        Returns:
+            StageTimer: Context manager timing the run
+        """
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return StageTimer(stats)
+
+    def report(self) -> Dict[str, object]:
+        """Builds the JSON report
+
+        Returns:
+            Dict[str, object]: Wall time and per stage statistics, slowest
+            stage first
+        """
+        stages = {}
+        for name, stats in sorted(self.stages.items(),
+                                  key=lambda item: -item[1].seconds):
+            rate = 1 / stats.seconds if stats.seconds > 0 else 0
+            stages[name] = {
+                'calls': stats.calls,
+                'seconds': stats.seconds,
+                'items': stats.items,
+                'bytes': stats.bytes,
+                'items_per_sec': stats.items * rate,
+                'bytes_per_sec': stats.bytes * rate,
+            }
+        return {
+            'version': REPORT_VERSION,
+            'command': sys.argv,
+            'wall_seconds': time.perf_counter() - self.__start,
+            'stages': stages,
+        }
+
+
+__active: Optional[Profiler] = None
+__NULL_TIMER = NullTimer()
+
+
+def stage(name: str):
+    """Starts a run of a stage in the active profiler
+
+    Args:
+        name (str): Stage name
+
+    Returns:
+        StageTimer | NullTimer: Context manager timing the run, whose `add`
+        counts items and bytes
+    """
+    if __active is None:
+        return __NULL_TIMER
+    return __active.stage(name)
+
+
+def active() -> Optional[Profiler]:
+    """Gets the active profiler
+
+    Returns:
+        Optional[Profiler]: Active profiler, None if profiling is off
+    """
+    return __active
+
+
+@contextmanager
+def profile(report_path: Optional[Path]) -> Iterator[Optional[Profiler]]:
+    """Profiles the enclosed code and writes a JSON report
+
+    Args:
+        report_path (Optional[Path]): Report path.  If None, profiling stays
+        off.
+
+    Yields:
+        Iterator[Optional[Profiler]]: Active profiler, or None
+    """
+    global __active  # pylint: disable=global-statement,invalid-name
+    if report_path is None:
+        yield None
+        return
+    previous = __active
+    profiler = __active = Profiler()
+    try:
+        yield profiler
+    finally:
+        __active = previous
+        report = profiler.report()
+        report_path.write_text(json.dumps(report, indent=2),
+                               encoding='utf-8')
+        logger = logging.getLogger('profiling')
+        for name, stats in report['stages'].items():
+            logger.info('%s: %d calls, %.3f s, %d items, %d bytes', name,
+                        stats['calls'], stats['seconds'], stats['items'],
+                        stats['bytes'])
+        logger.info('Wrote profile of %.3f s to %s', report['wall_seconds'],
+                    report_path)
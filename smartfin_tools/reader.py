@@ -0,0 +1,213 @@
+'''Memory-mapped SFP reader
+'''
+from __future__ import annotations
+
+import logging
+import mmap
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.cache import DecodeCache, cached_decode
+from smartfin_tools.container import SfzFile, is_compressed
+from smartfin_tools.index import index_path, read_index, save_index
+from smartfin_tools.schema import get_schema
+
+
+class SfpFile(AbstractContextManager):
+    """Memory-mapped Smartfin Packet file
+
+    The file is mapped rather than read, and columns are only decoded when
+    accessed, e.g. `reader['temp']` or `reader.by_type(9)`.  Decoded columns
+    are cached for the lifetime of the reader.  Compressed SFZ containers are
+    decompressed into memory instead.
+    """
+
+    def __init__(self, path: Path, *, write_sidecar: bool = True) -> None:
+        self.__path = path
+        self.__write_sidecar = write_sidecar
+        self.__handle = open(path, 'rb')  # pylint: disable=consider-using-with
+        self.__map: Optional[mmap.mmap] = None
+        if is_compressed(path):
+            with SfzFile(path) as sfz:
+                self.__buf = np.frombuffer(sfz.read(), dtype=np.uint8)
+        elif path.stat().st_size > 0:
+            self.__map = mmap.mmap(self.__handle.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            self.__buf = np.frombuffer(self.__map, dtype=np.uint8)
+        else:
+            self.__buf = np.zeros(0, dtype=np.uint8)
+        self.__index: Optional[np.ndarray] = None
+        self.__columns: Dict[str, np.ndarray] = {}
+        self.__tables: Dict[int, np.ndarray] = {}
+
+    def __enter__(self) -> SfpFile:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Releases the mapping and file handle
+        """
+        self.__columns.clear()
+        self.__tables.clear()
+        self.__buf = np.zeros(0, dtype=np.uint8)
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__handle.close()
+
+    @property
+    def buffer(self) -> memoryview:
+        """Read-only view of the whole file, without copying
+        """
+        return memoryview(self.__buf)
+
+    @property
+    def index(self) -> np.ndarray:
+        """Ensemble index, loaded from the sidecar or built on first access
+
+        An incomplete trailing ensemble is not indexed, and a warning with its
+        size is logged.
+        """
+        if self.__index is None:
+            sidecar = index_path(self.__path)
+            index = read_index(sidecar, self.__path)
+            if index is None:
+                index = scd.build_index(self.__buf)
+                if self.__write_sidecar:
+                    save_index(sidecar, index, self.__path)
+            self.__index = index
+            self.__check_truncated()
+        return self.__index
+
+    def __check_truncated(self) -> None:
+        start = int(self.__index['offset'][-1]) if len(self.__index) else 0
+        # pylint: disable=protected-access
+        offsets, end, _ = scd._scan_headers(self.__buf, start)
+        if end > len(self.__buf):
+            logger = logging.getLogger('Smartfin Decoder')
+            logger.warning('Ignoring %d bytes of truncated ensemble at index '
+                           '%d of %s', len(self.__buf) - int(offsets[-1]),
+                           int(offsets[-1]), self.__path.as_posix())
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def data_types(self) -> List[int]:
+        """Data types present in the file
+        """
+        return [int(data_type) for data_type in np.unique(
+            self.index['dataType'])]
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Decodes a single column
+
+        Args:
+            name (str): Field name, or `timestamp`/`dataType`
+
+        Raises:
+            KeyError: No ensemble in the file carries the field
+
+        Returns:
+            np.ndarray: Values for every ensemble carrying the field, in file
+            order
+        """
+        if name not in self.__columns:
+            self.__columns[name] = self.__decode_column(name)
+        return self.__columns[name]
+
+    def rows(self, name: str) -> np.ndarray:
+        """Gets the index rows of the ensembles carrying a field
+
+        Args:
+            name (str): Field name
+
+        Returns:
+            np.ndarray: Index rows aligned with `self[name]`
+        """
+        if name in ('timestamp', 'dataType'):
+            return self.index
+        return self.index[np.isin(self.index['dataType'],
+                                  self.__owners(name))]
+
+    def by_type(self, data_type: int) -> np.ndarray:
+        """Decodes all ensembles of a single data type
+
+        Args:
+            data_type (int): Data type
+
+        Returns:
+            np.ndarray: Structured array of payload fields
+        """
+        if data_type not in self.__tables:
+            offsets = self.index['offset'][
+                self.index['dataType'] == data_type].astype(np.int64)
+            decoded = scd.decode_at(self.__buf, offsets)
+            self.__tables[data_type] = decoded.tables.get(
+                data_type, np.zeros(0, dtype=self.__dtype(data_type)))
+        return self.__tables[data_type]
+
+    def decode(self,
+               *,
+               ensemble_filter: Optional[scd.EnsembleFilter] = None,
+               cache: Optional[DecodeCache] = None
+               ) -> scd.ColumnarEnsembles:
+        """Decodes the whole file
+
+        Args:
+            ensemble_filter (Optional[scd.EnsembleFilter], optional): Data
+            types, columns and timestamp range to decode. Defaults to
+            everything.
+            cache (Optional[DecodeCache], optional): Decode cache to consult.
+            Defaults to None.
+
+        Returns:
+            scd.ColumnarEnsembles: Decoded ensembles
+        """
+        return cached_decode(
+            cache, self.__path,
+            lambda: scd.decode_at(self.__buf,
+                                  self.index['offset'].astype(np.int64),
+                                  ensemble_filter=ensemble_filter),
+            variant=f'sfp:{ensemble_filter!r}')
+
+    def __dtype(self, data_type: int) -> np.dtype:
+        if data_type == scd.TEXT_DATA_TYPE:
+            return np.dtype([('text', object)])
+        return get_schema(data_type).dtype
+
+    def __owners(self, name: str) -> List[int]:
+        return [data_type for data_type in self.data_types
+                if name in (self.__dtype(data_type).names or ())]
+
+    def __decode_column(self, name: str) -> np.ndarray:
+        if name == 'timestamp':
+            return self.index['timestamp_ds'] / 10.
+        if name == 'dataType':
+            return self.index['dataType'].copy()
+        owners = self.__owners(name)
+        if not owners:
+            raise KeyError(name)
+        if name == 'text':
+            return self.by_type(scd.TEXT_DATA_TYPE)['text']
+        parts = []
+        offsets = []
+        for data_type in owners:
+            dtype = self.__dtype(data_type)
+            field_dtype, field_offset = dtype.fields[name][:2]
+            type_offsets = self.index['offset'][
+                self.index['dataType'] == data_type].astype(np.int64)
+            byte_idx = (type_offsets + 3 + field_offset)[:, np.newaxis] + \
+                np.arange(field_dtype.itemsize)
+            parts.append(self.__buf[byte_idx].view(field_dtype).reshape(-1))
+            offsets.append(type_offsets)
+        if len(parts) == 1:
+            return parts[0]
+        order = np.argsort(np.concatenate(offsets), kind='stable')
+        return np.concatenate(parts)[order]
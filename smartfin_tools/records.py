@@ -0,0 +1,509 @@
+'''Parallel Smartfin Record decoding
+'''
+import binascii
+import logging
+import mmap
+import os
+from base64 import urlsafe_b64decode
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.cache import DecodeCache, cached_decode
+from smartfin_tools.common import DECODERS, Encoding
+from smartfin_tools.profiling import stage
+
+RANGE_SIZE = 1 << 20
+
+# Decoders that records can be bulk decoded for
+BULK_ENCODINGS: Dict[Callable[[str], bytes], Encoding] = {
+    decoder: encoding for encoding, decoder in DECODERS.items()}
+
+__HEAD_SIZE = 1 << 12
+
+# Standard alphabet, with padding as zero digits
+__B64_TRANSLATE = {
+    Encoding.BASE64: bytes.maketrans(b'=', b'A'),
+    Encoding.BASE64URL: bytes.maketrans(b'-_=', b'+/A'),
+}
+
+__B85_VALUES = np.full(256, 255, dtype=np.uint8)
+__B85_VALUES[list(b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                  b'!#$%&()*+-;<=>?@^_`{|}~')] = np.arange(85)
+__B85_POWERS = 85 ** np.arange(4, -1, -1, dtype=np.uint64)
+
+
+@dataclass
+class RecordPackets:
+    """Decoded records in one contiguous buffer
+
+    Record `i` is `data[offsets[i]:offsets[i + 1]]`.
+    """
+    data: bytes
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> bytes:
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __iter__(self) -> Iterator[bytes]:
+        for begin, end in zip(self.offsets[:-1].tolist(),
+                              self.offsets[1:].tolist()):
+            yield self.data[begin:end]
+
+
+def __drop_tails(data: bytes, sizes: np.ndarray, tails: np.ndarray) -> bytes:
+    """Drops bytes from the end of each record in a buffer
+
+    Args:
+        data (bytes): Concatenated records
+        sizes (np.ndarray): Size of each record
+        tails (np.ndarray): Bytes to drop from the end of each record
+
+    Returns:
+        bytes: Concatenated records without their tails
+    """
+    if not np.any(tails):
+        return data
+    keep = np.ones(len(data), dtype=bool)
+    ends = np.cumsum(sizes)
+    for tail in range(1, int(tails.max()) + 1):
+        keep[ends[tails >= tail] - tail] = False
+    return np.frombuffer(data, dtype=np.uint8)[keep].tobytes()
+
+
+def __b64decode_run(text: bytes,
+                    n_chars: np.ndarray,
+                    n_pads: np.ndarray) -> Optional[bytes]:
+    """Decodes a run of base64 records in one call
+
+    Args:
+        text (bytes): Record text with padding replaced by zero digits
+        n_chars (np.ndarray): Characters in each record, a multiple of 4
+        n_pads (np.ndarray): Padding characters in each record
+
+    Returns:
+        Optional[bytes]: Concatenated records, or None if the text held
+        characters that were skipped
+    """
+    sizes = n_chars // 4 * 3
+    data = binascii.a2b_base64(text)
+    if len(data) != sizes.sum():
+        return None
+    return __drop_tails(data, sizes, n_pads)
+
+
+def __b85decode_run(text: bytes, n_chars: np.ndarray) -> Optional[bytes]:
+    """Decodes a run of base85 records in whole array operations
+
+    Args:
+        text (bytes): Record text
+        n_chars (np.ndarray): Characters in each record
+
+    Returns:
+        Optional[bytes]: Concatenated records, or None if the text is not
+        valid base85
+    """
+    # b85decode rejects whitespace, so only line endings are dropped
+    text = text.translate(None, b'\n')
+    values = __B85_VALUES[np.frombuffer(text, dtype=np.uint8)]
+    if len(values) != n_chars.sum() or np.any(values == 255):
+        return None
+    # Each record's last group is padded with the largest digit and the
+    # padding dropped after decoding, as b85decode does
+    padding = -n_chars % 5
+    values = np.insert(values, np.repeat(np.cumsum(n_chars), padding), 84)
+    groups = values.reshape(-1, 5).astype(np.uint64) @ __B85_POWERS
+    if np.any(groups > 0xFFFFFFFF):
+        return None
+    return __drop_tails(groups.astype('>u4').tobytes(),
+                        (n_chars + padding) // 5 * 4, padding)
+
+
+def decode_records(text: bytes,
+                   decoder: Callable[[str], bytes] = urlsafe_b64decode
+                   ) -> RecordPackets:
+    """Decodes newline separated records in as few calls as possible
+
+    Records of any `Encoding` are decoded together rather than one call per
+    record.  Base64 padding is replaced with zero digits so that `binascii`
+    decodes every record in one call, skipping the newlines between them,
+    and the bytes decoded from padding are then dropped.  Base85 records are
+    decoded in whole array operations.  Malformed records, and runs whose
+    decoded size does not add up, e.g. from stray characters, are decoded
+    record by record, so the result and any error are exactly those of
+    calling `decoder` on each stripped record.
+
+    Args:
+        text (bytes): Record text, one record per line
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Other than the `BULK_ENCODINGS` decoders, records are
+        decoded one at a time. Defaults to urlsafe_b64decode.
+
+    Returns:
+        RecordPackets: Decoded records
+    """
+    with stage('decode_records') as timer:
+        if b'\r' in text:
+            # Universal newlines, as when reading records in text mode
+            text = text.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        buf = np.frombuffer(text, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == ord('\n'))
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.concatenate((newlines, [len(buf)]))
+        if starts[-1] == len(buf):
+            # Trailing newline, not an empty record
+            starts = starts[:-1]
+            ends = ends[:-1]
+        timer.add(items=len(starts), nbytes=len(text))
+
+        def one_by_one(first: int, last: int) -> List[bytes]:
+            return [decoder(text[begin:end].decode('utf-8').strip())
+                    for begin, end in zip(starts[first:last].tolist(),
+                                          ends[first:last].tolist())]
+
+        def pack(packets: List[bytes], sizes: List[int]) -> RecordPackets:
+            return RecordPackets(
+                data=b''.join(packets),
+                offsets=np.concatenate(([0],
+                                        np.cumsum(sizes, dtype=np.int64))))
+
+        encoding = BULK_ENCODINGS.get(decoder)
+        if encoding is None or len(starts) == 0:
+            packets = one_by_one(0, len(starts))
+            return pack(packets, [len(packet) for packet in packets])
+
+        # Whitespace and control characters are few, so count them per record
+        # from their positions
+        spaces = np.flatnonzero(buf <= ord(' '))
+        n_chars = ends - starts - (np.searchsorted(spaces, ends) -
+                                   np.searchsorted(spaces, starts))
+
+        if encoding == Encoding.BASE85:
+            data = __b85decode_run(text, n_chars)
+            if data is None:
+                packets = one_by_one(0, len(starts))
+                return pack(packets, [len(packet) for packet in packets])
+            return pack([data],
+                        n_chars // 5 * 4 + np.maximum(n_chars % 5 - 1, 0))
+
+        # Padding must be at most the last two characters of a record
+        pads = np.flatnonzero(buf == ord('='))
+        padded = np.searchsorted(starts, pads, side='right') - 1
+        n_pads = np.bincount(padded, minlength=len(starts))
+        chars_after = ends[padded] - pads - 1 - (
+            np.searchsorted(spaces, ends[padded]) -
+            np.searchsorted(spaces, pads))
+        malformed = (n_chars % 4 != 0) | (n_pads > 2)
+        malformed[padded[chars_after >= n_pads[padded]]] = True
+
+        bulk_text = text.translate(__B64_TRANSLATE[encoding])
+        sizes = n_chars // 4 * 3 - n_pads
+        bounds = np.flatnonzero(malformed)
+        bounds = np.unique(np.concatenate(([0, len(starts)], bounds,
+                                           bounds + 1)))
+        packets: List[bytes] = []
+        for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            data = None
+            if not malformed[first]:
+                data = __b64decode_run(bulk_text[starts[first]:ends[last - 1]],
+                                       n_chars[first:last], n_pads[first:last])
+            if data is None:
+                run_packets = one_by_one(first, last)
+                sizes[first:last] = [len(packet) for packet in run_packets]
+                data = b''.join(run_packets)
+            packets.append(data)
+        return pack(packets, sizes)
+
+
+def load_records(path: Path,
+                 decoder: Callable[[str], bytes] = urlsafe_b64decode
+                 ) -> RecordPackets:
+    """Reads and decodes a whole SFR file
+
+    Args:
+        path (Path): SFR path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to urlsafe_b64decode.
+
+    Returns:
+        RecordPackets: Decoded records
+    """
+    with stage('read_records') as timer:
+        text = path.read_bytes()
+        timer.add(nbytes=len(text))
+    return decode_records(text, decoder)
+
+
+def iter_records(path: Path,
+                 decoder: Callable[[str], bytes] = urlsafe_b64decode,
+                 chunk_size: int = RANGE_SIZE) -> Iterator[RecordPackets]:
+    """Reads and decodes an SFR file a bounded chunk of records at a time
+
+    Args:
+        path (Path): SFR path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to urlsafe_b64decode.
+        chunk_size (int, optional): Text read per chunk in bytes, rounded up
+        to the end of a record. Defaults to RANGE_SIZE.
+
+    Yields:
+        Iterator[RecordPackets]: Decoded records of each chunk, in order
+    """
+    with open(path, 'rb') as sfr:
+        while True:
+            with stage('read_records') as timer:
+                text = sfr.read(chunk_size)
+                text += sfr.readline()
+                timer.add(nbytes=len(text))
+            if not text:
+                return
+            yield decode_records(text, decoder)
+
+
+def _decoder_id(decoder: Callable[[str], bytes]) -> Optional[str]:
+    """Names a record decoder the same way in every process and run
+
+    Args:
+        decoder (Callable[[str], bytes]): Record Ascii to binary decoder
+
+    Returns:
+        Optional[str]: Decoder name, or None if the decoder is anonymous
+        (e.g. a lambda or closure) and so cannot be told apart from others
+    """
+    encoding = BULK_ENCODINGS.get(decoder)
+    if encoding is not None:
+        return str(encoding)
+    qualname = getattr(decoder, '__qualname__', '<unknown>')
+    if '<' in qualname:
+        return None
+    return f'{decoder.__module__}.{qualname}'
+
+
+@dataclass
+class _RangeResult:
+    """Decode of one record range
+
+    `chunk` is None if the text of an ensemble past the head could not be
+    decoded, which may only be because the range was decoded misaligned.
+    """
+    chunk: Optional[scd.ColumnarEnsembles]
+    chain_head: np.ndarray
+    head: bytes
+    tail: bytes
+    size: int
+
+
+def record_ranges(path: Path, n_ranges: int) -> List[Tuple[int, int]]:
+    """Splits an SFR file into byte ranges of whole records
+
+    Args:
+        path (Path): SFR path
+        n_ranges (int): Desired number of ranges
+
+    Returns:
+        List[Tuple[int, int]]: `[begin, end)` byte ranges in file order.  There
+        may be fewer than requested if records are long.
+    """
+    size = path.stat().st_size
+    if size == 0:
+        return []
+    bounds = [0]
+    with open(path, 'rb') as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for idx in range(1, n_ranges):
+                newline = data.find(b'\n', max(idx * size // n_ranges,
+                                               bounds[-1]))
+                if newline < 0:
+                    break
+                if newline + 1 > bounds[-1]:
+                    bounds.append(newline + 1)
+    if bounds[-1] != size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _decode_range(path: Path,
+                  begin: int,
+                  end: int,
+                  decoder: Callable[[str], bytes],
+                  ensemble_filter: Optional[scd.EnsembleFilter],
+                  start: Optional[int] = None) -> _RangeResult:
+    """Decodes the records in a byte range of an SFR file
+
+    Without a known start, the range is assumed to start on an ensemble
+    boundary, and the ensembles that end within the head are left to
+    `decode_sfr` to decode from the bridge.
+
+    Args:
+        path (Path): SFR path
+        begin (int): First byte of the range
+        end (int): End of the range
+        decoder (Callable[[str], bytes]): Record Ascii to binary decoder
+        ensemble_filter (Optional[scd.EnsembleFilter]): Selection to apply
+        start (Optional[int], optional): Offset of the first ensemble header
+        in the decoded range, if known. Defaults to None.
+
+    Returns:
+        _RangeResult: Ensembles with offsets relative to the range, the start
+        of the header chain, the leading bytes and the trailing partial
+        ensemble
+    """
+    with stage('read_records') as timer, open(path, 'rb') as handle:
+        handle.seek(begin)
+        text = handle.read(end - begin)
+        timer.add(nbytes=len(text))
+    data = decode_records(text, decoder).data
+    buf = np.frombuffer(data, dtype=np.uint8)
+    head = data[:__HEAD_SIZE]
+    # pylint: disable=protected-access
+    offsets, stop, _ = scd._scan_headers(buf, start or 0)
+    if stop > len(buf):
+        stop = int(offsets[-1])
+        offsets = offsets[:-1]
+    stop = min(stop, len(buf))
+    if start is None:
+        # The chain may start misaligned, so the ensembles that end within
+        # the head can be garbage.  `decode_sfr` decodes those from the
+        # bridge instead.
+        ends = np.append(offsets[1:], stop)[:len(offsets)]
+        gathered = offsets[ends > len(head)]
+    else:
+        gathered = offsets
+    chunk: Optional[scd.ColumnarEnsembles] = None
+    try:
+        chunk = scd._gather_ensembles(buf, gathered, ensemble_filter)
+    except UnicodeDecodeError:
+        if start is not None:
+            raise
+        # Misaligned garbage, or bad text that `decode_sfr` raises once it
+        # has decoded the range again from the true chain
+    return _RangeResult(
+        chunk=chunk,
+        chain_head=offsets[offsets < __HEAD_SIZE],
+        head=head,
+        tail=data[stop:],
+        size=len(data)
+    )
+
+
+def decode_sfr(path: Path,
+               *,
+               decoder: Callable[[str], bytes] = urlsafe_b64decode,
+               ensemble_filter: Optional[scd.EnsembleFilter] = None,
+               workers: Optional[int] = None,
+               range_size: int = RANGE_SIZE,
+               cache: Optional[DecodeCache] = None) -> scd.ColumnarEnsembles:
+    """Decodes an SFR file, splitting its records over worker processes
+
+    The records are treated as one stream, as in `scd.decode_stream`, so
+    ensembles bridged across records are reassembled.  Each worker decodes a
+    range of records assuming it starts on an ensemble boundary.  The ranges
+    are then stitched in order.  The true header chain is followed across
+    each boundary through the leading bytes of the next range, and the
+    ensembles ending within them are decoded here, provided the chain meets
+    the worker's chain there.  Otherwise, that range is decoded again from
+    the right offset.  Text is decoded strictly, as in `scd.decode_stream`.
+
+    Args:
+        path (Path): SFR path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Must be picklable. Defaults to urlsafe_b64decode.
+        ensemble_filter (Optional[scd.EnsembleFilter], optional): Data types,
+        columns and timestamp range to decode. Defaults to everything.
+        workers (Optional[int], optional): Worker processes. Defaults to the
+        CPU count. A single worker decodes the ranges in process.
+        range_size (int, optional): Target size of each record range in
+        bytes, which bounds the text held at once. Defaults to RANGE_SIZE.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Anonymous decoders bypass it. Defaults to None.
+
+    Returns:
+        scd.ColumnarEnsembles: Decoded ensembles, identical to decoding the
+        records serially
+    """
+    decoder_id = _decoder_id(decoder) if cache is not None else None
+    if decoder_id is not None:
+        return cached_decode(
+            cache, path,
+            lambda: decode_sfr(path, decoder=decoder,
+                               ensemble_filter=ensemble_filter,
+                               workers=workers, range_size=range_size),
+            variant=f'sfr:{decoder_id}:{ensemble_filter!r}')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    size = path.stat().st_size
+    ranges = record_ranges(path, max(1, -(-size // range_size)))
+    parts: List[scd.ColumnarEnsembles] = []
+    pending = b''
+    position = 0
+    with stage('decode_sfr') as timer, ExitStack() as stack:
+        timer.add(items=len(ranges), nbytes=size)
+        if workers > 1 and len(ranges) > 1:
+            pool = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers))
+            futures = [pool.submit(_decode_range, path, begin, end, decoder,
+                                   ensemble_filter)
+                       for begin, end in ranges]
+            results = (future.result() for future in futures)
+        else:
+            results = (_decode_range(path, begin, end, decoder,
+                                     ensemble_filter)
+                       for begin, end in ranges)
+        for (begin, end), result in zip(ranges, results):
+            data = pending + result.head
+            buf = np.frombuffer(data, dtype=np.uint8)
+            # pylint: disable=protected-access
+            offsets, stop, _ = scd._scan_headers(buf)
+            if result.size == len(result.head):
+                # Whole range fits in its head, so decode it here
+                if stop > len(buf):
+                    stop = int(offsets[-1])
+                    offsets = offsets[:-1]
+                bridged = scd._gather_ensembles(buf, offsets,
+                                                ensemble_filter)
+                bridged.offsets += position - len(pending)
+                parts.append(bridged)
+                pending = data[min(stop, len(buf)):]
+                position += result.size
+                continue
+
+            # Ensembles on the true chain that end within the head come from
+            # the bridge, the rest from the worker once the chains meet
+            true_offsets = offsets - len(pending)
+            meets = true_offsets[np.isin(true_offsets, result.chain_head)]
+            if len(meets) > 0 and result.chunk is not None:
+                if stop > len(buf):
+                    stop = int(offsets[-1])
+                boundary = min(stop, len(buf)) - len(pending)
+            else:
+                boundary = int(meets[0]) if len(meets) > 0 \
+                    else int(true_offsets[true_offsets >= 0][0])
+                result = _decode_range(path, begin, end, decoder,
+                                       ensemble_filter, boundary)
+            bridged = scd._gather_ensembles(buf,
+                                            offsets[true_offsets < boundary],
+                                            ensemble_filter)
+            bridged.offsets += position - len(pending)
+            parts.append(bridged)
+            chunk = result.chunk
+            assert chunk is not None
+            if boundary > 0:
+                chunk = chunk.select(chunk.offsets >= boundary)
+            chunk.offsets += position
+            parts.append(chunk)
+            pending = result.tail
+            position += result.size
+
+    if len(pending) >= 3:
+        logger = logging.getLogger('Smartfin Decoder')
+        logger.warning('Discarding %d bytes of truncated ensemble at index %d',
+                       len(pending), position - len(pending))
+    return scd.ColumnarEnsembles.concat(parts)
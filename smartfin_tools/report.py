@@ -0,0 +1,264 @@
+'''Single pass session report
+
+Walks a session once, checksumming it and following the ensemble chain the
+same way `decode_packet` does, to report what a session holds and how
+healthy it is without converting or plotting it.
+'''
+import binascii
+from base64 import urlsafe_b64decode
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.common import FileFormats
+from smartfin_tools.container import SfzFile, is_compressed
+from smartfin_tools.records import decode_records
+from smartfin_tools.schema import (HEADER_SIZE, PADDING_DATA_TYPE,
+                                   TEXT_DATA_TYPE, schemas, valid_types)
+from smartfin_tools.timebase import unwrap_timestamps, utc_time
+
+REPORT_VERSION = 1
+CHUNK_SIZE = 1 << 22
+
+# Counter steps forward by more than this are reported as gaps
+GAP_THRESHOLD_DS = 100
+
+# Longest gap, rollback and unknown span lists kept in a report.  Totals are
+# always complete.
+MAX_LISTED = 1000
+
+
+def __sfp_chunks(path: Path, chunk_size: int
+                 ) -> Iterator[Tuple[bytes, bytes, int]]:
+    with open(path, 'rb') as handle:
+        while chunk := handle.read(chunk_size):
+            yield chunk, chunk, 0
+
+
+def __sfz_chunks(path: Path) -> Iterator[Tuple[bytes, bytes, int]]:
+    with SfzFile(path) as sfz:
+        for block in sfz.iter_blocks():
+            yield b'', block, 0
+
+
+def __sfr_chunks(path: Path,
+                 chunk_size: int,
+                 decoder: Callable[[str], bytes]
+                 ) -> Iterator[Tuple[bytes, bytes, int]]:
+    with open(path, 'rb') as sfr:
+        while text := sfr.read(chunk_size):
+            text += sfr.readline()
+            packets = decode_records(text, decoder)
+            yield text, packets.data, len(packets)
+
+
+def __spans(offsets: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Merges back to back `[offset, offset + size)` spans
+
+    Args:
+        offsets (np.ndarray): Span starts in ascending order
+        sizes (np.ndarray): Span sizes
+
+    Returns:
+        np.ndarray: Merged `[start, stop)` spans
+    """
+    if len(offsets) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    stops = offsets + sizes
+    breaks = np.flatnonzero(offsets[1:] != stops[:-1]) + 1
+    return np.column_stack((offsets[np.concatenate(([0], breaks))],
+                            stops[np.append(breaks - 1, len(stops) - 1)]))
+
+
+def __time_report(ensembles: scd.ColumnarEnsembles,
+                  gap_threshold_ds: int) -> Dict[str, object]:
+    """Summarizes the header timestamps
+
+    Args:
+        ensembles (scd.ColumnarEnsembles): Decoded ensembles
+        gap_threshold_ds (int): Smallest forward step reported as a gap
+
+    Returns:
+        Dict[str, object]: Time coverage, gaps and rollbacks
+    """
+    if len(ensembles) == 0:
+        return {'start_s': None, 'end_s': None, 'duration_s': 0,
+                'covered_s': 0, 'coverage': None, 'rollovers': 0,
+                'utc_start': None, 'utc_end': None,
+                'gap_count': 0, 'gaps': [],
+                'rollback_count': 0, 'rollbacks': []}
+    raw_ds = ensembles.timestamp_ds.astype(np.int64)
+    unwrapped = unwrap_timestamps(raw_ds)
+    steps = np.diff(unwrapped)
+    gaps = np.flatnonzero(steps > gap_threshold_ds)
+    rollbacks = np.flatnonzero(steps < 0)
+    start_ds = int(unwrapped.min())
+    duration_ds = int(unwrapped.max()) - start_ds
+    covered_ds = duration_ds - int(steps[gaps].sum())
+    try:
+        utc = utc_time(ensembles)
+        utc_start, utc_end = utc.min().isoformat(), utc.max().isoformat()
+    except ValueError:
+        utc_start = utc_end = None
+    return {
+        'start_s': start_ds / 10,
+        'end_s': int(unwrapped.max()) / 10,
+        'duration_s': duration_ds / 10,
+        'covered_s': covered_ds / 10,
+        'coverage': covered_ds / duration_ds if duration_ds > 0 else 1.,
+        'rollovers': int((np.diff(raw_ds) <
+                          -(scd.COUNTER_PERIOD_DS // 2)).sum()),
+        'utc_start': utc_start,
+        'utc_end': utc_end,
+        'gap_count': len(gaps),
+        'gaps': [{'offset': int(ensembles.offsets[idx + 1]),
+                  'start_s': int(unwrapped[idx]) / 10,
+                  'duration_s': int(steps[idx]) / 10}
+                 for idx in gaps[:MAX_LISTED].tolist()],
+        'rollback_count': len(rollbacks),
+        'rollbacks': [{'offset': int(ensembles.offsets[idx + 1]),
+                       'at_s': int(unwrapped[idx]) / 10,
+                       'step_s': int(steps[idx]) / 10}
+                      for idx in rollbacks[:MAX_LISTED].tolist()],
+    }
+
+
+def session_report(path: Path,
+                   *,
+                   decoder: Callable[[str], bytes] = urlsafe_b64decode,
+                   chunk_size: int = CHUNK_SIZE,
+                   gap_threshold_ds: int = GAP_THRESHOLD_DS
+                   ) -> Dict[str, object]:
+    """Reports on a session's integrity and content in one pass
+
+    The file is read once, in chunks.  Each chunk is checksummed and its
+    ensemble chain walked as `decode_packet` walks it, so padding bytes and
+    unknown data type headers are exactly those the decoder steps over.
+    Only headers, type 8 times and text messages are decoded.  Text that is
+    not valid UTF-8 is reported with replacement characters and counted in
+    `text_undecodable` rather than failing the report.
+
+    Args:
+        path (Path): SFR, SFP or SFZ path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder for SFR files. Defaults to urlsafe_b64decode.
+        chunk_size (int, optional): Bytes read at a time. Defaults to
+        CHUNK_SIZE.
+        gap_threshold_ds (int, optional): Smallest counter step forward (ds)
+        reported as a gap. Defaults to GAP_THRESHOLD_DS.
+
+    Raises:
+        ValueError: A compressed block is corrupt
+
+    Returns:
+        Dict[str, object]: JSON serializable report.  `file_crc32` is the
+        CRC32 of the file as stored, and `sfp_crc32` that of its SFP bytes,
+        as printed by `sfVerify`.  Offsets are into the SFP bytes.
+        `trailing_bytes` follow the last complete ensemble.
+    """
+    if is_compressed(path):
+        file_format = FileFormats.SFZ
+        chunks = __sfz_chunks(path)
+    elif path.suffix.lower() == FileFormats.SFR.value:
+        file_format = FileFormats.SFR
+        chunks = __sfr_chunks(path, chunk_size, decoder)
+    else:
+        file_format = FileFormats.SFP
+        chunks = __sfp_chunks(path, chunk_size)
+
+    projection = scd.EnsembleFilter(
+        data_types=[*schemas(), TEXT_DATA_TYPE],
+        columns=('time', 'text'))
+    valid = valid_types()
+    file_crc = 0
+    sfp_crc = 0
+    n_records = 0
+    padding_bytes = 0
+    padding_runs = 0
+    after_padding = False
+    unknown_offsets: List[np.ndarray] = []
+    unknown_types: List[np.ndarray] = []
+    parts: List[scd.ColumnarEnsembles] = []
+    pending = b''
+    position = 0
+    for raw, packet, records in chunks:
+        file_crc = binascii.crc32(raw, file_crc)
+        sfp_crc = binascii.crc32(packet, sfp_crc)
+        n_records += records
+        data = pending + packet
+        buf = np.frombuffer(data, dtype=np.uint8)
+        # pylint: disable=protected-access
+        offsets, end, _ = scd._scan_headers(buf)
+        if end > len(buf):
+            # Last ensemble is bridged into the next chunk
+            end = int(offsets[-1])
+            offsets = offsets[:-1]
+        end = min(end, len(buf))
+
+        data_types = buf[offsets] & 0x0F
+        padding = data_types == PADDING_DATA_TYPE
+        padding_bytes += int(padding.sum())
+        if len(padding) > 0:
+            padding_runs += int((padding[1:] & ~padding[:-1]).sum()) + \
+                int(padding[0] and not after_padding)
+            after_padding = bool(padding[-1])
+        unknown = ~valid[data_types] & ~padding
+        unknown_offsets.append(offsets[unknown] + position)
+        unknown_types.append(data_types[unknown])
+
+        part = scd._gather_ensembles(buf, offsets[valid[data_types]],
+                                     projection, text_errors='replace')
+        part.offsets += position
+        parts.append(part)
+        pending = data[end:]
+        position += end
+
+    ensembles = scd.ColumnarEnsembles.concat(parts)
+    unknown_offsets = np.concatenate(unknown_offsets) if unknown_offsets \
+        else np.zeros(0, dtype=np.int64)
+    unknown_types = np.concatenate(unknown_types) if unknown_types \
+        else np.zeros(0, dtype=np.uint8)
+    spans = __spans(unknown_offsets,
+                    np.full(len(unknown_offsets), HEADER_SIZE))
+    types, counts = np.unique(ensembles.data_type, return_counts=True)
+    bad_types, bad_counts = np.unique(unknown_types, return_counts=True)
+    texts = ensembles.tables.get(TEXT_DATA_TYPE)
+    text_rows = np.flatnonzero(ensembles.data_type == TEXT_DATA_TYPE)
+
+    report: Dict[str, object] = {
+        'version': REPORT_VERSION,
+        'path': str(path),
+        'format': file_format.value,
+        'size_bytes': path.stat().st_size,
+        'file_crc32': None if file_format == FileFormats.SFZ
+        else f'{file_crc & 0xFFFFFFFF:08X}',
+        'sfp_crc32': f'{sfp_crc & 0xFFFFFFFF:08X}',
+        'sfp_bytes': position + len(pending),
+    }
+    if file_format == FileFormats.SFR:
+        report['records'] = n_records
+    report.update({
+        'ensembles': len(ensembles),
+        'ensembles_by_type': {str(data_type): count for data_type, count
+                              in zip(types.tolist(), counts.tolist())},
+        'padding_bytes': padding_bytes,
+        'padding_runs': padding_runs,
+        'unknown_bytes': len(unknown_offsets) * HEADER_SIZE,
+        'unknown_by_type': {str(data_type): count for data_type, count
+                            in zip(bad_types.tolist(), bad_counts.tolist())},
+        'unknown_span_count': len(spans),
+        'unknown_spans': spans[:MAX_LISTED].tolist(),
+        'trailing_bytes': len(pending),
+        'time': __time_report(ensembles, gap_threshold_ds),
+        'text_undecodable': 0 if texts is None else
+        sum('\ufffd' in text for text in texts['text'].tolist()),
+        'text': [] if texts is None else [
+            {'offset': int(ensembles.offsets[row]),
+             'timestamp_s': int(ensembles.timestamp_ds[row]) / 10,
+             'text': text}
+            for row, text in zip(text_rows.tolist(), texts['text'].tolist())
+        ],
+    })
+    return report
@@ -0,0 +1,359 @@
+'''Ensemble schema registry
+
+Each ensemble data type is compiled once, at registration, into a
+`struct.Struct`, a matching packed NumPy dtype and its SI conversion vectors.
+The decoders, `convert_to_si` and the encoders all read from this registry.
+'''
+import hashlib
+import re
+import struct
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TEXT_DATA_TYPE = 0x0F
+PADDING_DATA_TYPE = 0x00
+HEADER_SIZE = 3
+
+__dtypeCodes = {
+    '?': '?',
+    'b': 'i1',
+    'B': 'u1',
+    'h': '<i2',
+    'H': '<u2',
+    'i': '<i4',
+    'I': '<u4',
+    'l': '<i4',
+    'L': '<u4',
+    'q': '<i8',
+    'Q': '<u8',
+    'e': '<f2',
+    'f': '<f4',
+    'd': '<f8',
+    'c': 'S1',
+}
+__formatCode = re.compile(r'\s*(\d*)(.)')
+
+
+@dataclass(frozen=True)
+class SiUnit:
+    """SI conversion for a raw column
+
+    Values convert as `raw * scale / divisor`, or `raw > 0` for flags.
+    """
+    label: str
+    scale: float = 1.0
+    divisor: float = 1.0
+    flag: bool = False
+
+    def convert(self, values):
+        """Converts raw values to SI
+
+        Args:
+            values: Raw values (scalar, array or Series)
+
+        Returns:
+            Converted values
+        """
+        if self.flag:
+            return values > 0
+        return values * self.scale / self.divisor
+
+
+@dataclass(frozen=True)
+class EnsembleSchema:
+    """Compiled ensemble layout for a single data type
+    """
+    # pylint: disable=too-many-instance-attributes
+    # Compiled representation
+    data_type: int
+    fmt: str
+    names: Tuple[str, ...]
+    struct: struct.Struct
+    dtype: np.dtype
+    si_labels: Tuple[Optional[str], ...]
+    si_scales: np.ndarray
+    si_divisors: np.ndarray
+    si_flags: np.ndarray
+
+    @property
+    def size(self) -> int:
+        """Payload size in bytes, excluding the header
+        """
+        return self.struct.size
+
+
+def struct_to_dtype(fmt: str, names: Sequence[str]) -> np.dtype:
+    """Builds a packed little endian structured dtype from a struct format
+
+    Repeat counts expand to one field per repetition, except for `s`, which
+    is a single bytes field of that length.  Pad bytes (`x`) take space
+    without a field.
+
+    Args:
+        fmt (str): Little endian struct format string
+        names (Sequence[str]): Field names
+
+    Raises:
+        ValueError: Unsupported format or mismatched names
+
+    Returns:
+        np.dtype: Structured dtype with the same layout as `fmt`
+    """
+    if not fmt:
+        return np.dtype({'names': [], 'formats': []})
+    if fmt[0] != '<':
+        raise ValueError(f'Format must be little endian: {fmt}')
+    try:
+        struct.calcsize(fmt)
+    except struct.error as exc:
+        raise ValueError(f'Invalid format {fmt}: {exc}') from exc
+    formats: List[str] = []
+    offsets: List[int] = []
+    offset = 0
+    for match in __formatCode.finditer(fmt.rstrip(), 1):
+        count = int(match.group(1)) if match.group(1) else 1
+        code = match.group(2)
+        if code == 'x':
+            # Pad bytes take space but no field
+            offset += count
+        elif code == 's':
+            formats.append(f'S{count}')
+            offsets.append(offset)
+            offset += count
+        elif code in __dtypeCodes:
+            item = np.dtype(__dtypeCodes[code])
+            formats.extend([__dtypeCodes[code]] * count)
+            offsets.extend(range(offset, offset + count * item.itemsize,
+                                 item.itemsize))
+            offset += count * item.itemsize
+        else:
+            raise ValueError(f'Unsupported format code {code!r} in {fmt}')
+    if len(formats) != len(names):
+        raise ValueError(f'{fmt} has {len(formats)} fields, '
+                         f'got {len(names)} names')
+    return np.dtype({'names': list(names), 'formats': formats,
+                     'offsets': offsets, 'itemsize': offset})
+
+
+__unitTable: Dict[str, SiUnit] = {}
+si_conversions: Dict[str, Tuple[str, Callable]] = {}
+__schemaTable: Dict[int, EnsembleSchema] = {}
+
+# Bytes consumed by the ensemble starting with each data type nibble.  Text
+# ensembles additionally consume their length byte's worth of payload, padding
+# steps forward by a single byte, and unknown types consume only the header.
+__stepTable = np.array([
+    1 if data_type == PADDING_DATA_TYPE
+    else HEADER_SIZE + 1 if data_type == TEXT_DATA_TYPE
+    else HEADER_SIZE
+    for data_type in range(16)
+], dtype=np.int64)
+__validTable = np.arange(16) == TEXT_DATA_TYPE
+
+
+def register_unit(name: str, unit: SiUnit) -> None:
+    """Registers the SI conversion for a raw column name
+
+    Schemas registered afterwards pick up the conversion.
+
+    Args:
+        name (str): Raw column name
+        unit (SiUnit): SI conversion
+    """
+    __unitTable[name] = unit
+    si_conversions[name] = (unit.label, unit.convert)
+
+
+def get_unit(name: str) -> Optional[SiUnit]:
+    """Gets the SI conversion for a raw column name
+
+    Args:
+        name (str): Raw column name
+
+    Returns:
+        Optional[SiUnit]: SI conversion, or None if the column has no unit
+    """
+    return __unitTable.get(name)
+
+
+def register_schema(data_type: int,
+                    fmt: str,
+                    names: Sequence[str],
+                    *,
+                    replace: bool = False) -> EnsembleSchema:
+    """Registers and compiles an ensemble data type
+
+    Args:
+        data_type (int): Data type nibble, 0x01 through 0x0E
+        fmt (str): Little endian struct format of the payload
+        names (Sequence[str]): Payload field names
+        replace (bool, optional): Allow replacing an existing registration.
+        Defaults to False.
+
+    Raises:
+        ValueError: Reserved or already registered data type, or invalid
+        format
+
+    Returns:
+        EnsembleSchema: Compiled schema
+    """
+    if not PADDING_DATA_TYPE < data_type < TEXT_DATA_TYPE:
+        raise ValueError(f'Data type {data_type} is reserved or out of range')
+    if data_type in __schemaTable and not replace:
+        raise ValueError(f'Data type {data_type} is already registered')
+    names = tuple(names)
+    dtype = struct_to_dtype(fmt, names)
+    units = [__unitTable.get(name) for name in names]
+    schema = EnsembleSchema(
+        data_type=data_type,
+        fmt=fmt,
+        names=names,
+        struct=struct.Struct(fmt),
+        dtype=dtype,
+        si_labels=tuple(unit.label if unit else None for unit in units),
+        si_scales=np.array([unit.scale if unit else np.nan
+                            for unit in units], dtype=np.float64),
+        si_divisors=np.array([unit.divisor if unit else np.nan
+                              for unit in units], dtype=np.float64),
+        si_flags=np.array([unit.flag if unit else False for unit in units],
+                          dtype=bool),
+    )
+    __schemaTable[data_type] = schema
+    __stepTable[data_type] = HEADER_SIZE + schema.size
+    __validTable[data_type] = True
+    return schema
+
+
+def unregister_schema(data_type: int) -> EnsembleSchema:
+    """Removes a registered data type
+
+    Ensembles of the data type are treated as unknown again.
+
+    Args:
+        data_type (int): Data type
+
+    Raises:
+        KeyError: Data type is not registered
+
+    Returns:
+        EnsembleSchema: Removed schema
+    """
+    schema = __schemaTable.pop(data_type)
+    __stepTable[data_type] = HEADER_SIZE
+    __validTable[data_type] = False
+    return schema
+
+
+def get_schema(data_type: int) -> EnsembleSchema:
+    """Gets the compiled schema for a data type
+
+    Args:
+        data_type (int): Data type
+
+    Returns:
+        EnsembleSchema: Compiled schema
+    """
+    return __schemaTable[data_type]
+
+
+def schemas() -> Dict[int, EnsembleSchema]:
+    """Gets all registered schemas
+
+    Returns:
+        Dict[int, EnsembleSchema]: Compiled schemas by data type
+    """
+    return dict(__schemaTable)
+
+
+def ensemble_steps() -> np.ndarray:
+    """Gets the per data type nibble ensemble length lookup table
+
+    Returns:
+        np.ndarray: Bytes consumed by an ensemble, indexed by data type.  Text
+        ensembles consume their length byte's worth in addition.
+    """
+    return __stepTable
+
+
+def valid_types() -> np.ndarray:
+    """Gets the per data type nibble validity lookup table
+
+    Returns:
+        np.ndarray: True for registered and text data types
+    """
+    return __validTable
+
+
+def schema_fingerprint() -> str:
+    """Fingerprints the registered schemas
+
+    Decoded results depend on the registered layouts, so anything persisted
+    from a decode should be keyed on this.
+
+    Returns:
+        str: Hex digest of every registered data type, format and field name
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for data_type, schema in sorted(__schemaTable.items()):
+        digest.update(repr((data_type, schema.fmt, schema.names)).encode())
+    return digest.hexdigest()
+
+
+def max_ensemble_size() -> int:
+    """Gets the largest possible ensemble size, including text ensembles
+
+    Returns:
+        int: Maximum ensemble size in bytes
+    """
+    return max(int(__stepTable.max()), HEADER_SIZE + 1 + 0xFF)
+
+
+def _register_builtin_units() -> None:
+    """Registers the SI conversions for the built-in data types
+    """
+    register_unit('timestamp', SiUnit('Timestamp (s)'))
+    register_unit('timestamp_ds', SiUnit('Timestamp (s)', divisor=10))
+    register_unit('temp', SiUnit('Temperature (C)', divisor=128))
+    register_unit('water', SiUnit('Water Detect', flag=True))
+    for axis in 'xyz':
+        label = axis.upper()
+        register_unit(f'{axis}Acc',
+                      SiUnit(f'{label} Acceleration (m/s^2)', divisor=16384))
+        register_unit(f'{axis}Gyro',
+                      SiUnit(f'{label} Angular Velocity (deg/s)',
+                             divisor=131.072))
+        register_unit(f'{axis}Mag',
+                      SiUnit(f'{label} Magnetic Field (uT)', scale=0.15))
+        register_unit(f'{axis}AccQ10',
+                      SiUnit(f'{label} Acceleration (m/s^2)', divisor=1024))
+        register_unit(f'{axis}GyroQ7',
+                      SiUnit(f'{label} Angular Velocity (deg/s)',
+                             divisor=128))
+        register_unit(f'{axis}MagQ3',
+                      SiUnit(f'{label} Magnetic Field (uT)', divisor=8))
+
+
+_register_builtin_units()
+register_schema(1, '<hb', ['temp', 'water'])
+register_schema(2, '<bbb', ['rawXAcc', 'rawYAcc', 'rawZAcc'])
+register_schema(3, '', [])
+register_schema(4, '<hbbbb', ['temp', 'water', 'rawXAcc', 'rawYAcc',
+                              'rawZAcc'])
+register_schema(5, '', [])
+register_schema(6, '<hbbbbii', ['temp', 'water', 'rawXAcc', 'rawYAcc',
+                                'rawZAcc', 'lat', 'lon'])
+register_schema(7, '<H', ['battery'])
+register_schema(8, '<hbI', ['temp', 'water', 'time'])
+register_schema(9, '<hhhhhhhhh', ['xAcc', 'yAcc', 'zAcc', 'xGyro', 'yGyro',
+                                  'zGyro', 'xMag', 'yMag', 'zMag'])
+register_schema(10, '<hbhhhhhhhhh', ['temp', 'water', 'xAcc', 'yAcc', 'zAcc',
+                                     'xGyro', 'yGyro', 'zGyro', 'xMag',
+                                     'yMag', 'zMag'])
+register_schema(11, '<hbhhhhhhhhhii', ['temp', 'water', 'xAcc', 'yAcc',
+                                       'zAcc', 'xGyro', 'yGyro', 'zGyro',
+                                       'xMag', 'yMag', 'zMag', 'lat', 'lon'])
+register_schema(0x0C, '<hhhhhhhhh', ['xAccQ10', 'yAccQ10', 'zAccQ10',
+                                     'xAngQ7', 'yAngQ7', 'zAngQ7',
+                                     'xMagQ3', 'yMagQ3', 'zMagQ3'])
@@ -0,0 +1,302 @@
+'''Smartfin decoder benchmarks
+
+Times the decode pipeline stages on a synthetic session and compares the
+results against a saved JSON baseline.
+'''
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import smartfin_tools.decoder as scd
+from smartfin_tools import __version__
+from smartfin_tools.common import DECODERS, Encoding
+from smartfin_tools.config import configure_logging
+from smartfin_tools.sfConvert import sfr_to_csv
+from smartfin_tools.sfGenerate import (SyntheticSession, generate_session,
+                                       parse_mix)
+
+BASELINE_VERSION = 1
+
+# A benchmark's setup runs untimed before each repeat and returns the timed
+# call
+Benchmark = Callable[[SyntheticSession, Encoding, Path], Callable[[], None]]
+
+
+@dataclass
+class BenchmarkResult:
+    """Timing of one benchmark
+    """
+    seconds: float
+    ensembles_per_sec: float
+    peak_bytes: int
+
+
+def _decode_packet(session: SyntheticSession,
+                   encoding: Encoding,
+                   work_dir: Path) -> Callable[[], None]:
+    # pylint: disable=unused-argument
+    packet = session.packet
+    return lambda: scd.decode_packet(packet)
+
+
+def _strip_padding(session: SyntheticSession,
+                   encoding: Encoding,
+                   work_dir: Path) -> Callable[[], None]:
+    # pylint: disable=unused-argument
+    records = session.records
+
+    def run():
+        for record in records:
+            scd.strip_padding(record)
+    return run
+
+
+def _convert_to_si(session: SyntheticSession,
+                   encoding: Encoding,
+                   work_dir: Path) -> Callable[[], None]:
+    # pylint: disable=unused-argument
+    df = scd.decode_columns(session.packet).to_dataframe()
+    return lambda: scd.convert_to_si(df.copy())
+
+
+def _sfr_to_csv(session: SyntheticSession,
+                encoding: Encoding,
+                work_dir: Path) -> Callable[[], None]:
+    sfr_path = work_dir / 'session.sfr'
+    if not sfr_path.exists():
+        session.write(sfr_path, encoding=encoding)
+    return lambda: sfr_to_csv(sfr_path, work_dir / 'session.csv',
+                              decoder=DECODERS[encoding])
+
+
+def _plot_file(session: SyntheticSession,
+               encoding: Encoding,
+               work_dir: Path) -> Callable[[], None]:
+    # Deferred, matplotlib is slow to import and only needed here
+    # pylint: disable=import-outside-toplevel
+    from smartfin_tools.sfPlotter import plotFile
+    sfr_path = work_dir / 'session.sfr'
+    if not sfr_path.exists():
+        session.write(sfr_path, encoding=encoding)
+    return lambda: plotFile(sfr_path, work_dir / 'plots',
+                            decoder=DECODERS[encoding])
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'decode_packet': _decode_packet,
+    'strip_padding': _strip_padding,
+    'convert_to_si': _convert_to_si,
+    'sfr_to_csv': _sfr_to_csv,
+    'plotFile': _plot_file,
+}
+
+
+def time_benchmark(benchmark: Benchmark,
+                   session: SyntheticSession,
+                   encoding: Encoding,
+                   work_dir: Path,
+                   *,
+                   repeats: int = 3) -> BenchmarkResult:
+    """Times a benchmark
+
+    The time is the best of `repeats` runs.  Peak memory is measured in a
+    separate run under `tracemalloc`, so tracing does not skew the timings.
+
+    Args:
+        benchmark (Benchmark): Benchmark setup
+        session (SyntheticSession): Session to process
+        encoding (Encoding): Record encoding
+        work_dir (Path): Scratch directory
+        repeats (int, optional): Timed runs. Defaults to 3.
+
+    Returns:
+        BenchmarkResult: Timing
+    """
+    seconds = float('inf')
+    for _ in range(repeats):
+        run = benchmark(session, encoding, work_dir)
+        start = time.perf_counter()
+        run()
+        seconds = min(seconds, time.perf_counter() - start)
+    run = benchmark(session, encoding, work_dir)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(seconds=seconds,
+                           ensembles_per_sec=session.n_ensembles / seconds,
+                           peak_bytes=peak_bytes)
+
+
+def run_benchmarks(n_ensembles: int,
+                   *,
+                   mix: Optional[Dict[int, float]] = None,
+                   encoding: Encoding = Encoding.BASE64URL,
+                   names: Optional[List[str]] = None,
+                   repeats: int = 3,
+                   seed: int = 0) -> Dict[str, BenchmarkResult]:
+    """Runs benchmarks on a synthetic session
+
+    Args:
+        n_ensembles (int): Session length in ensembles
+        mix (Optional[Dict[int, float]], optional): Data type weights.
+        Defaults to the generator's default mix.
+        encoding (Encoding, optional): Record encoding. Defaults to
+        Encoding.BASE64URL.
+        names (Optional[List[str]], optional): Benchmarks to run. Defaults to
+        all of `BENCHMARKS`.
+        repeats (int, optional): Timed runs per benchmark. Defaults to 3.
+        seed (int, optional): Generator seed. Defaults to 0.
+
+    Returns:
+        Dict[str, BenchmarkResult]: Timing by benchmark name
+    """
+    logger = logging.getLogger('sfBenchmark')
+    session = generate_session(n_ensembles, mix=mix, seed=seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names or list(BENCHMARKS):
+            results[name] = time_benchmark(BENCHMARKS[name], session,
+                                           encoding, Path(work_dir),
+                                           repeats=repeats)
+            logger.info('%s: %.3f s, %.0f ensembles/s, peak %.1f MiB', name,
+                        results[name].seconds,
+                        results[name].ensembles_per_sec,
+                        results[name].peak_bytes / (1 << 20))
+    return results
+
+
+def save_baseline(results: Dict[str, BenchmarkResult],
+                  path: Path,
+                  params: Dict[str, object]) -> None:
+    """Saves benchmark results as a JSON baseline
+
+    Args:
+        results (Dict[str, BenchmarkResult]): Timing by benchmark name
+        path (Path): Output path
+        params (Dict[str, object]): Benchmark parameters, recorded so
+        baselines are only compared like for like
+    """
+    path.write_text(json.dumps({
+        'version': BASELINE_VERSION,
+        'smartfin_tools': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': {name: asdict(result) for name, result in results.items()},
+    }, indent=2), encoding='utf-8')
+
+
+def compare_baseline(results: Dict[str, BenchmarkResult],
+                     baseline: Dict[str, object],
+                     *,
+                     tolerance: float = 0.2) -> List[str]:
+    """Compares benchmark results against a baseline
+
+    Args:
+        results (Dict[str, BenchmarkResult]): Timing by benchmark name
+        baseline (Dict[str, object]): Loaded JSON baseline
+        tolerance (float, optional): Allowed relative slowdown or memory
+        growth. Defaults to 0.2.
+
+    Returns:
+        List[str]: Description of each regression, empty if none
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            continue
+        if result.ensembles_per_sec < \
+                reference['ensembles_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: {result.ensembles_per_sec:.0f} ensembles/s, '
+                f'baseline {reference["ensembles_per_sec"]:.0f}')
+        if result.peak_bytes > reference['peak_bytes'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: peak {result.peak_bytes} bytes, '
+                f'baseline {reference["peak_bytes"]}')
+    return regressions
+
+
+def main():
+    """Main entry point
+    """
+    configure_logging()
+    parser = ArgumentParser(
+        description=f'Smartfin Decoder Benchmarks {__version__}')
+    parser.add_argument('-n', '--ensembles',
+                        type=int,
+                        default=20000)
+    parser.add_argument('--mix',
+                        type=parse_mix,
+                        default=None,
+                        help='Data type weights, such as 0x01:0.1,0x09:0.9')
+    parser.add_argument('-e', '--encoding',
+                        type=Encoding,
+                        choices=list(Encoding),
+                        default=Encoding.BASE64URL)
+    parser.add_argument('--only',
+                        nargs='+',
+                        choices=list(BENCHMARKS),
+                        default=None,
+                        help='Only run these benchmarks')
+    parser.add_argument('--repeats',
+                        type=int,
+                        default=3)
+    parser.add_argument('--output',
+                        type=Path,
+                        default=None,
+                        help='Save the results as a JSON baseline')
+    parser.add_argument('--baseline',
+                        type=Path,
+                        default=None,
+                        help='Compare against a JSON baseline')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.2,
+                        help='Allowed relative regression')
+    args = parser.parse_args()
+
+    params = {'ensembles': args.ensembles,
+              'mix': args.mix,
+              'encoding': args.encoding.value}
+    results = run_benchmarks(args.ensembles,
+                             mix=args.mix,
+                             encoding=args.encoding,
+                             names=args.only,
+                             repeats=args.repeats)
+    print(f'{"benchmark":<16}{"seconds":>10}{"ensembles/s":>14}'
+          f'{"peak MiB":>10}')
+    for name, result in results.items():
+        print(f'{name:<16}{result.seconds:>10.3f}'
+              f'{result.ensembles_per_sec:>14.0f}'
+              f'{result.peak_bytes / (1 << 20):>10.1f}')
+    if args.output is not None:
+        save_baseline(results, args.output, params)
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        if baseline['params'] != json.loads(json.dumps(params)):
+            logging.getLogger('sfBenchmark').warning(
+                'Baseline parameters %s differ from %s', baseline['params'],
+                params)
+        regressions = compare_baseline(results, baseline,
+                                       tolerance=args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''Decode cache management
+'''
+import argparse
+from pathlib import Path
+
+from smartfin_tools import __version__
+from smartfin_tools.cache import DecodeCache
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description=f'Smartfin Decode Cache {__version__}'
+    )
+    parser.add_argument('--cache_dir',
+                        type=Path,
+                        default=None,
+                        help='Cache directory, defaults to volumes/cache')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help='Show cache usage')
+    purge = commands.add_parser('purge', help='Evict cached decodes')
+    purge.add_argument('--max_size',
+                       type=int,
+                       default=0,
+                       help='Keep the most recently used entries up to this '
+                       'size (MiB), defaults to emptying the cache')
+
+    args = parser.parse_args()
+    cache = DecodeCache(args.cache_dir)
+
+    if args.command == 'purge':
+        evicted = cache.purge(args.max_size << 20)
+        print(f'Evicted {evicted} entries')
+
+    info = cache.info()
+    print(f'Cache: {info.path.as_posix()}')
+    print(f'Entries: {info.entries}')
+    print(f'Size: {info.size / (1 << 20):.1f} MiB of '
+          f'{info.max_size / (1 << 20):.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,51 @@
 '''Smartfin Data Conversion
 '''
-import base64
+import logging
+import os
 import shutil
+import sys
+import time
 from argparse import ArgumentParser
 from base64 import urlsafe_b64decode
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
+from tqdm import tqdm
 
 import smartfin_tools.decoder as scd
 from smartfin_tools import __version__
-from smartfin_tools.common import ConverterType, Encoding, FileFormats
+from smartfin_tools.cache import DecodeCache
+from smartfin_tools.common import (DECODERS, ConverterType, Encoding,
+                                   FileFormats, expand_inputs)
 from smartfin_tools.config import configure_logging
+from smartfin_tools.container import CODECS, read_sfp, write_sfz
+from smartfin_tools.encoder import columns_from_dataframe, write_session
+from smartfin_tools.export import export_csv, file_chunks, record_chunks
+from smartfin_tools.index import index_path, write_index
+from smartfin_tools.manifest import MANIFEST_NAME, BuildManifest
+from smartfin_tools.profiling import profile, stage
+from smartfin_tools.reader import SfpFile
+from smartfin_tools.records import decode_sfr, iter_records
+from smartfin_tools.storage import COLUMNAR_FORMATS, write_table
 
 
 def sfr_to_sfp(input_path: Path,
                output_path: Path,
                *,
                strip_padding: bool = False,
-               decoder: Callable[[str], bytes] = urlsafe_b64decode):
+               decoder: Callable[[str], bytes] = urlsafe_b64decode,
+               write_sidecar: bool = True):
     """Converts Smartfin Records to Smartfin Packets (base64url to binary)
 
+    Records are decoded and written a bounded chunk at a time, so memory use
+    does not grow with the file.  The sidecar ensemble index is built from the
+    packets as they are written, so readers of the output never have to
+    rescan it.
+
     Args:
         input_path (Path): Input path
         output_path (Path): Output path
@@ -29,57 +53,263 @@ def sfr_to_sfp(input_path: Path,
         Defaults to False.
         decoder (Callable[[str], bytes], optional): Record Ascii to binary 
         decoder. Defaults to urlsafe_b64decode.
+        write_sidecar (bool, optional): Write the `.sfi` ensemble index next
+        to the output. Defaults to True.
     """
-    with open(input_path, 'r', encoding='utf-8') as sfr:
-        with open(output_path, 'wb') as sfp:
-            for record in sfr:
-                packet = decoder(record.strip())
+    stats = scd.StripStats()
+    indexer = scd.StreamIndexer() if write_sidecar else None
+    with open(output_path, 'wb') as sfp:
+        for packets in iter_records(input_path, decoder):
+            with stage('write_sfp') as timer:
                 if strip_padding:
-                    packet = scd.strip_padding(packet)
-                sfp.write(packet)
+                    data = b''.join(scd.strip_padding(packet, stats=stats)
+                                    for packet in packets)
+                else:
+                    data = packets.data
+                sfp.write(data)
+                if indexer is not None:
+                    indexer.feed(data)
+                timer.add(items=len(packets), nbytes=len(data))
+    if indexer is not None:
+        write_index(index_path(output_path), indexer.close(), output_path)
+    if strip_padding:
+        logger = logging.getLogger('sfConvert')
+        logger.info('Stripped %d bytes, kept %d ensembles, unknown types %s',
+                    stats.bytes_removed, stats.ensembles_kept,
+                    stats.unknown_types)
+
+
+def _write_csv(df: pd.DataFrame, output_path: Path) -> None:
+    """Writes a converted session to CSV
+
+    Args:
+        df (pd.DataFrame): SI converted session
+        output_path (Path): Output path
+    """
+    with stage('write_csv') as timer:
+        df.to_csv(output_path)
+        timer.add(items=len(df), nbytes=output_path.stat().st_size)
+
+
+def _write_table(df: pd.DataFrame, output_path: Path) -> None:
+    """Writes a converted session to a columnar binary format
+
+    Args:
+        df (pd.DataFrame): SI converted session
+        output_path (Path): Output path, whose extension selects the format
+    """
+    with stage('write_table') as timer:
+        write_table(df, output_path)
+        timer.add(items=len(df), nbytes=output_path.stat().st_size)
 
 
 def sfr_to_csv(in_sfr: Path,
                out_csv: Path,
                *,
-               decoder: Callable[[str], bytes] = urlsafe_b64decode):
-    ensembles: List[Dict[str, int | float]] = []
-    with open(in_sfr, 'r', encoding='utf-8') as sfr:
-        for record in sfr:
-            data = decoder(record)
-            ensembles.extend(scd.decode_packet(data))
+               decoder: Callable[[str], bytes] = urlsafe_b64decode,
+               ensemble_filter: scd.EnsembleFilter | None = None,
+               workers: Optional[int] = 1,
+               memory_budget: Optional[int] = None,
+               cache: Optional[DecodeCache] = None):
+    """Converts Smartfin Records to CSV format
 
+    Ensembles bridged across records are reassembled.  With a memory budget,
+    the records are decoded, converted and appended in chunks instead of all
+    at once.
 
-    df = pd.DataFrame(ensembles)
-    df = scd.convert_to_si(df)
-    df.to_csv(out_csv)
+    Args:
+        in_sfr (Path): Input path
+        out_csv (Path): Output path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to urlsafe_b64decode.
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        workers (Optional[int], optional): Worker processes to decode record
+        ranges with, None for the CPU count. Defaults to 1.
+        memory_budget (Optional[int], optional): Peak memory budget in bytes.
+        Defaults to no budget.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+    """
+    if memory_budget is not None:
+        export_csv(record_chunks(in_sfr, decoder), out_csv,
+                   ensemble_filter=ensemble_filter,
+                   memory_budget=memory_budget)
+        return
+    df = decode_sfr(in_sfr, decoder=decoder, ensemble_filter=ensemble_filter,
+                    workers=workers, cache=cache).to_dataframe()
+    _write_csv(scd.convert_to_si(df), out_csv)
 
 
-def sfp_to_csv(input_path: Path, output_path: Path):
+def sfp_to_csv(input_path: Path,
+               output_path: Path,
+               *,
+               ensemble_filter: scd.EnsembleFilter | None = None,
+               memory_budget: Optional[int] = None,
+               cache: Optional[DecodeCache] = None):
     """Converts Smartfin Packets to CSV format
 
+    With a memory budget, the packets are decoded, converted and appended in
+    chunks instead of all at once.
+
+    Args:
+        input_path (Path): Input path
+        output_path (Path): Output path
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        memory_budget (Optional[int], optional): Peak memory budget in bytes.
+        Defaults to no budget.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+    """
+    if memory_budget is not None:
+        export_csv(file_chunks(input_path), output_path,
+                   ensemble_filter=ensemble_filter,
+                   memory_budget=memory_budget)
+        return
+    with SfpFile(input_path, write_sidecar=False) as reader:
+        df = reader.decode(ensemble_filter=ensemble_filter,
+                           cache=cache).to_dataframe()
+    _write_csv(scd.convert_to_si(df), output_path)
+
+
+def sfr_to_table(in_sfr: Path,
+                 out_path: Path,
+                 *,
+                 decoder: Callable[[str], bytes] = urlsafe_b64decode,
+                 ensemble_filter: scd.EnsembleFilter | None = None,
+                 workers: Optional[int] = 1,
+                 cache: Optional[DecodeCache] = None):
+    """Converts Smartfin Records to a columnar binary format
+
+    Raw columns keep their schema dtypes, see `storage.write_table`.
+
+    Args:
+        in_sfr (Path): Input path
+        out_path (Path): Output path, whose extension selects the format
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to urlsafe_b64decode.
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        workers (Optional[int], optional): Worker processes to decode record
+        ranges with, None for the CPU count. Defaults to 1.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+    """
+    df = decode_sfr(in_sfr, decoder=decoder, ensemble_filter=ensemble_filter,
+                    workers=workers, cache=cache).to_dataframe(compact=True)
+    _write_table(scd.convert_to_si(df), out_path)
+
+
+def sfp_to_table(input_path: Path,
+                 output_path: Path,
+                 *,
+                 ensemble_filter: scd.EnsembleFilter | None = None,
+                 cache: Optional[DecodeCache] = None):
+    """Converts Smartfin Packets to a columnar binary format
+
+    Raw columns keep their schema dtypes, see `storage.write_table`.
+
+    Args:
+        input_path (Path): Input path
+        output_path (Path): Output path, whose extension selects the format
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+    """
+    with SfpFile(input_path, write_sidecar=False) as reader:
+        df = reader.decode(ensemble_filter=ensemble_filter,
+                           cache=cache).to_dataframe(compact=True)
+    _write_table(scd.convert_to_si(df), output_path)
+
+
+def sfp_to_sfz(input_path: Path,
+               output_path: Path,
+               *,
+               codec: str = 'zlib'):
+    """Compresses Smartfin Packets into a block-seekable SFZ container
+
+    Args:
+        input_path (Path): Input path
+        output_path (Path): Output path
+        codec (str, optional): Block compression codec. Defaults to 'zlib'.
+    """
+    write_sfz(read_sfp(input_path), output_path, codec=codec)
+
+
+def sfr_to_sfz(input_path: Path,
+               output_path: Path,
+               *,
+               decoder: Callable[[str], bytes] = urlsafe_b64decode,
+               codec: str = 'zlib'):
+    """Converts Smartfin Records to a compressed SFZ container
+
+    Records are decoded a bounded chunk at a time and streamed into the
+    container, so memory use does not grow with the file.
+
+    Args:
+        input_path (Path): Input path
+        output_path (Path): Output path
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to urlsafe_b64decode.
+        codec (str, optional): Block compression codec. Defaults to 'zlib'.
+    """
+    write_sfz((packets.data for packets in iter_records(input_path, decoder)),
+              output_path, codec=codec)
+
+
+def sfz_to_sfp(input_path: Path, output_path: Path):
+    """Decompresses an SFZ container to Smartfin Packets
+
     Args:
         input_path (Path): Input path
         output_path (Path): Output path
     """
-    ensembles = []
-    with open(input_path, 'rb') as handle:
-        data = handle.read()
-        ensembles = scd.decode_packet(data)
+    output_path.write_bytes(read_sfp(input_path))
+
 
-    df = pd.DataFrame(ensembles)
-    df = scd.convert_to_si(df)
-    df.to_csv(output_path)
+def csv_to_session(input_path: Path,
+                   output_path: Path,
+                   *,
+                   encoding: Encoding = Encoding.BASE64URL,
+                   codec: str = 'zlib'):
+    """Re-encodes an exported CSV as SFP, SFR or SFZ, by the output path's
+    suffix
+
+    The CSV must hold the raw columns, as `sfConvert` exports them.
+
+    Args:
+        input_path (Path): Input path
+        output_path (Path): Output path
+        encoding (Encoding, optional): Record encoding for SFR outputs.
+        Defaults to Encoding.BASE64URL.
+        codec (str, optional): Block compression codec for SFZ outputs.
+        Defaults to 'zlib'.
+    """
+    with stage('read_csv') as timer:
+        df = pd.read_csv(input_path)
+        timer.add(items=len(df), nbytes=input_path.stat().st_size)
+    write_session(columns_from_dataframe(df), output_path,
+                  encoding=encoding, codec=codec)
 
 
 def sf_convert(input_file: Path,
                input_type: FileFormats | None,
                output_file: Path,
                output_type: FileFormats | None,
-               encoding: Encoding
+               encoding: Encoding,
+               *,
+               ensemble_filter: scd.EnsembleFilter | None = None,
+               workers: Optional[int] = 1,
+               memory_budget: Optional[int] = None,
+               cache: Optional[DecodeCache] = None,
+               codec: str = 'zlib'
                ) -> None:
     """Convert input file to output file
 
+    SFZ containers are read wherever SFP files are.
+
     Args:
         input_file (Path): Input Path
         input_type (FileFormats | None): File format, defaults to input path
@@ -87,6 +317,20 @@ def sf_convert(input_file: Path,
         output_type (FileFormats | None): Output file format, defaults to
         output path extension
         encoding (Encoding): Record encoding
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Only applies to decoded
+        outputs. Defaults to everything.
+        workers (Optional[int], optional): Worker processes for decoding a
+        single large file, None for the CPU count. Defaults to 1.
+        memory_budget (Optional[int], optional): Peak memory budget in bytes
+        for CSV outputs. Defaults to no budget.
+        cache (Optional[DecodeCache], optional): Decode cache to consult for
+        decoded outputs. Defaults to None.
+        codec (str, optional): Compression codec for SFZ outputs. Defaults
+        to 'zlib'.
+
+    Raises:
+        ValueError: Filter requested for a raw output format
 
     """
     if input_type is None:
@@ -95,28 +339,218 @@ def sf_convert(input_file: Path,
     if output_type is None:
         output_type = FileFormats(output_file.suffix.lower())
 
+    if ensemble_filter is not None and output_type != FileFormats.CSV \
+            and output_type not in COLUMNAR_FORMATS:
+        raise ValueError(f'Filters do not apply to {output_type.value} '
+                         'outputs')
+
     if input_type == output_type:
         shutil.copy(input_file, output_file)
         return
 
-    decoder_map: Dict[Encoding, Callable[[str], bytes]] = {
-        Encoding.BASE64: base64.b64decode,
-        Encoding.BASE64URL: base64.urlsafe_b64decode,
-        Encoding.BASE85: base64.b85decode
-    }
-    decoder = decoder_map[encoding]
+    decoder = DECODERS[encoding]
 
     conversion_map: Dict[Tuple[FileFormats, FileFormats], ConverterType] = {
-        (FileFormats.SFR, FileFormats.SFP): lambda input_path, output_path: sfr_to_sfp(input_path, output_path, decoder=decoder),
-        (FileFormats.SFP, FileFormats.CSV): sfp_to_csv,
-        (FileFormats.SFR, FileFormats.CSV): lambda input_path, output_path: sfr_to_csv(input_path, output_path, decoder=decoder)
+        (FileFormats.SFR, FileFormats.SFP): partial(sfr_to_sfp,
+                                                    decoder=decoder),
+        (FileFormats.SFP, FileFormats.CSV): partial(
+            sfp_to_csv, ensemble_filter=ensemble_filter,
+            memory_budget=memory_budget, cache=cache),
+        (FileFormats.SFR, FileFormats.CSV): partial(
+            sfr_to_csv, decoder=decoder, ensemble_filter=ensemble_filter,
+            workers=workers, memory_budget=memory_budget, cache=cache),
+        (FileFormats.SFR, FileFormats.SFZ): partial(
+            sfr_to_sfz, decoder=decoder, codec=codec),
+        (FileFormats.SFP, FileFormats.SFZ): partial(sfp_to_sfz, codec=codec),
+        (FileFormats.SFZ, FileFormats.SFP): sfz_to_sfp,
+        (FileFormats.SFZ, FileFormats.CSV): partial(
+            sfp_to_csv, ensemble_filter=ensemble_filter,
+            memory_budget=memory_budget, cache=cache),
     }
 
+    for session_format in (FileFormats.SFP, FileFormats.SFR, FileFormats.SFZ):
+        conversion_map[(FileFormats.CSV, session_format)] = partial(
+            csv_to_session, encoding=encoding, codec=codec)
+
+    for table_format in COLUMNAR_FORMATS:
+        conversion_map[(FileFormats.SFP, table_format)] = partial(
+            sfp_to_table, ensemble_filter=ensemble_filter, cache=cache)
+        conversion_map[(FileFormats.SFZ, table_format)] = \
+            conversion_map[(FileFormats.SFP, table_format)]
+        conversion_map[(FileFormats.SFR, table_format)] = partial(
+            sfr_to_table, decoder=decoder, ensemble_filter=ensemble_filter,
+            workers=workers, cache=cache)
+
     conversion_type = (input_type, output_type)
-    conversion_map[conversion_type](
-        input_path=input_file,
-        output_path=output_file
-    )
+    with stage('convert') as timer:
+        conversion_map[conversion_type](input_file, output_file)
+        timer.add(items=1, nbytes=input_file.stat().st_size)
+
+
+@dataclass
+class ConversionResult:
+    """Outcome of a single file conversion in a batch
+    """
+    input_file: Path
+    output_file: Path
+    error: Optional[str] = None
+    duration: float = 0.0
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        """Whether the conversion succeeded
+        """
+        return self.error is None
+
+
+def _convert_one(input_file: Path,
+                 input_type: FileFormats | None,
+                 output_file: Path,
+                 output_type: FileFormats,
+                 encoding: Encoding,
+                 ensemble_filter: scd.EnsembleFilter | None,
+                 memory_budget: Optional[int],
+                 cache: Optional[DecodeCache],
+                 codec: str
+                 ) -> ConversionResult:
+    start = time.perf_counter()
+    try:
+        sf_convert(input_file, input_type, output_file, output_type,
+                   encoding, ensemble_filter=ensemble_filter,
+                   memory_budget=memory_budget, cache=cache, codec=codec)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        # A bad file must not take down the rest of the batch
+        return ConversionResult(input_file, output_file,
+                                error=f'{type(exc).__name__}: {exc}',
+                                duration=time.perf_counter() - start)
+    return ConversionResult(input_file, output_file,
+                            duration=time.perf_counter() - start)
+
+
+def batch_convert(input_files: List[Path],
+                  input_type: FileFormats | None,
+                  output_dir: Path,
+                  output_type: FileFormats,
+                  encoding: Encoding,
+                  *,
+                  ensemble_filter: scd.EnsembleFilter | None = None,
+                  workers: Optional[int] = None,
+                  memory_budget: Optional[int] = None,
+                  cache: Optional[DecodeCache] = None,
+                  codec: str = 'zlib',
+                  manifest: Optional[BuildManifest] = None,
+                  progress: bool = True) -> List[ConversionResult]:
+    """Converts many files in parallel
+
+    Each file is converted in its own worker process. Failures are recorded
+    in the results rather than raised, so one bad file does not abort the
+    batch.  Outputs mirror the inputs' directory layout below their common
+    parent directory.
+
+    With a manifest, outputs that are up to date with their inputs are
+    skipped, and successful conversions are recorded in it.
+
+    Args:
+        input_files (List[Path]): Files to convert
+        input_type (FileFormats | None): Input format, defaults to each input
+        path extension
+        output_dir (Path): Directory to write `<stem><output_type>` files to
+        output_type (FileFormats): Output format
+        encoding (Encoding): Record encoding
+        ensemble_filter (scd.EnsembleFilter | None, optional): Data types,
+        columns and timestamp range to export. Defaults to everything.
+        workers (Optional[int], optional): Worker processes. Defaults to the
+        CPU count. A single worker converts in process.
+        memory_budget (Optional[int], optional): Peak memory budget in bytes
+        per worker for CSV outputs. Defaults to no budget.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+        codec (str, optional): Compression codec for SFZ outputs. Defaults
+        to 'zlib'.
+        manifest (Optional[BuildManifest], optional): Manifest of previous
+        conversions. Defaults to converting everything.
+        progress (bool, optional): Show a progress bar. Defaults to True.
+
+    Raises:
+        ValueError: Two inputs would be written to the same output file
+
+    Returns:
+        List[ConversionResult]: Results in input order
+    """
+    if not input_files:
+        return []
+    root = Path(os.path.commonpath([path.absolute().parent
+                                    for path in input_files]))
+    output_files = [output_dir / path.absolute().parent.relative_to(root) /
+                    f'{path.stem}{output_type.value}'
+                    for path in input_files]
+    if len(set(output_files)) != len(output_files):
+        raise ValueError('Inputs with the same name would overwrite each '
+                         'other in the output directory')
+    for output_file in set(output_files):
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    settings = f'{output_type.value}:{encoding}:{ensemble_filter!r}'
+    if output_type == FileFormats.SFZ:
+        settings += f':{codec}'
+
+    results: List[Optional[ConversionResult]] = [None] * len(input_files)
+    jobs = {}
+    for idx, (input_file, output_file) in enumerate(zip(input_files,
+                                                        output_files)):
+        if manifest is not None and \
+                manifest.is_current(input_file, output_file, settings):
+            results[idx] = ConversionResult(input_file, output_file,
+                                            skipped=True)
+            continue
+        jobs[idx] = (input_file, input_type, output_file, output_type,
+                     encoding, ensemble_filter, memory_budget, cache, codec)
+
+    def finish(idx: int, result: ConversionResult) -> None:
+        results[idx] = result
+        if manifest is not None and result.ok:
+            manifest.record(result.input_file, result.output_file, settings)
+        pbar.update(1)
+
+    try:
+        with tqdm(total=len(jobs), unit='file', disable=not progress) as pbar:
+            if workers <= 1:
+                for idx, job in jobs.items():
+                    finish(idx, _convert_one(*job))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = {pool.submit(_convert_one, *job): idx
+                               for idx, job in jobs.items()}
+                    for future in as_completed(futures):
+                        idx = futures[future]
+                        # pylint: disable=broad-exception-caught
+                        # A dead worker fails its file, not the batch
+                        try:
+                            result = future.result()
+                        except Exception as exc:
+                            result = ConversionResult(
+                                jobs[idx][0], jobs[idx][2],
+                                error=f'{type(exc).__name__}: {exc}')
+                        finish(idx, result)
+    finally:
+        if manifest is not None:
+            manifest.save()
+    return results
+
+
+def _summarize(results: List[ConversionResult]) -> None:
+    logger = logging.getLogger('sfConvert')
+    failures = [result for result in results if not result.ok]
+    skipped = sum(result.skipped for result in results)
+    for result in failures:
+        logger.error('Failed to convert %s: %s',
+                     result.input_file.as_posix(), result.error)
+    logger.info('Converted %d of %d files in %.1f s of worker time, %d '
+                'already up to date',
+                len(results) - len(failures) - skipped, len(results),
+                sum(result.duration for result in results), skipped)
 
 
 def main():
@@ -142,10 +576,95 @@ def main():
                         type=Encoding,
                         choices=list(Encoding),
                         default=Encoding.BASE64URL)
+    parser.add_argument('--data_types',
+                        nargs='+',
+                        type=lambda value: int(value, 0),
+                        default=None,
+                        help='Only export these data types')
+    parser.add_argument('--columns',
+                        nargs='+',
+                        default=None,
+                        help='Only export these raw columns')
+    parser.add_argument('--start',
+                        type=float,
+                        default=None,
+                        help='Only export ensembles from this timestamp (s)')
+    parser.add_argument('--end',
+                        type=float,
+                        default=None,
+                        help='Only export ensembles before this timestamp (s)')
+    parser.add_argument('--memory_budget',
+                        type=int,
+                        default=None,
+                        help='Export CSV in chunks within this peak memory '
+                        'budget (MiB)')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Consult and fill the decode cache')
+    parser.add_argument('--batch',
+                        action='store_true',
+                        help='Treat input_file as a directory, glob or .txt '
+                        'file list and output_file as an output directory')
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        default=None,
+                        help='Worker processes, defaults to CPU count')
+    parser.add_argument('--codec',
+                        choices=list(CODECS),
+                        default='zlib',
+                        help='Block compression for .sfz outputs')
+    parser.add_argument('--recursive',
+                        action='store_true',
+                        help='Include subdirectories in --batch')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Skip --batch outputs that are up to date, '
+                        f'tracked in the output directory\'s {MANIFEST_NAME}')
+    parser.add_argument('--profile',
+                        type=Path,
+                        default=None,
+                        metavar='REPORT',
+                        help='Write per stage timings to this JSON report')
 
     args = parser.parse_args()
     kwargs = vars(args)
-    sf_convert(**kwargs)
+    filter_args = {key: kwargs.pop(key)
+                   for key in ('data_types', 'columns', 'start', 'end')}
+    if any(value is not None for value in filter_args.values()):
+        kwargs['ensemble_filter'] = scd.EnsembleFilter(**filter_args)
+    batch = kwargs.pop('batch')
+    workers = kwargs.pop('workers')
+    recursive = kwargs.pop('recursive')
+    incremental = kwargs.pop('incremental')
+    report_path = kwargs.pop('profile')
+    if kwargs['memory_budget'] is not None:
+        kwargs['memory_budget'] <<= 20
+    kwargs['cache'] = DecodeCache() if kwargs['cache'] else None
+    if not batch:
+        with profile(report_path):
+            sf_convert(**kwargs, workers=workers)
+        return
+
+    if args.output_type is None:
+        parser.error('--output_type is required with --batch')
+    with profile(report_path):
+        results = batch_convert(
+            expand_inputs(args.input_file, args.input_type,
+                          recursive=recursive),
+            args.input_type,
+            args.output_file,
+            args.output_type,
+            args.encoding,
+            ensemble_filter=kwargs.get('ensemble_filter'),
+            workers=workers,
+            memory_budget=kwargs['memory_budget'],
+            cache=kwargs['cache'],
+            codec=args.codec,
+            manifest=BuildManifest(args.output_file / MANIFEST_NAME)
+            if incremental else None)
+    _summarize(results)
+    if not all(result.ok for result in results):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -10,6 +10,7 @@ import semantic_version
 import serial
 from tqdm.auto import tqdm
 from smartfin_tools import __version__
+from smartfin_tools.profiling import profile, stage
 
 def discoverAndReset(port:serial.Serial):
     port.flush()
@@ -45,11 +46,17 @@ def sfDownloader():
                         help=('Number of files to grab, defaults to all. If '
                               'provided as N, downloads the last N files.'),
                         default=None)
+    parser.add_argument('--profile',
+                        type=Path,
+                        default=None,
+                        metavar='REPORT',
+                        help='Write per stage timings to this JSON report')
 
     args = parser.parse_args()
     delete = args.delete
 
-    with serial.Serial(port=args.port, baudrate=115200) as port:
+    with profile(args.profile), \
+            serial.Serial(port=args.port, baudrate=115200) as port:
         port.timeout = 1
         drop_into_cli(port)
 
@@ -76,12 +83,18 @@ def flogDownloader():
     parser.add_argument('port')
     parser.add_argument('output_file', default='flog.txt')
     parser.add_argument('--clear', '-c', action='store_true')
+    parser.add_argument('--profile',
+                        type=Path,
+                        default=None,
+                        metavar='REPORT',
+                        help='Write per stage timings to this JSON report')
     args = parser.parse_args()
     clear = args.clear
     output_file = args.output_file
     portname = args.port
 
-    with serial.Serial(port=portname, baudrate=115200) as port:
+    with profile(args.profile), \
+            serial.Serial(port=portname, baudrate=115200) as port:
         port.timeout = 1
         drop_into_cli(port)
         download_flog(clear, port, Path(output_file))
@@ -111,17 +124,19 @@ def download_data(delete: bool,
         n_packets = 0
         pbar = tqdm(total=filesize, unit='B', desc=publish_name,
                    unit_scale=True, unit_divisor=1024)
-        while True:
-            packet = port.read_until('\n'.encode()).decode()
-            encoded_data += packet
-            if len(packet.strip()) > 0:
-                n_packets += 1
-            pbar.update(len(base64.urlsafe_b64decode(packet.strip())))
-            if port.in_waiting == 0:
-                port.write('n'.encode())
-            else:
-                pbar.close()
-                break
+        with stage('download') as timer:
+            while True:
+                packet = port.read_until('\n'.encode()).decode()
+                encoded_data += packet
+                if len(packet.strip()) > 0:
+                    n_packets += 1
+                pbar.update(len(base64.urlsafe_b64decode(packet.strip())))
+                if port.in_waiting == 0:
+                    port.write('n'.encode())
+                else:
+                    pbar.close()
+                    break
+            timer.add(items=n_packets, nbytes=len(encoded_data))
 
 
         footer = port.read_until('\n:>'.encode())
@@ -131,8 +146,9 @@ def download_data(delete: bool,
         if n_packets != expected_packets:
             raise RuntimeError('Packet count mismatch!')
 
-        with open((output_dir / (publish_name + '.sfr')), 'w', encoding='utf-8') as handle:
-            handle.write(encoded_data.strip())
+        with stage('write_sfr') as timer, \
+                open((output_dir / (publish_name + '.sfr')), 'w', encoding='utf-8') as handle:
+            timer.add(items=1, nbytes=handle.write(encoded_data.strip()))
 
 
 def get_files(port: serial.Serial) -> Dict[str, int]:
@@ -196,11 +212,11 @@ def download_flog(clear: bool, port: serial.Serial, output_path: Path):
     port.write('11\r'.encode())
     port.readline() # Throwing away echo
     port.readline() # Throwing away title
-    with open(output_path, 'w') as output:
+    with stage('download_flog') as timer, open(output_path, 'w') as output:
         while True:
             line = port.readline().decode(errors='ignore')
             if line.strip() != '':
-                output.write(line)
+                timer.add(items=1, nbytes=output.write(line))
             else:
                 break
     while True:
@@ -0,0 +1,269 @@
+'''Synthetic Smartfin session generator
+
+Builds sessions of a configurable length and data type mix from the
+registered ensemble schemas, for benchmarking and testing the decoders
+without field data.
+'''
+import math
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import smartfin_tools.decoder as scd
+from smartfin_tools import __version__
+from smartfin_tools.common import Encoding, FileFormats
+from smartfin_tools.encoder import (DEFAULT_RECORD_SIZE, encode_records,
+                                    pack_records)
+from smartfin_tools.schema import TEXT_DATA_TYPE, get_schema, schemas
+
+# Roughly the type mix of a surf session: mostly IMU, a temperature reading
+# every second or so, occasional GPS fixes and battery readings
+DEFAULT_MIX: Dict[int, float] = {
+    0x01: 0.08,
+    0x06: 0.01,
+    0x07: 0.005,
+    0x09: 0.9,
+    TEXT_DATA_TYPE: 0.005,
+}
+
+__MESSAGES = ('Session start', 'GPS fix acquired', 'GPS fix lost',
+              'Entered water', 'Left water', 'Low battery')
+
+
+@dataclass
+class SyntheticSession:
+    """Generated session
+
+    `packet` is the SFP content: the records concatenated.
+    """
+    records: List[bytes]
+    data_types: np.ndarray
+    timestamp_ds: np.ndarray
+
+    @property
+    def packet(self) -> bytes:
+        """SFP bytes
+        """
+        return b''.join(self.records)
+
+    @property
+    def n_ensembles(self) -> int:
+        """Number of ensembles
+        """
+        return len(self.data_types)
+
+    def counts(self) -> Dict[int, int]:
+        """Counts the ensembles of each data type
+
+        Returns:
+            Dict[int, int]: Number of ensembles by data type
+        """
+        types, counts = np.unique(self.data_types, return_counts=True)
+        return dict(zip(types.tolist(), counts.tolist()))
+
+    def encode(self, encoding: Encoding) -> bytes:
+        """Encodes the session as Smartfin Records
+
+        Args:
+            encoding (Encoding): Record encoding
+
+        Returns:
+            bytes: SFR content, one record per line
+        """
+        return encode_records(self.records, encoding)
+
+    def write(self,
+              path: Path,
+              *,
+              encoding: Encoding = Encoding.BASE64URL) -> None:
+        """Writes the session as SFR or SFP, by the path's suffix
+
+        Args:
+            path (Path): Output path
+            encoding (Encoding, optional): Record encoding for SFR outputs.
+            Defaults to Encoding.BASE64URL.
+
+        Raises:
+            ValueError: Unsupported suffix
+        """
+        suffix = FileFormats(path.suffix.lower())
+        if suffix == FileFormats.SFR:
+            path.write_bytes(self.encode(encoding))
+        elif suffix == FileFormats.SFP:
+            path.write_bytes(self.packet)
+        else:
+            raise ValueError(f'Cannot write a session as {path.suffix}')
+
+
+def parse_mix(value: str) -> Dict[int, float]:
+    """Parses a data type mix such as `0x01:0.1,0x09:0.9`
+
+    Args:
+        value (str): Comma separated `data_type:weight` pairs
+
+    Returns:
+        Dict[int, float]: Weight by data type
+    """
+    mix = {}
+    for item in value.split(','):
+        data_type, weight = item.split(':')
+        mix[int(data_type, 0)] = float(weight)
+    return mix
+
+
+def __field_values(dtype: np.dtype,
+                   name: str,
+                   n_rows: int,
+                   rng: np.random.Generator) -> np.ndarray:
+    """Generates a slowly varying, noisy signal within a field's range
+
+    Args:
+        dtype (np.dtype): Field dtype
+        name (str): Field name
+        n_rows (int): Number of values
+        rng (np.random.Generator): Random source
+
+    Returns:
+        np.ndarray: Field values
+    """
+    if name == 'water' or dtype.kind == 'b':
+        return (rng.random(n_rows) < 0.9).astype(dtype)
+    if dtype.kind == 'S':
+        return np.zeros(n_rows, dtype=dtype)
+    phase = rng.uniform(0, 2 * math.pi)
+    period = rng.uniform(50, 500)
+    signal = np.sin(np.arange(n_rows) * (2 * math.pi / period) + phase)
+    if dtype.kind == 'f':
+        return (signal + rng.normal(0, 1 / 32, n_rows)).astype(dtype)
+    info = np.iinfo(dtype)
+    span = float(info.max) - float(info.min)
+    values = (float(info.min) + span / 2 + span / 8 * signal
+              + rng.normal(0, span / 256, n_rows))
+    return np.clip(np.rint(values), info.min, info.max).astype(dtype)
+
+
+def __type_table(data_type: int,
+                 n_rows: int,
+                 rng: np.random.Generator) -> np.ndarray:
+    """Builds the payloads of every ensemble of one data type
+
+    Args:
+        data_type (int): Data type
+        n_rows (int): Number of ensembles
+        rng (np.random.Generator): Random source
+
+    Returns:
+        np.ndarray: Payload table, as in `ColumnarEnsembles.tables`
+    """
+    if data_type == TEXT_DATA_TYPE:
+        table = np.empty(n_rows, dtype=[('text', object)])
+        table['text'] = [__MESSAGES[message] for message
+                         in rng.choice(len(__MESSAGES), n_rows).tolist()]
+        return table
+    schema = get_schema(data_type)
+    table = np.zeros(n_rows, dtype=schema.dtype)
+    for name in schema.names:
+        table[name] = __field_values(schema.dtype[name], name, n_rows, rng)
+    return table
+
+
+def generate_session(n_ensembles: int,
+                     *,
+                     mix: Optional[Dict[int, float]] = None,
+                     seed: int = 0,
+                     record_size: int = DEFAULT_RECORD_SIZE,
+                     bridged: bool = False,
+                     start_ds: int = 0) -> SyntheticSession:
+    """Generates a session
+
+    Ensembles are drawn from the data type mix, with a timestamp that
+    advances by one decisecond per ensemble and wraps like the device
+    counter.
+
+    Args:
+        n_ensembles (int): Number of ensembles
+        mix (Optional[Dict[int, float]], optional): Relative weight of each
+        data type. Defaults to DEFAULT_MIX.
+        seed (int, optional): Random seed. Defaults to 0.
+        record_size (int, optional): Record size in bytes. Defaults to
+        DEFAULT_RECORD_SIZE.
+        bridged (bool, optional): Let ensembles span records instead of
+        zero padding each record. Defaults to False.
+        start_ds (int, optional): First timestamp (ds). Defaults to 0.
+
+    Raises:
+        ValueError: Unregistered data type in the mix
+
+    Returns:
+        SyntheticSession: Generated session
+    """
+    if mix is None:
+        mix = DEFAULT_MIX
+    registered = schemas()
+    for data_type in mix:
+        if data_type not in registered and data_type != TEXT_DATA_TYPE:
+            raise ValueError(f'Data type {data_type} is not registered')
+    rng = np.random.default_rng(seed)
+    types = np.array(list(mix), dtype=np.uint8)
+    weights = np.array(list(mix.values()), dtype=np.float64)
+    data_types = rng.choice(types, n_ensembles, p=weights / weights.sum())
+    timestamp_ds = (start_ds + np.arange(n_ensembles, dtype=np.int64)) \
+        & 0xFFFFF
+
+    ensembles = scd.ColumnarEnsembles(
+        tables={data_type: __type_table(data_type,
+                                        int((data_types == data_type).sum()),
+                                        rng)
+                for data_type in types.tolist()},
+        data_type=data_types,
+        timestamp_ds=timestamp_ds.astype(np.uint32),
+        offsets=np.zeros(n_ensembles, dtype=np.int64))
+    return SyntheticSession(
+        records=pack_records(ensembles, record_size=record_size,
+                             bridged=bridged),
+        data_types=data_types,
+        timestamp_ds=timestamp_ds)
+
+
+def main():
+    """Main entry point
+    """
+    parser = ArgumentParser(
+        description=f'Smartfin Session Generator {__version__}')
+    parser.add_argument('output',
+                        type=Path,
+                        help='Output .sfr or .sfp path')
+    parser.add_argument('-n', '--ensembles',
+                        type=int,
+                        default=100000)
+    parser.add_argument('--mix',
+                        type=parse_mix,
+                        default=None,
+                        help='Data type weights, such as 0x01:0.1,0x09:0.9')
+    parser.add_argument('-e', '--encoding',
+                        type=Encoding,
+                        choices=list(Encoding),
+                        default=Encoding.BASE64URL)
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0)
+    parser.add_argument('--record_size',
+                        type=int,
+                        default=DEFAULT_RECORD_SIZE)
+    parser.add_argument('--bridged',
+                        action='store_true',
+                        help='Let ensembles span records')
+    args = parser.parse_args()
+    session = generate_session(args.ensembles,
+                               mix=args.mix,
+                               seed=args.seed,
+                               record_size=args.record_size,
+                               bridged=args.bridged)
+    session.write(args.output, encoding=args.encoding)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+'''Smartfin Ingestion Service
+
+Watches the data directory and converts new sessions as they land.
+'''
+import argparse
+import logging
+import signal
+import time
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+import smartfin_tools.decoder as scd
+from smartfin_tools import __version__
+from smartfin_tools.cache import DecodeCache
+from smartfin_tools.common import DECODERS, Encoding, FileFormats
+from smartfin_tools.config import (configure_logging, get_data_path,
+                                   get_ingest_path)
+from smartfin_tools.manifest import BuildManifest
+from smartfin_tools.reader import SfpFile
+from smartfin_tools.sfConvert import sfr_to_sfp
+from smartfin_tools.sfPlotter import plot_ensembles
+from smartfin_tools.storage import COLUMNAR_FORMATS, write_table
+
+INGEST_MANIFEST = 'sfingest_manifest.json'
+
+
+@dataclass
+class IngestResult:
+    """Outcome of ingesting one session
+    """
+    input_file: Path
+    outputs: List[Path] = field(default_factory=list)
+    error: Optional[str] = None
+    duration: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """Whether every output was produced
+        """
+        return self.error is None
+
+
+def output_paths(input_file: Path,
+                 data_dir: Path,
+                 output_dir: Path,
+                 table_format: FileFormats) -> Tuple[Path, Path, Path]:
+    """Computes where a session's outputs are written
+
+    The session's path relative to the data directory is mirrored under each
+    output subdirectory, so same-named sessions in different subdirectories
+    do not overwrite each other.
+
+    Args:
+        input_file (Path): SFR path, within `data_dir`
+        data_dir (Path): Data directory
+        output_dir (Path): Output root
+        table_format (FileFormats): Columnar output format
+
+    Returns:
+        Tuple[Path, Path, Path]: SFP path, columnar table path and plot
+        directory
+    """
+    session = input_file.relative_to(data_dir).with_suffix('')
+    return (output_dir / 'sfp' / session.with_suffix(FileFormats.SFP.value),
+            output_dir / 'tables' / session.with_suffix(table_format.value),
+            output_dir / 'plots' / session)
+
+
+def ingest_file(input_file: Path,
+                data_dir: Path,
+                output_dir: Path,
+                encoding: Encoding,
+                table_format: FileFormats,
+                plots: bool,
+                cache: Optional[DecodeCache]) -> IngestResult:
+    """Produces the SFP, columnar and plot outputs for one session
+
+    The records are decoded once, into the SFP output.  The ensembles are
+    then decoded once from the SFP, and the table and plots both derived
+    from them.
+
+    Args:
+        input_file (Path): SFR path, within `data_dir`
+        data_dir (Path): Data directory
+        output_dir (Path): Output root
+        encoding (Encoding): Record encoding
+        table_format (FileFormats): Columnar output format
+        plots (bool): Whether to plot the session
+        cache (Optional[DecodeCache]): Decode cache to consult
+
+    Returns:
+        IngestResult: Outputs, or the error that stopped ingestion
+    """
+    start = time.perf_counter()
+    sfp_path, table_path, plot_dir = output_paths(input_file, data_dir,
+                                                  output_dir, table_format)
+    result = IngestResult(input_file)
+    try:
+        sfp_path.parent.mkdir(parents=True, exist_ok=True)
+        sfr_to_sfp(input_file, sfp_path, decoder=DECODERS[encoding])
+        result.outputs.append(sfp_path)
+        with SfpFile(sfp_path) as reader:
+            ensembles = reader.decode(cache=cache)
+        table_path.parent.mkdir(parents=True, exist_ok=True)
+        write_table(scd.convert_to_si(ensembles.to_dataframe(compact=True)),
+                    table_path)
+        result.outputs.append(table_path)
+        if plots:
+            plot_ensembles(ensembles, plot_dir)
+            result.outputs.append(plot_dir)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        # A bad session must not stop the service
+        result.error = f'{type(exc).__name__}: {exc}'
+    result.duration = time.perf_counter() - start
+    return result
+
+
+class Ingester:
+    """Polls a data directory and converts sessions in a worker pool
+
+    A file is ingested once its size and modification time have not changed
+    for `settle_time` seconds, so sessions still being downloaded are left
+    alone.  Completed sessions are recorded in a build manifest in the
+    output directory, so restarting the service does not redo them, and a
+    session that fails is retried only once it changes.
+
+    At most `max_in_flight` sessions are handed to the pool at a time.  The
+    rest wait in a queue of paths, so a large drop of files cannot flood the
+    pool, and the queue depth is logged while the pool is saturated.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 data_dir: Path,
+                 output_dir: Path,
+                 *,
+                 encoding: Encoding = Encoding.BASE64URL,
+                 table_format: FileFormats = FileFormats.NPZ,
+                 plots: bool = True,
+                 workers: int = 1,
+                 max_in_flight: Optional[int] = None,
+                 settle_time: float = 2.0,
+                 cache: Optional[DecodeCache] = None) -> None:
+        if table_format not in COLUMNAR_FORMATS:
+            raise ValueError(f'{table_format.value} is not a columnar format')
+        self.data_dir = data_dir
+        self.output_dir = output_dir
+        self.encoding = encoding
+        self.table_format = table_format
+        self.plots = plots
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.settle_time = settle_time
+        self.cache = cache
+        self.manifest = BuildManifest(output_dir / INGEST_MANIFEST)
+        self.__settings = f'ingest:{encoding}:{table_format.value}:{plots}'
+        self.__logger = logging.getLogger('sfIngest')
+        self.__seen: Dict[Path, Tuple[int, int, float]] = {}
+        self.__failed: Dict[Path, Tuple[int, int]] = {}
+        self.__queue: Deque[Path] = deque()
+        self.__in_flight: Dict[Future, Path] = {}
+        self.__saturated = False
+        self.__stopping = False
+
+    def stop(self) -> None:
+        """Asks `run` to return once in flight sessions finish
+        """
+        self.__stopping = True
+
+    def scan(self, *, settled: bool = True) -> List[Path]:
+        """Finds sessions that are ready to ingest
+
+        Args:
+            settled (bool, optional): Only return files that have not
+            changed for `settle_time` seconds. Defaults to True.
+
+        Returns:
+            List[Path]: New or changed sessions, not already queued
+        """
+        now = time.monotonic()
+        busy = set(self.__queue) | set(self.__in_flight.values())
+        ready: List[Path] = []
+        present = set()
+        for path in sorted(self.data_dir.rglob(f'*{FileFormats.SFR.value}')):
+            present.add(path)
+            if path in busy:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.__failed.get(path) == signature:
+                continue
+            seen = self.__seen.get(path)
+            if seen is None or seen[:2] != signature:
+                self.__seen[path] = (*signature, now)
+                if settled and self.settle_time > 0:
+                    continue
+            elif settled and now - seen[2] < self.settle_time:
+                continue
+            if self.manifest.is_current(path, self.__outputs(path),
+                                        self.__settings):
+                continue
+            ready.append(path)
+        for path in set(self.__seen) - present:
+            del self.__seen[path]
+        return ready
+
+    def __outputs(self, path: Path) -> List[Path]:
+        sfp_path, table_path, plot_dir = output_paths(
+            path, self.data_dir, self.output_dir, self.table_format)
+        return [sfp_path, table_path, plot_dir] if self.plots \
+            else [sfp_path, table_path]
+
+    def __submit(self, pool: Optional[ProcessPoolExecutor]) -> None:
+        while self.__queue and len(self.__in_flight) < self.max_in_flight:
+            path = self.__queue.popleft()
+            args = (path, self.data_dir, self.output_dir, self.encoding,
+                    self.table_format, self.plots, self.cache)
+            self.__logger.info('event=queued file=%s', path.as_posix())
+            if pool is None:
+                self.__finish(ingest_file(*args))
+            else:
+                self.__in_flight[pool.submit(ingest_file, *args)] = path
+        if self.__queue and not self.__saturated:
+            self.__logger.warning('event=backpressure queued=%d in_flight=%d',
+                                  len(self.__queue), len(self.__in_flight))
+        elif not self.__queue and self.__saturated:
+            self.__logger.info('event=backlog_cleared in_flight=%d',
+                               len(self.__in_flight))
+        self.__saturated = bool(self.__queue)
+
+    def __finish(self, result: IngestResult) -> None:
+        path = result.input_file
+        if result.ok:
+            self.manifest.record(path, result.outputs, self.__settings)
+            self.manifest.save()
+            self.__failed.pop(path, None)
+            self.__logger.info('event=ingested file=%s outputs=%d '
+                               'duration_s=%.3f', path.as_posix(),
+                               len(result.outputs), result.duration)
+        else:
+            try:
+                stat = path.stat()
+                self.__failed[path] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+            self.__logger.error('event=failed file=%s error="%s" '
+                                'duration_s=%.3f', path.as_posix(),
+                                result.error, result.duration)
+
+    def run(self, *, poll_interval: float = 1.0, once: bool = False) -> None:
+        """Ingests sessions until stopped
+
+        Args:
+            poll_interval (float, optional): Seconds between directory scans.
+            Defaults to 1.0.
+            once (bool, optional): Ingest the sessions present now without
+            waiting for them to settle, then return. Defaults to False.
+        """
+        self.__logger.info('event=started data_dir=%s output_dir=%s '
+                           'workers=%d', self.data_dir.as_posix(),
+                           self.output_dir.as_posix(), self.workers)
+        pool = ProcessPoolExecutor(max_workers=self.workers) \
+            if self.workers > 1 else None
+        try:
+            self.__queue.extend(self.scan(settled=not once))
+            while True:
+                self.__submit(pool)
+                if once and not self.__queue and not self.__in_flight:
+                    break
+                if self.__stopping:
+                    # Let sessions already in the pool finish
+                    self.__queue.clear()
+                    if not self.__in_flight:
+                        break
+                if self.__in_flight:
+                    done, _ = wait(self.__in_flight, timeout=poll_interval,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__in_flight.pop(future)
+                        self.__finish(future.result())
+                elif not once:
+                    time.sleep(poll_interval)
+                if not once and not self.__stopping:
+                    self.__queue.extend(self.scan())
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        self.__logger.info('event=stopped')
+
+
+def main():
+    """Main entry point
+    """
+    parser = argparse.ArgumentParser(
+        description=f'Smartfin Ingestion Service {__version__}'
+    )
+    parser.add_argument('--data_dir',
+                        type=Path,
+                        default=None,
+                        help='Directory to watch, defaults to volumes/data')
+    parser.add_argument('--output_dir',
+                        type=Path,
+                        default=None,
+                        help='Output root, defaults to volumes/ingest')
+    parser.add_argument('-e', '--encoding',
+                        type=Encoding,
+                        choices=list(Encoding),
+                        default=Encoding.BASE64URL)
+    parser.add_argument('--table_format',
+                        type=FileFormats,
+                        choices=COLUMNAR_FORMATS,
+                        default=FileFormats.NPZ)
+    parser.add_argument('--no_plots',
+                        action='store_true',
+                        help='Skip plotting sessions')
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        default=2,
+                        help='Worker processes')
+    parser.add_argument('--poll_interval',
+                        type=float,
+                        default=1.0,
+                        help='Seconds between directory scans')
+    parser.add_argument('--settle_time',
+                        type=float,
+                        default=2.0,
+                        help='Seconds a file must be unchanged before it is '
+                        'ingested')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Decode through the decode cache')
+    parser.add_argument('--once',
+                        action='store_true',
+                        help='Ingest the current sessions and exit')
+    args = parser.parse_args()
+    configure_logging()
+
+    ingester = Ingester(
+        args.data_dir or get_data_path(),
+        args.output_dir or get_ingest_path(),
+        encoding=args.encoding,
+        table_format=args.table_format,
+        plots=not args.no_plots,
+        workers=args.workers,
+        settle_time=args.settle_time,
+        cache=DecodeCache() if args.cache else None)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: ingester.stop())
+    ingester.run(poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == '__main__':
+    main()
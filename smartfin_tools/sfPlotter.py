@@ -3,149 +3,104 @@
 import argparse
 import base64
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Optional
 
 import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
 
-import smartfin_tools.decoder
+import smartfin_tools.decoder as scd
 from smartfin_tools import __version__
-
-
-def plotFile(fileName: Path, output_dir: Path, *, decoder: Callable[[str], bytes] = base64.urlsafe_b64decode):
-    ensembles = []
-    with open(fileName, 'r', encoding='utf-8') as handle:
-        for record in handle:
-            data = decoder(record)
-            ensembles.extend(smartfin_tools.decoder.decode_packet(data))
-
-    df = pd.DataFrame(ensembles)
-    df = smartfin_tools.decoder.convert_to_si(df)
-
-    plot_dir = output_dir / fileName.stem
-    plot_dir.mkdir(parents=True, exist_ok=True)
-
-    plt.scatter(df.index, df['timestamp'])
-    plt.xlabel('Ensemble Number by decode order')
-    plt.ylabel('Timestamp (s)')
-    plt.title('Time vs Ensemble Number')
-    plt.grid()
-    plt.savefig(plot_dir / 'EnsembleNumber.png')
-    plt.close()
-
-    plt.scatter(df['timestamp'], df['Temperature (C)'])
-    plt.xlabel('Time (s)')
-    plt.ylabel('Temperature (C)')
-    plt.title("Temperature vs Time")
-    plt.grid()
-    plt.savefig(plot_dir / "Temperature.png")
-    plt.close()
-
-    plt.scatter(df['timestamp'], df['Water Detect'])
-    plt.xlabel('Time (s)')
-    plt.ylabel('Water Detect Reading')
-    plt.title('Water Detect Reading')
-    plt.grid()
-    plt.savefig(plot_dir / "WaterDetect.png")
-    plt.close()
-
-    plt.scatter(df['timestamp'], df['dataType'])
-    plt.xlabel('Time (s)')
-    plt.ylabel('Data Type')
-    plt.title('Data Types')
-    plt.grid()
-    plt.savefig(plot_dir / "DataTypes.png")
-    plt.close()
-
-    if "X Acceleration (m/s^2)" in df.columns:
-        plt.scatter(df['timestamp'], df['X Acceleration (m/s^2)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Acceleration (m/s^2)')
-        plt.title('X Acceleration')
-        plt.grid()
-        plt.savefig(plot_dir / 'Acceleration_x.png')
-        plt.close()
-
-    if "Y Acceleration (m/s^2)" in df.columns:
-        plt.scatter(df['timestamp'], df['Y Acceleration (m/s^2)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Acceleration (m/s^2)')
-        plt.title('Y Acceleration')
-        plt.grid()
-        plt.savefig(plot_dir / 'Acceleration_y.png')
-        plt.close()
-
-    if "Z Acceleration (m/s^2)" in df.columns:
-        plt.scatter(df['timestamp'], df['Z Acceleration (m/s^2)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Acceleration (m/s^2)')
-        plt.title('Z Acceleration')
-        plt.grid()
-        plt.savefig(plot_dir / 'Acceleration_z.png')
-        plt.close()
-
-    if "X Angular Velocity (deg/s)" in df.columns:
-        plt.scatter(df['timestamp'], df['X Angular Velocity (deg/s)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Angular Velocity (deg/s)')
-        plt.title('X Angular Velocity')
+from smartfin_tools.cache import DecodeCache
+from smartfin_tools.profiling import profile, stage
+from smartfin_tools.records import decode_sfr
+from smartfin_tools.tables import SessionTables
+
+# Column, y axis label, title and file name of each time series plot
+__SERIES_PLOTS = [
+    ('Temperature (C)', 'Temperature (C)', 'Temperature vs Time',
+     'Temperature.png'),
+    ('Water Detect', 'Water Detect Reading', 'Water Detect Reading',
+     'WaterDetect.png'),
+    ('X Acceleration (m/s^2)', 'Acceleration (m/s^2)', 'X Acceleration',
+     'Acceleration_x.png'),
+    ('Y Acceleration (m/s^2)', 'Acceleration (m/s^2)', 'Y Acceleration',
+     'Acceleration_y.png'),
+    ('Z Acceleration (m/s^2)', 'Acceleration (m/s^2)', 'Z Acceleration',
+     'Acceleration_z.png'),
+    ('X Angular Velocity (deg/s)', 'Angular Velocity (deg/s)',
+     'X Angular Velocity', 'AngularVel_x.png'),
+    ('Y Angular Velocity (deg/s)', 'Angular Velocity (deg/s)',
+     'Y Angular Velocity', 'AngularVel_y.png'),
+    ('Z Angular Velocity (deg/s)', 'Angular Velocity (deg/s)',
+     'Z Angular Velocity', 'AngularVel_z.png'),
+    ('X Magnetic Field (uT)', 'Magnetic Field Strength (uT)',
+     'X Magnetic Field', 'Magfield_x.png'),
+    ('Y Magnetic Field (uT)', 'Magnetic Field Strength (uT)',
+     'Y Magnetic Field', 'Magfield_y.png'),
+    ('Z Magnetic Field (uT)', 'Magnetic Field Strength (uT)',
+     'Z Magnetic Field', 'Magfield_z.png'),
+    ('battery', 'Battery Voltage (mV)', 'Battery Voltage', 'Battery.png'),
+]
+
+
+def __scatter(x: np.ndarray, y: np.ndarray, xlabel: str, ylabel: str,
+              title: str, path: Path) -> None:
+    with stage('plot') as timer:
+        plt.scatter(x, y)
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        plt.title(title)
         plt.grid()
-        plt.savefig(plot_dir / 'AngularVel_x.png')
+        plt.savefig(path)
         plt.close()
+        timer.add(items=len(x), nbytes=path.stat().st_size)
 
-    if "Y Angular Velocity (deg/s)" in df.columns:
-        plt.scatter(df['timestamp'], df['Y Angular Velocity (deg/s)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Angular Velocity (deg/s)')
-        plt.title('Y Angular Velocity')
-        plt.grid()
-        plt.savefig(plot_dir / 'AngularVel_y.png')
-        plt.close()
 
-    if "Z Angular Velocity (deg/s)" in df.columns:
-        plt.scatter(df['timestamp'], df['Z Angular Velocity (deg/s)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Angular Velocity (deg/s)')
-        plt.title('Z Angular Velocity')
-        plt.grid()
-        plt.savefig(plot_dir / 'AngularVel_z.png')
-        plt.close()
+def plot_ensembles(ensembles: scd.ColumnarEnsembles, plot_dir: Path):
+    """Plots each data stream of decoded ensembles
 
-    if "X Magnetic Field (uT)" in df.columns:
-        plt.scatter(df['timestamp'], df['X Magnetic Field (uT)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Magnetic Field Strength (uT)')
-        plt.title('X Magnetic Field')
-        plt.grid()
-        plt.savefig(plot_dir / 'Magfield_x.png')
-        plt.close()
+    Each series is plotted from the dense table of the data types that carry
+    it, so the session is never expanded into one sparse wide frame.
 
-    if "Y Magnetic Field (uT)" in df.columns:
-        plt.scatter(df['timestamp'], df['Y Magnetic Field (uT)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Magnetic Field Strength (uT)')
-        plt.title('Y Magnetic Field')
-        plt.grid()
-        plt.savefig(plot_dir / 'Magfield_y.png')
-        plt.close()
+    Args:
+        ensembles (scd.ColumnarEnsembles): Decoded session
+        plot_dir (Path): Directory to write the plots to
+    """
+    with stage('session_tables') as timer:
+        session = SessionTables.from_ensembles(ensembles)
+        timer.add(items=len(ensembles))
 
-    if "Z Magnetic Field (uT)" in df.columns:
-        plt.scatter(df['timestamp'], df['Z Magnetic Field (uT)'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Magnetic Field Strength (uT)')
-        plt.title('Z Magnetic Field')
-        plt.grid()
-        plt.savefig(plot_dir / 'Magfield_z.png')
-        plt.close()
+    plot_dir.mkdir(parents=True, exist_ok=True)
 
-    if "battery" in df.columns:
-        plt.scatter(df['timestamp'], df['battery'])
-        plt.xlabel('Time (s)')
-        plt.ylabel('Battery Voltage (mV)')
-        plt.title('Battery Voltage')
-        plt.grid()
-        plt.savefig(plot_dir / 'Battery.png')
-        plt.close()
+    __scatter(np.arange(len(ensembles)), ensembles.timestamp,
+              'Ensemble Number by decode order', 'Timestamp (s)',
+              'Time vs Ensemble Number', plot_dir / 'EnsembleNumber.png')
+    for column, ylabel, title, file_name in __SERIES_PLOTS:
+        series = session.column(column)
+        if len(series) > 0:
+            __scatter(series.index, series, 'Time (s)', ylabel, title,
+                      plot_dir / file_name)
+    __scatter(ensembles.timestamp, ensembles.data_type, 'Time (s)',
+              'Data Type', 'Data Types', plot_dir / 'DataTypes.png')
+
+
+def plotFile(fileName: Path,
+             output_dir: Path,
+             *,
+             decoder: Callable[[str], bytes] = base64.urlsafe_b64decode,
+             cache: Optional[DecodeCache] = None):
+    """Plots each data stream of a session, see `plot_ensembles`
+
+    Args:
+        fileName (Path): SFR path
+        output_dir (Path): Plots are written to `output_dir / fileName.stem`
+        decoder (Callable[[str], bytes], optional): Record Ascii to binary
+        decoder. Defaults to base64.urlsafe_b64decode.
+        cache (Optional[DecodeCache], optional): Decode cache to consult.
+        Defaults to None.
+    """
+    ensembles = decode_sfr(fileName, decoder=decoder, workers=1, cache=cache)
+    plot_ensembles(ensembles, output_dir / fileName.stem)
 
 
 def main():
@@ -156,6 +111,14 @@ def main():
     parser.add_argument('output', default=Path('.'), type=Path)
     parser.add_argument(
         '-e', '--encoding', choices=['base85', 'base64', 'base64url'], default='base64url')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Decode through the decode cache')
+    parser.add_argument('--profile',
+                        type=Path,
+                        default=None,
+                        metavar='REPORT',
+                        help='Write per stage timings to this JSON report')
     args = parser.parse_args()
     output_dir: Path = args.output
     if args.sfr_file:
@@ -178,7 +141,9 @@ def main():
     else:
         raise NotImplementedError(f"Unknown encoding {args.encoding}")
 
-    plotFile(path, output_dir, decoder=decoder)
+    with profile(args.profile):
+        plotFile(path, output_dir, decoder=decoder,
+                 cache=DecodeCache() if args.cache else None)
 
 
 if __name__ == "__main__":
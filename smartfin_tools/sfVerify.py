@@ -2,22 +2,92 @@
 '''
 import argparse
 import binascii
+import json
 import sys
 from pathlib import Path
+from typing import List
 
 from smartfin_tools import __version__
+from smartfin_tools.checksums import (CHECKSUM_MANIFEST, ChecksumManifest,
+                                      VerifyStatus, file_crc32, verify_files)
+from smartfin_tools.common import DECODERS, Encoding, expand_inputs
+from smartfin_tools.container import SfzFile, is_compressed
+from smartfin_tools.report import GAP_THRESHOLD_DS, session_report
 
 
 def compute_crc32(path: Path):
     """Computes the CRC32 of the SFP file
 
+    For SFZ containers, the CRC32 is of the uncompressed SFP data, so it
+    matches the original `.sfp` file, and each block is checked against the
+    CRC32 in the block index.
+
     Args:
         path (Path): Path to file
+
+    Raises:
+        ValueError: A compressed block is corrupt
     """
-    with open(path, 'rb') as handle:
-        data = handle.read()
-    crc = binascii.crc32(data, 0) & 0xFFFFFFFF
-    print(f'CRC32: {crc:08X}')
+    crc = 0
+    if is_compressed(path):
+        with SfzFile(path) as sfz:
+            for block in sfz.iter_blocks():
+                crc = binascii.crc32(block, crc)
+            print(f'Blocks: {len(sfz.blocks)} ({sfz.codec}), all intact')
+    else:
+        crc = file_crc32(path)
+    print(f'CRC32: {crc & 0xFFFFFFFF:08X}')
+
+
+def verify_archive(inputs: List[Path],
+                   manifest_path: Path,
+                   *,
+                   workers: int | None = None,
+                   update: bool = False) -> bool:
+    """Verifies files and directories against a checksum manifest
+
+    Directories are searched recursively for SFR, SFP and SFZ files.  Only
+    recorded files under the directories given are reported as missing, so
+    part of an archive can be verified against the whole archive's manifest.
+
+    Args:
+        inputs (List[Path]): Files and directories
+        manifest_path (Path): Checksum manifest, created if missing
+        workers (int | None, optional): Worker processes. Defaults to the CPU
+        count.
+        update (bool, optional): Accept changed files and forget missing
+        ones. Defaults to False.
+
+    Returns:
+        bool: True if no file changed, went missing or could not be read
+    """
+    paths = sorted({path for source in inputs
+                    for path in expand_inputs(source, recursive=True)})
+    manifest = ChecksumManifest(manifest_path)
+    results = verify_files(paths, manifest, workers=workers, update=update,
+                           roots=[source for source in inputs
+                                  if source.is_dir()])
+    manifest.save()
+
+    counts = {status: 0 for status in VerifyStatus}
+    for result in results:
+        counts[result.status] += 1
+        if result.status == VerifyStatus.CHANGED:
+            lines = ''
+            if result.bad_records:
+                shown = ', '.join(map(str, result.bad_records[:20]))
+                more = len(result.bad_records) - 20
+                lines = f' at lines {shown}' + \
+                    (f' and {more} more' if more > 0 else '')
+            print(f'CHANGED {result.path}{lines}')
+        elif result.status in (VerifyStatus.MISSING, VerifyStatus.ERROR):
+            print(f'{result.status.name} {result.path}'
+                  + (f': {result.error}' if result.error else ''))
+    print(f'Verified {len(results)} files against {manifest_path}: '
+          + ', '.join(f'{count} {status}' for status, count in counts.items()))
+    return not (counts[VerifyStatus.ERROR] or (
+        not update and (counts[VerifyStatus.CHANGED] or
+                        counts[VerifyStatus.MISSING])))
 
 
 def main():
@@ -26,16 +96,79 @@ def main():
     parser = argparse.ArgumentParser(
         description=f'Smartfin Data Verifier {__version__}'
     )
-    parser.add_argument('input_file', type=Path)
+    parser.add_argument('input_file',
+                        type=Path,
+                        nargs='+',
+                        help='File to checksum, or files and directories to '
+                        'verify against a checksum manifest')
+    parser.add_argument('--manifest',
+                        type=Path,
+                        default=None,
+                        help='Checksum manifest, defaults to '
+                        f'{CHECKSUM_MANIFEST} in the first directory given')
+    parser.add_argument('--update',
+                        action='store_true',
+                        help='Accept changed files and forget missing files '
+                        'in the manifest')
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        default=None,
+                        help='Worker processes, defaults to CPU count')
+    parser.add_argument('--report',
+                        nargs='?',
+                        const='-',
+                        default=None,
+                        metavar='REPORT',
+                        help='Write a JSON session report to this path, or '
+                        'to stdout if no path is given')
+    parser.add_argument('-e', '--encoding',
+                        type=Encoding,
+                        choices=list(Encoding),
+                        default=Encoding.BASE64URL,
+                        help='Record encoding of .sfr files')
+    parser.add_argument('--gap',
+                        type=float,
+                        default=GAP_THRESHOLD_DS / 10,
+                        help='Report timestamp gaps longer than this (s)')
 
     args = parser.parse_args()
-    input_path: Path = args.input_file
+    inputs: List[Path] = args.input_file
+    if len(inputs) > 1 or inputs[0].is_dir() or args.manifest is not None \
+            or args.update:
+        if args.report:
+            parser.error('--report takes a single file')
+        manifest_path = args.manifest
+        if manifest_path is None:
+            root = next((path for path in inputs if path.is_dir()),
+                        inputs[0].parent)
+            manifest_path = root / CHECKSUM_MANIFEST
+        if not verify_archive(inputs, manifest_path, workers=args.workers,
+                              update=args.update):
+            sys.exit(1)
+        return
+    input_path = inputs[0]
 
-    if input_path.suffix.lower() != '.sfp':
-        print('Needs to be a .sfp file!')
+    suffixes = ('.sfp', '.sfz', '.sfr') if args.report else ('.sfp', '.sfz')
+    if input_path.suffix.lower() not in suffixes:
+        print(f'Needs to be a {", ".join(suffixes)} file!')
         sys.exit(1)
 
-    compute_crc32(input_path)
+    try:
+        if args.report:
+            report = json.dumps(
+                session_report(input_path,
+                               decoder=DECODERS[args.encoding],
+                               gap_threshold_ds=round(args.gap * 10)),
+                indent=2)
+            if args.report == '-':
+                print(report)
+            else:
+                Path(args.report).write_text(report, encoding='utf-8')
+        else:
+            compute_crc32(input_path)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+'''Columnar binary session storage
+'''
+import struct
+import zipfile
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from smartfin_tools.common import FileFormats
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNAR_FORMATS = frozenset({
+    FileFormats.NPZ,
+    FileFormats.PARQUET,
+    FileFormats.FEATHER,
+})
+
+
+def write_npz(df: pd.DataFrame, path: Path) -> None:
+    """Writes a DataFrame as an uncompressed NumPy archive
+
+    Each column is stored as its own array with its exact dtype.  Nullable
+    columns store their values alongside a separate missing value mask, and
+    text is stored as concatenated UTF-8 with offsets.  The archive is left
+    uncompressed so that it can be memory-mapped by `read_npz`.
+
+    Args:
+        df (pd.DataFrame): Session DataFrame
+        path (Path): Output path
+    """
+    arrays: Dict[str, np.ndarray] = {
+        'columns': np.array(df.columns.to_list(), dtype=np.str_)
+    }
+    for idx, name in enumerate(df.columns):
+        column = df[name]
+        if isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            mask = column.isna().to_numpy()
+            arrays[f'c{idx}'] = column.array.to_numpy(
+                dtype=column.dtype.numpy_dtype,
+                na_value=column.dtype.numpy_dtype.type(0))
+            arrays[f'm{idx}'] = mask
+        elif column.dtype == object:
+            mask = column.isna().to_numpy()
+            encoded = [text.encode() for text in column[~mask]]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(text) for text in encoded], out=offsets[1:])
+            arrays[f'c{idx}'] = np.frombuffer(b''.join(encoded),
+                                              dtype=np.uint8)
+            arrays[f'o{idx}'] = offsets
+            arrays[f'm{idx}'] = mask
+        else:
+            arrays[f'c{idx}'] = column.to_numpy()
+    with open(path, 'wb') as handle:
+        np.savez(handle, **arrays)
+
+
+def __map_members(path: Path) -> Dict[str, np.ndarray]:
+    """Memory-maps every array of an uncompressed NumPy archive
+
+    Args:
+        path (Path): Archive path
+
+    Raises:
+        ValueError: Archive member is compressed
+
+    Returns:
+        Dict[str, np.ndarray]: Read only arrays by name
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as handle:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{info.filename} is compressed')
+            # Local file header: 30 fixed bytes, then name and extra field
+            handle.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', handle.read(4))
+            handle.seek(info.header_offset + 30 + name_len + extra_len)
+            if np.lib.format.read_magic(handle) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(handle)
+            else:
+                header = np.lib.format.read_array_header_2_0(handle)
+            shape, fortran, dtype = header
+            if dtype.hasobject:
+                raise ValueError(f'{info.filename} holds Python objects')
+            name = info.filename.removesuffix('.npy')
+            if np.prod(shape) == 0:
+                # Empty regions cannot be mapped
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                     offset=handle.tell(), shape=shape,
+                                     order='F' if fortran else 'C'
+                                     ).view(np.ndarray)
+    return arrays
+
+
+def read_npz(path: Path, *, mmap: bool = False) -> pd.DataFrame:
+    """Reads a DataFrame written by `write_npz`
+
+    Args:
+        path (Path): Archive path
+        mmap (bool, optional): Memory-map the columns instead of reading them.
+        Defaults to False.
+
+    Returns:
+        pd.DataFrame: Session DataFrame
+    """
+    if mmap:
+        arrays = __map_members(path)
+    else:
+        with np.load(path, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+    columns = {}
+    for idx, name in enumerate(arrays['columns'].tolist()):
+        values = arrays[f'c{idx}']
+        mask = arrays.get(f'm{idx}')
+        if mask is None:
+            columns[name] = values
+        elif f'o{idx}' in arrays:
+            data = values.tobytes()
+            offsets = arrays[f'o{idx}'].tolist()
+            column = np.full(len(mask), np.nan, dtype=object)
+            column[~mask] = [data[start:stop].decode()
+                             for start, stop in zip(offsets, offsets[1:])]
+            columns[name] = column
+        elif values.dtype.kind == 'b':
+            columns[name] = pd.arrays.BooleanArray(values, mask)
+        elif values.dtype.kind == 'f':
+            columns[name] = pd.arrays.FloatingArray(values, mask)
+        else:
+            columns[name] = pd.arrays.IntegerArray(values, mask)
+    return pd.DataFrame(columns, copy=False)
+
+
+def write_table(df: pd.DataFrame,
+                path: Path,
+                file_format: FileFormats | None = None) -> None:
+    """Writes a DataFrame in a columnar binary format
+
+    Args:
+        df (pd.DataFrame): Session DataFrame
+        path (Path): Output path
+        file_format (FileFormats | None, optional): Output format. Defaults to
+        the path extension.
+
+    Raises:
+        ValueError: Not a columnar format
+        ImportError: Parquet or Feather requested without pyarrow installed
+    """
+    if file_format is None:
+        file_format = FileFormats(path.suffix.lower())
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError(f'{file_format.value} is not a columnar format')
+    if file_format == FileFormats.NPZ:
+        write_npz(df, path)
+        return
+    if pyarrow is None:
+        raise ImportError(f'{file_format.value} output requires pyarrow')
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    if file_format == FileFormats.PARQUET:
+        pyarrow.parquet.write_table(table, path)
+    else:
+        # Uncompressed so that reads can be memory-mapped
+        pyarrow.feather.write_feather(table, path,
+                                      compression='uncompressed')
+
+
+def read_table(path: Path,
+               file_format: FileFormats | None = None,
+               *,
+               mmap: bool = False) -> pd.DataFrame:
+    """Reads a DataFrame written by `write_table`
+
+    Args:
+        path (Path): Input path
+        file_format (FileFormats | None, optional): Input format. Defaults to
+        the path extension.
+        mmap (bool, optional): Memory-map the file instead of reading it.
+        Defaults to False.
+
+    Raises:
+        ValueError: Not a columnar format
+        ImportError: Parquet or Feather requested without pyarrow installed
+
+    Returns:
+        pd.DataFrame: Session DataFrame
+    """
+    if file_format is None:
+        file_format = FileFormats(path.suffix.lower())
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError(f'{file_format.value} is not a columnar format')
+    if file_format == FileFormats.NPZ:
+        return read_npz(path, mmap=mmap)
+    if pyarrow is None:
+        raise ImportError(f'{file_format.value} input requires pyarrow')
+    if file_format == FileFormats.PARQUET:
+        table = pyarrow.parquet.read_table(path, memory_map=mmap)
+    else:
+        table = pyarrow.feather.read_table(path, memory_map=mmap)
+    return table.to_pandas()
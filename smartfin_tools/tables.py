@@ -0,0 +1,103 @@
+'''Per data type session tables
+'''
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.schema import TEXT_DATA_TYPE
+
+TIME_INDEX = 'timestamp'
+
+
+@dataclass
+class SessionTables:
+    """Decoded session as one dense table per data type
+
+    `tables` holds one DataFrame per sensor data type with only that type's
+    fields, in their schema dtypes, and their SI columns.  Text messages are
+    in `text`.  Every table is indexed by ensemble timestamp in seconds,
+    named `timestamp`, and has an `ensemble` column with each row's position
+    in decode order, so tables can be aligned with each other and with the
+    wide view.
+
+    The wide view, one row per ensemble with every column, is only built if
+    `wide` is used.
+    """
+    ensembles: scd.ColumnarEnsembles
+    tables: Dict[int, pd.DataFrame]
+    text: pd.DataFrame
+
+    @classmethod
+    def from_ensembles(cls,
+                       ensembles: scd.ColumnarEnsembles,
+                       *,
+                       compact: bool = False) -> SessionTables:
+        """Splits decoded ensembles into per data type tables
+
+        Args:
+            ensembles (scd.ColumnarEnsembles): Decoded ensembles
+            compact (bool, optional): Produce float32 SI columns instead of
+            float64. Defaults to False.
+
+        Returns:
+            SessionTables: Session tables
+        """
+        timestamp = ensembles.timestamp
+        tables: Dict[int, pd.DataFrame] = {}
+        text = pd.DataFrame({'ensemble': np.zeros(0, dtype=np.int64),
+                             'text': np.zeros(0, dtype=object)},
+                            index=pd.Index(np.zeros(0), name=TIME_INDEX))
+        for data_type, table in ensembles.tables.items():
+            rows = np.flatnonzero(ensembles.data_type == data_type)
+            columns = {'ensemble': rows}
+            for name in table.dtype.names or ():
+                columns[name] = table[name].astype(
+                    table.dtype[name].newbyteorder('='))
+            df = pd.DataFrame(columns,
+                              index=pd.Index(timestamp[rows], name=TIME_INDEX))
+            if data_type == TEXT_DATA_TYPE:
+                text = df
+            else:
+                tables[data_type] = scd.convert_to_si(df, compact=compact)
+        return cls(ensembles=ensembles, tables=tables, text=text)
+
+    def __getitem__(self, data_type: int) -> pd.DataFrame:
+        if data_type == TEXT_DATA_TYPE:
+            return self.text
+        return self.tables[data_type]
+
+    @property
+    def data_types(self) -> List[int]:
+        """Sensor data types present, in ascending order
+        """
+        return sorted(self.tables)
+
+    def column(self, name: str) -> pd.Series:
+        """Gathers a column from every table that has it
+
+        Args:
+            name (str): Raw or SI column name
+
+        Returns:
+            pd.Series: Values in decode order, indexed by timestamp.  Empty if
+            no table has the column.
+        """
+        parts = [table[[name, 'ensemble']] for table in self.tables.values()
+                 if name in table]
+        if not parts:
+            return pd.Series(np.zeros(0), name=name,
+                             index=pd.Index(np.zeros(0), name=TIME_INDEX))
+        return pd.concat(parts).sort_values('ensemble')[name]
+
+    @cached_property
+    def wide(self) -> pd.DataFrame:
+        """One row per ensemble with every column, in SI units, as
+        `convert_to_si(pd.DataFrame(decode_packet(packet)))` would produce
+        """
+        return scd.convert_to_si(self.ensembles.to_dataframe())
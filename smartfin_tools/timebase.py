@@ -0,0 +1,126 @@
+'''Time reconstruction
+
+Ensemble headers carry a 20-bit decisecond counter that wraps after about 29
+hours.  Type 8 ensembles additionally carry an absolute Unix `time` in whole
+seconds.  This module unwraps the counter and anchors it to those readings to
+give a UTC `datetime64[ns]` time for every ensemble.
+'''
+import datetime as dt
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from smartfin_tools.decoder import COUNTER_PERIOD_DS, ColumnarEnsembles
+
+ANCHOR_DATA_TYPE = 8
+ANCHOR_TOLERANCE_DS = 10
+__NS_PER_DS = 100_000_000
+
+
+def unwrap_timestamps(timestamp_ds: np.ndarray) -> np.ndarray:
+    """Unwraps rollovers of the header decisecond counter
+
+    A step backwards by more than half the counter period is taken to be a
+    rollover.  Smaller steps backwards are left alone.
+
+    Args:
+        timestamp_ds (np.ndarray): Header timestamps (ds) in decode order
+
+    Returns:
+        np.ndarray: Unwrapped timestamps (ds) as int64
+    """
+    timestamp_ds = np.asarray(timestamp_ds, dtype=np.int64)
+    if len(timestamp_ds) == 0:
+        return timestamp_ds
+    rollovers = np.diff(timestamp_ds) < -(COUNTER_PERIOD_DS // 2)
+    n_wraps = np.concatenate(([0], np.cumsum(rollovers)))
+    return timestamp_ds + n_wraps * COUNTER_PERIOD_DS
+
+
+def anchor_offsets(ensembles: ColumnarEnsembles,
+                   unwrapped_ds: np.ndarray) -> np.ndarray:
+    """Computes the epoch offset (ds) that applies to each ensemble
+
+    Type 8 readings are only precise to the second, so consecutive readings
+    agreeing within `ANCHOR_TOLERANCE_DS` are pooled and the largest offset
+    (the one least affected by truncation) is used.  Readings that disagree
+    start a new segment, e.g. after a clock correction.  Ensembles before the
+    first reading use the first segment.
+
+    Args:
+        ensembles (ColumnarEnsembles): Decoded ensembles
+        unwrapped_ds (np.ndarray): Unwrapped timestamps from
+        `unwrap_timestamps`
+
+    Raises:
+        ValueError: No type 8 ensembles to anchor to
+
+    Returns:
+        np.ndarray: Offset (ds) to add to each unwrapped timestamp
+    """
+    anchor_rows = np.flatnonzero(ensembles.data_type == ANCHOR_DATA_TYPE)
+    if len(anchor_rows) == 0:
+        raise ValueError('No type 8 ensembles to anchor time to')
+    epoch_ds = ensembles.tables[ANCHOR_DATA_TYPE]['time'].astype(
+        np.int64) * 10
+    offsets = epoch_ds - unwrapped_ds[anchor_rows]
+
+    breaks = np.abs(np.diff(offsets)) > ANCHOR_TOLERANCE_DS
+    segment_starts = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    segment_offsets = np.maximum.reduceat(offsets, segment_starts)
+    anchor_segments = np.cumsum(np.concatenate(([False], breaks)))
+
+    row_anchor = np.searchsorted(anchor_rows, np.arange(len(ensembles)),
+                                 side='right') - 1
+    row_anchor = np.maximum(row_anchor, 0)
+    return segment_offsets[anchor_segments[row_anchor]]
+
+
+def utc_time(ensembles: ColumnarEnsembles,
+             *,
+             epoch: Optional[dt.datetime] = None) -> pd.DatetimeIndex:
+    """Reconstructs the absolute UTC time of every ensemble
+
+    Args:
+        ensembles (ColumnarEnsembles): Decoded ensembles
+        epoch (Optional[dt.datetime], optional): Time of counter zero, used
+        instead of type 8 anchors.  Naive times are taken as UTC. Defaults to
+        None.
+
+    Returns:
+        pd.DatetimeIndex: UTC time of each ensemble, in decode order
+    """
+    unwrapped = unwrap_timestamps(ensembles.timestamp_ds)
+    if epoch is None:
+        epoch_ns = anchor_offsets(ensembles, unwrapped) * __NS_PER_DS
+    else:
+        epoch_ts = pd.Timestamp(epoch)
+        if epoch_ts.tzinfo is not None:
+            epoch_ts = epoch_ts.tz_convert('UTC').tz_localize(None)
+        epoch_ns = epoch_ts.value
+    time_ns = unwrapped * __NS_PER_DS + epoch_ns
+    return pd.DatetimeIndex(time_ns.astype('datetime64[ns]'), tz='UTC',
+                            name='time')
+
+
+def with_time_index(df: pd.DataFrame,
+                    ensembles: ColumnarEnsembles,
+                    *,
+                    epoch: Optional[dt.datetime] = None) -> pd.DataFrame:
+    """Indexes a per-ensemble frame by UTC time, sorted for binary search
+    slicing, resampling and joins
+
+    Args:
+        df (pd.DataFrame): Frame with one row per ensemble in decode order,
+        e.g. from `ColumnarEnsembles.to_dataframe`
+        ensembles (ColumnarEnsembles): Decoded ensembles
+        epoch (Optional[dt.datetime], optional): Time of counter zero, used
+        instead of type 8 anchors. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Time indexed frame
+    """
+    time_index = utc_time(ensembles, epoch=epoch)
+    order = np.argsort(time_index.asi8, kind='stable')
+    return df.iloc[order].set_axis(time_index[order], axis=0)
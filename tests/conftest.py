@@ -0,0 +1,32 @@
+'''Shared test fixtures
+'''
+import struct
+from typing import Callable
+
+import pytest
+
+
+def pack_ensemble(data_type: int, timestamp: int, fmt: str,
+                  *fields) -> bytes:
+    """Packs one binary ensemble, header included
+
+    Args:
+        data_type (int): Data type nibble
+        timestamp (int): Timestamp (ds)
+        fmt (str): `struct` format of the payload, without byte order
+
+    Returns:
+        bytes: Binary ensemble
+    """
+    return struct.pack(f'<BH{fmt}', ((timestamp & 0xF) << 4) | data_type,
+                       timestamp >> 4, *fields)
+
+
+@pytest.fixture(name='ensemble')
+def fixture_ensemble() -> Callable[..., bytes]:
+    """Provides the ensemble packer
+
+    Returns:
+        Callable[..., bytes]: `pack_ensemble`
+    """
+    return pack_ensemble
@@ -0,0 +1,63 @@
+'''Tests the synthetic session generator and benchmarks
+'''
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.common import DECODERS, Encoding
+from smartfin_tools.records import decode_records
+from smartfin_tools.sfBenchmark import (BenchmarkResult, compare_baseline,
+                                        run_benchmarks, save_baseline)
+from smartfin_tools.sfGenerate import generate_session
+
+
+@pytest.mark.parametrize('bridged', [False, True])
+def test_generate_session(bridged: bool):
+    """Generated sessions decode to the generated ensembles in every encoding
+
+    Args:
+        bridged (bool): Let ensembles span records
+    """
+    session = generate_session(3000, mix={0x01: 1, 0x09: 2, 0x0F: 0.1},
+                               record_size=100, bridged=bridged)
+    assert sum(session.counts().values()) == 3000
+    assert all(len(record) == 100 for record in session.records[:-1])
+    ensembles = scd.decode_columns(session.packet)
+    assert np.array_equal(ensembles.data_type, session.data_types)
+    assert np.array_equal(ensembles.timestamp_ds, session.timestamp_ds)
+    if not bridged:
+        assert len(scd.decode_packet(session.packet)) == 3000
+    for encoding in Encoding:
+        packets = decode_records(session.encode(encoding), DECODERS[encoding])
+        assert packets.data == session.packet
+
+    with pytest.raises(ValueError):
+        generate_session(10, mix={0x0E: 1})
+
+
+def test_baseline(tmp_path: Path):
+    """Benchmark results round trip through a baseline and regressions are
+    reported
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    results = run_benchmarks(500, names=['decode_packet', 'strip_padding'],
+                             repeats=1)
+    assert set(results) == {'decode_packet', 'strip_padding'}
+    assert all(result.ensembles_per_sec > 0 for result in results.values())
+
+    baseline_path = tmp_path / 'baseline.json'
+    save_baseline(results, baseline_path, {'ensembles': 500})
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    assert compare_baseline(results, baseline) == []
+
+    slower = {name: BenchmarkResult(seconds=result.seconds * 2,
+                                    ensembles_per_sec=result.ensembles_per_sec
+                                    / 2,
+                                    peak_bytes=result.peak_bytes)
+              for name, result in results.items()}
+    assert len(compare_baseline(slower, baseline)) == 2
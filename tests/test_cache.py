@@ -0,0 +1,118 @@
+'''Tests the decode cache
+'''
+import base64
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from smartfin_tools.cache import DecodeCache
+from smartfin_tools.decoder import decode_columns
+from smartfin_tools.reader import SfpFile
+from smartfin_tools.records import decode_sfr
+from tests.conftest import pack_ensemble
+
+
+def test_decode_cache(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Cached decodes round trip, follow file contents and stay within size
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(500):
+        packet += ensemble(0x01, timestamp, 'hb', -timestamp, 1)
+        packet += ensemble(0x0F, timestamp, 'B3s', 3, b'\xc2\xb0C')
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet)
+    cache = DecodeCache(tmp_path / 'cache')
+
+    with SfpFile(sfp_path, write_sidecar=False) as reader:
+        expected = reader.decode()
+        assert reader.decode(cache=cache) is not None
+        assert cache.info().entries == 1
+        hit = reader.decode(cache=cache)
+    np.testing.assert_array_equal(hit.offsets, expected.offsets)
+    pd.testing.assert_frame_equal(hit.to_dataframe(),
+                                  expected.to_dataframe())
+
+    # Changed contents never hit the old entry
+    key = cache.entries()[0].stem
+    assert key == cache.key(sfp_path, 'sfp:None')
+    sfp_path.write_bytes(packet[:-7])
+    assert cache.key(sfp_path, 'sfp:None') != key
+
+    # Least recently used entries are evicted first
+    cache.put('other', expected)
+    os.utime(cache.path / 'other.npz', ns=(0, 0))
+    assert cache.get(key) is not None
+    cache.max_size = cache.info().size
+    cache.put('newest', expected)
+    assert cache.get('other') is None
+    assert cache.get(key) is not None
+    assert cache.get('newest') is not None
+    assert cache.purge() == 2
+    assert cache.info().entries == 0
+
+
+def _put_entry(path: Path, key: str) -> bool:
+    """Writes and reads back a cache entry from a worker process
+
+    Args:
+        path (Path): Cache directory
+        key (str): Cache key
+
+    Returns:
+        bool: Whether the entry read back complete
+    """
+    cache = DecodeCache(path)
+    packet = b''.join(pack_ensemble(0x01, timestamp, 'hb', timestamp, 1)
+                      for timestamp in range(2000))
+    ensembles = decode_columns(packet)
+    for _ in range(5):
+        cache.put(key, ensembles)
+        hit = cache.get(key)
+        if hit is None or len(hit) != len(ensembles):
+            return False
+    return True
+
+
+def test_shared_cache(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Processes sharing a cache only see complete entries, and anonymous
+    decoders never share keys
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    cache = DecodeCache(tmp_path / 'cache')
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        assert all(pool.map(_put_entry, [cache.path] * 8, ['shared'] * 8))
+    assert [entry.name for entry in cache.entries()] == ['shared.npz']
+
+    # Unreadable entries and abandoned temporary files are cleaned up
+    (cache.path / 'broken.npz').write_bytes(b'PK\x03\x04')
+    assert cache.get('broken') is None
+    assert not (cache.path / 'broken.npz').exists()
+    abandoned = cache.path / 'abandoned.tmp'
+    abandoned.write_bytes(b'')
+    os.utime(abandoned, (0, 0))
+    cache.purge(cache.max_size)
+    assert not abandoned.exists()
+
+    sfr_path = tmp_path / 'session.sfr'
+    sfr_path.write_text(base64.urlsafe_b64encode(
+        ensemble(0x01, 0, 'hb', 20, 1)).decode() + '\n', encoding='utf-8')
+    cache.purge()
+    decode_sfr(sfr_path, decoder=base64.urlsafe_b64decode, workers=1,
+               cache=cache)
+    assert cache.info().entries == 1
+
+    def closure(text: str) -> bytes:
+        return base64.urlsafe_b64decode(text)
+    decode_sfr(sfr_path, decoder=closure, workers=1, cache=cache)
+    assert cache.info().entries == 1
@@ -0,0 +1,95 @@
+'''Tests archive checksums
+'''
+import binascii
+from pathlib import Path
+
+import pytest
+
+from smartfin_tools.checksums import (ChecksumManifest, VerifyStatus,
+                                      checksum_file, verify_files)
+from smartfin_tools.sfGenerate import generate_session
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_verify_files(tmp_path: Path, workers: int):
+    """Changed records, changed files and missing files are reported
+
+    Args:
+        tmp_path (Path): Temporary directory
+        workers (int): Worker processes
+    """
+    archive = tmp_path / 'archive'
+    (archive / 'fin1').mkdir(parents=True)
+    paths = [archive / 'fin1' / 'a.sfr', archive / 'fin1' / 'b.sfp',
+             archive / 'c.sfr']
+    for seed, path in enumerate(paths):
+        generate_session(2000, seed=seed).write(path)
+
+    checksum = checksum_file(paths[0], chunk_size=100)
+    assert checksum.crc32 == binascii.crc32(paths[0].read_bytes())
+    assert len(checksum.records) == \
+        len(paths[0].read_bytes().splitlines())
+
+    manifest_path = archive / 'checksums.json'
+    manifest = ChecksumManifest(manifest_path)
+    results = verify_files(paths, manifest, workers=workers, chunk_size=100,
+                           progress=False)
+    assert [result.status for result in results] == [VerifyStatus.NEW] * 3
+    manifest.save()
+
+    lines = paths[0].read_bytes().split(b'\n')
+    lines[4] = lines[4][::-1]
+    paths[0].write_bytes(b'\n'.join(lines) + b'extra\n')
+    with open(paths[1], 'r+b') as handle:
+        handle.write(b'\xff')
+    paths[2].rename(archive / 'd.sfr')
+
+    manifest = ChecksumManifest(manifest_path)
+    results = verify_files([*paths[:2], archive / 'd.sfr'], manifest,
+                           workers=workers, progress=False)
+    statuses = {result.path.name: result for result in results}
+    assert statuses['a.sfr'].status == VerifyStatus.CHANGED
+    assert statuses['a.sfr'].bad_records == [5, len(lines)]
+    assert statuses['b.sfp'].status == VerifyStatus.CHANGED
+    assert statuses['b.sfp'].bad_records == []
+    assert statuses['d.sfr'].status == VerifyStatus.NEW
+    assert statuses['c.sfr'].status == VerifyStatus.MISSING
+
+    # c.sfr is outside fin1, so verifying fin1 alone neither reports nor
+    # forgets it
+    results = verify_files(paths[:2], manifest, update=True,
+                           roots=[archive / 'fin1'], progress=False)
+    assert VerifyStatus.MISSING not in [result.status for result in results]
+    assert manifest.get(paths[2]) is not None
+
+    results = verify_files([*paths[:2], archive / 'd.sfr'], manifest,
+                           update=True, progress=False)
+    manifest.save()
+    results = verify_files([*paths[:2], archive / 'd.sfr'],
+                           ChecksumManifest(manifest_path), progress=False)
+    assert [result.status for result in results] == [VerifyStatus.OK] * 3
+
+
+class UnpicklablePath(type(Path())):
+    """Path that cannot be sent to a worker process
+    """
+
+    def __reduce__(self):
+        raise TypeError('cannot pickle UnpicklablePath')
+
+
+def test_verify_files_worker_failure(tmp_path: Path):
+    """A file whose job fails outside checksumming is reported as an error
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    paths = [tmp_path / 'a.sfr', UnpicklablePath(tmp_path / 'b.sfr')]
+    for seed, path in enumerate(paths):
+        generate_session(200, seed=seed).write(path)
+
+    manifest = ChecksumManifest(tmp_path / 'checksums.json')
+    results = verify_files(paths, manifest, workers=2, progress=False)
+    assert [result.status for result in results] == \
+        [VerifyStatus.NEW, VerifyStatus.ERROR]
+    assert 'cannot pickle UnpicklablePath' in results[1].error
@@ -0,0 +1,79 @@
+'''Tests the compressed SFP container
+'''
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.common import Encoding, FileFormats
+from smartfin_tools.container import SfzFile, read_sfp, write_sfz
+from smartfin_tools.index import read_window
+from smartfin_tools.reader import SfpFile
+from smartfin_tools.sfConvert import sf_convert
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_sfz(tmp_path: Path, codec: str, ensemble: Callable[..., bytes]):
+    """Containers round trip and decode only the blocks in a time range
+
+    Args:
+        tmp_path (Path): Temporary directory
+        codec (str): Block codec
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(5000):
+        packet += ensemble(0x01, timestamp, 'hb', timestamp % 3000,
+                           timestamp & 1)
+        if timestamp % 7 == 0:
+            packet += ensemble(0x07, timestamp, 'H', 3700)
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet + b'\x01\x02')
+    sfz_path = tmp_path / 'session.sfz'
+    sf_convert(sfp_path, None, sfz_path, None, Encoding.BASE64URL,
+               codec=codec)
+
+    assert read_sfp(sfz_path) == sfp_path.read_bytes()
+    assert sfz_path.stat().st_size < sfp_path.stat().st_size
+    write_sfz(packet, sfz_path, codec=codec, block_size=1000)
+    with SfzFile(sfz_path) as sfz:
+        assert sfz.codec == codec
+        assert len(sfz.blocks) > 20
+        assert sfz.size == len(packet)
+        # Blocks start on ensemble boundaries
+        index = scd.build_index(packet)
+        assert np.isin(sfz.blocks['offset'], index['offset']).all()
+        assert len(sfz.blocks_between(100, 120)) == 3
+
+    # Streamed chunks are cut into the same blocks
+    streamed_path = tmp_path / 'streamed.sfz'
+    write_sfz((packet[idx:idx + 333] for idx in range(0, len(packet), 333)),
+              streamed_path, codec=codec, block_size=1000)
+    assert streamed_path.read_bytes() == sfz_path.read_bytes()
+
+    expected = read_window(sfp_path, data_types=[1], start=100, end=120)
+    window = read_window(sfz_path, data_types=[1], start=100, end=120)
+    assert len(window) == 200
+    np.testing.assert_array_equal(window.offsets, expected.offsets)
+    np.testing.assert_array_equal(window.tables[1], expected.tables[1])
+
+    with SfpFile(sfz_path, write_sidecar=False) as reader:
+        np.testing.assert_array_equal(reader['temp'],
+                                      scd.decode_columns(packet).tables[1]
+                                      ['temp'])
+    for memory_budget in (None, 1 << 16):
+        sf_convert(sfz_path, None, tmp_path / 'session.csv',
+                   FileFormats.CSV, Encoding.BASE64URL,
+                   memory_budget=memory_budget)
+        assert len(pd.read_csv(tmp_path / 'session.csv')) == \
+            len(scd.build_index(packet))
+
+    # Corrupt blocks are detected
+    data = bytearray(sfz_path.read_bytes())
+    data[20] ^= 0xFF
+    sfz_path.write_bytes(data)
+    with pytest.raises(ValueError):
+        read_sfp(sfz_path)
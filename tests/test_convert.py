@@ -0,0 +1,162 @@
+'''Tests file conversion
+'''
+import base64
+import os
+from pathlib import Path
+from typing import Callable, List
+
+import pandas as pd
+
+from smartfin_tools.cache import DecodeCache
+from smartfin_tools.common import Encoding, FileFormats, expand_inputs
+from smartfin_tools.manifest import MANIFEST_NAME, BuildManifest
+from smartfin_tools.sfConvert import batch_convert, sf_convert
+from tests.conftest import pack_ensemble
+
+
+def write_session(path: Path, n_ensembles: int) -> None:
+    """Writes a temperature only session as base64url records
+
+    Args:
+        path (Path): SFR path
+        n_ensembles (int): Number of ensembles
+    """
+    packet = b''.join(
+        pack_ensemble(0x01, timestamp, 'hb', timestamp * 128, timestamp & 1)
+        for timestamp in range(n_ensembles))
+    with open(path, 'w', encoding='utf-8') as handle:
+        for idx in range(0, len(packet), 60):
+            record = base64.urlsafe_b64encode(packet[idx:idx + 60])
+            handle.write(record.decode() + '\n')
+
+
+def test_batch_convert(tmp_path: Path):
+    """A batch converts every good file and reports the bad one
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for idx in range(4):
+        write_session(input_dir / f'session{idx}.sfr', 50 + idx)
+    (input_dir / 'broken.sfr').write_text('not base64!\n', encoding='utf-8')
+    (input_dir / 'notes.md').write_text('ignored', encoding='utf-8')
+
+    inputs = expand_inputs(input_dir)
+    assert [path.name for path in inputs] == [
+        'broken.sfr', 'session0.sfr', 'session1.sfr', 'session2.sfr',
+        'session3.sfr']
+    assert expand_inputs(input_dir / 'session*.sfr') == inputs[1:]
+
+    results = batch_convert(inputs, None, tmp_path / 'out', FileFormats.CSV,
+                            Encoding.BASE64URL, workers=2, progress=False)
+    assert [result.input_file for result in results] == inputs
+    assert not results[0].ok
+    assert not results[0].output_file.exists()
+    for idx, result in enumerate(results[1:]):
+        assert result.ok
+        df = pd.read_csv(result.output_file)
+        assert len(df) == 50 + idx
+
+
+class UnpicklableCache(DecodeCache):
+    """Decode cache that cannot be sent to a worker process
+    """
+
+    def __reduce__(self):
+        raise TypeError('cannot pickle UnpicklableCache')
+
+
+def test_batch_convert_worker_failure(tmp_path: Path):
+    """A job that fails outside its conversion is reported, not raised
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    inputs = [tmp_path / 'in' / f'session{idx}.sfr' for idx in range(2)]
+    inputs[0].parent.mkdir()
+    for path in inputs:
+        write_session(path, 50)
+
+    results = batch_convert(inputs, None, tmp_path / 'out', FileFormats.CSV,
+                            Encoding.BASE64URL, workers=2,
+                            cache=UnpicklableCache(tmp_path / 'cache'),
+                            progress=False)
+    assert [result.input_file for result in results] == inputs
+    for result in results:
+        assert not result.ok
+        assert 'cannot pickle UnpicklableCache' in result.error
+
+
+def test_chunked_csv(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Chunked CSV export matches converting the whole session at once
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(3000):
+        packet += ensemble(0x01, timestamp, 'hb', timestamp * 3,
+                           timestamp & 1)
+        if timestamp > 2000:
+            # Only appears late, so early chunks see complete temperatures
+            packet += ensemble(0x04, timestamp, 'hbbbb', -timestamp,
+                               1, 2, 3, 4)
+        if timestamp % 500 == 0:
+            packet += ensemble(0x0F, timestamp, 'B2s', 2, b'hi')
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet)
+    sfr_path = tmp_path / 'session.sfr'
+    with open(sfr_path, 'w', encoding='utf-8') as handle:
+        for idx in range(0, len(packet), 100):
+            record = base64.urlsafe_b64encode(packet[idx:idx + 100])
+            handle.write(record.decode() + '\n')
+    (tmp_path / 'empty.sfp').write_bytes(b'')
+
+    for name in ('session.sfp', 'session.sfr', 'empty.sfp'):
+        input_path = tmp_path / name
+        sf_convert(input_path, None, tmp_path / 'whole.csv', FileFormats.CSV,
+                   Encoding.BASE64URL)
+        sf_convert(input_path, None, tmp_path / 'chunked.csv',
+                   FileFormats.CSV, Encoding.BASE64URL,
+                   memory_budget=1 << 16)
+        assert (tmp_path / 'chunked.csv').read_bytes() == \
+            (tmp_path / 'whole.csv').read_bytes()
+
+
+def test_incremental_batch(tmp_path: Path):
+    """An incremental batch only reconverts new and changed inputs
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    input_dir = tmp_path / 'in'
+    (input_dir / 'deployment').mkdir(parents=True)
+    write_session(input_dir / 'session0.sfr', 50)
+    write_session(input_dir / 'deployment' / 'session1.sfr', 60)
+    output_dir = tmp_path / 'out'
+
+    def run() -> List[bool]:
+        inputs = expand_inputs(input_dir, recursive=True)
+        results = batch_convert(inputs, None, output_dir, FileFormats.CSV,
+                                Encoding.BASE64URL, workers=1,
+                                manifest=BuildManifest(
+                                    output_dir / MANIFEST_NAME),
+                                progress=False)
+        assert all(result.ok for result in results)
+        return [result.skipped for result in results]
+
+    assert run() == [False, False]
+    assert (output_dir / 'deployment' / 'session1.csv').exists()
+    assert run() == [True, True]
+
+    # Touched but unchanged inputs are still up to date
+    os.utime(input_dir / 'session0.sfr')
+    assert run() == [True, True]
+
+    write_session(input_dir / 'deployment' / 'session1.sfr', 70)
+    write_session(input_dir / 'session2.sfr', 10)
+    assert run() == [False, True, False]
+    assert len(pd.read_csv(output_dir / 'deployment' / 'session1.csv')) == 70
@@ -1,12 +1,19 @@
 '''Tests decoding
 '''
+import random
 import struct
+from typing import Callable, List
 
 import numpy as np
+import pandas as pd
 from hypothesis import given
 from hypothesis import strategies as st
 
-from smartfin_tools.decoder import decode_packet, si_conversions
+from smartfin_tools.decoder import (ColumnarEnsembles, EnsembleFilter,
+                                    convert_to_si, decode_columns,
+                                    decode_packet, decode_stream,
+                                    si_conversions, strip_padding_inplace)
+from smartfin_tools.schema import get_unit
 
 
 @given(st.floats(min_value=5, max_value=40),
@@ -114,3 +121,155 @@ def test_hdr_imu(acc_x,
         ensemble['yMagQ3']), mag_y, atol=1/8)
     assert np.isclose(si_conversions['zMagQ3'][1](
         ensemble['zMagQ3']), mag_z, atol=1/8)
+
+
+@st.composite
+def ensemble_streams(draw) -> bytes:
+    """Draws a packet of mixed ensembles with occasional padding
+
+    Returns:
+        bytes: Packet
+    """
+    formats = {1: '<hb', 2: '<bbb', 3: '', 4: '<hbbbb', 7: '<H', 8: '<hbI',
+               9: '<hhhhhhhhh', 0x0C: '<hhhhhhhhh'}
+    packet = b''
+    for data_type in draw(st.lists(st.sampled_from([*formats, 0x0F]),
+                                   max_size=50)):
+        timestamp = draw(st.integers(min_value=0, max_value=0xfffff))
+        packet += struct.pack('<BH', ((timestamp & 0xF) << 4) | data_type,
+                              timestamp >> 4)
+        if data_type == 0x0F:
+            text = draw(st.text(alphabet='abcxyz ', max_size=40)).encode()
+            packet += struct.pack('<B', len(text)) + text
+        else:
+            size = struct.calcsize(formats[data_type])
+            packet += draw(st.binary(min_size=size, max_size=size))
+        packet += bytes(draw(st.integers(min_value=0, max_value=3)))
+    return packet
+
+
+@given(ensemble_streams())
+def test_decode_columns(packet: bytes):
+    """Columnar decode matches the ensemble decoder
+
+    Args:
+        packet (bytes): Packet
+    """
+    expected = pd.DataFrame(decode_packet(packet))
+    dut = decode_columns(packet).to_dataframe()
+    pd.testing.assert_frame_equal(dut, expected)
+
+    compact = decode_columns(packet).to_dataframe(compact=True)
+    restored = compact.copy()
+    if len(compact) > 0:
+        assert compact['timestamp_ds'].dtype == np.uint32
+        restored = restored.rename(columns={'timestamp_ds': 'timestamp'})
+        restored['timestamp'] = compact['timestamp_ds'] / 10.
+    pd.testing.assert_frame_equal(
+        restored.astype(expected.dtypes.to_dict()), expected)
+    compact_si = convert_to_si(compact, compact=True, replace=True)
+    if len(compact) > 0:
+        assert compact_si['timestamp_ds'].dtype == np.uint32
+    for col in expected.columns:
+        unit = get_unit(col)
+        if unit is None or unit.flag or col == 'timestamp':
+            continue
+        present = expected[col].notna().to_numpy()
+        assert np.allclose(compact_si[unit.label].to_numpy()[present],
+                           unit.convert(expected[col].to_numpy()[present]),
+                           rtol=1e-6)
+
+
+@given(ensemble_streams(), st.lists(st.integers(min_value=1, max_value=64)))
+def test_decode_stream(packet: bytes, chunk_sizes: List[int]):
+    """Streaming decode across arbitrary chunk boundaries matches a whole
+    packet decode
+
+    Args:
+        packet (bytes): Packet
+        chunk_sizes (List[int]): Chunk sizes, with the remainder fed last
+    """
+    chunks = []
+    idx = 0
+    for size in chunk_sizes:
+        chunks.append(packet[idx:idx + size])
+        idx += size
+    chunks.append(packet[idx:])
+    expected = decode_columns(packet)
+    dut = ColumnarEnsembles.concat(decode_stream(chunks))
+    assert np.array_equal(dut.offsets, expected.offsets)
+    pd.testing.assert_frame_equal(dut.to_dataframe(), expected.to_dataframe())
+
+
+@given(ensemble_streams())
+def test_strip_padding_inplace(packet: bytes):
+    """Stripping padding in place keeps every ensemble
+
+    Args:
+        packet (bytes): Packet
+    """
+    expected = decode_columns(packet)
+    stripped = bytearray(packet)
+    stats = strip_padding_inplace(stripped)
+    assert stats.ensembles_kept == len(expected)
+    assert stats.bytes_removed == len(packet) - len(stripped)
+    pd.testing.assert_frame_equal(
+        decode_columns(bytes(stripped)).to_dataframe(),
+        expected.to_dataframe())
+
+
+@given(ensemble_streams(), st.floats(min_value=0, max_value=0xfffff / 10))
+def test_decode_filter(packet: bytes, start: float):
+    """Filtered decode matches filtering a full decode
+
+    Args:
+        packet (bytes): Packet
+        start (float): Start timestamp (s)
+    """
+    full = decode_columns(packet).to_dataframe()
+    dut = decode_columns(packet, ensemble_filter=EnsembleFilter(
+        columns=['temp', 'water'], start=start)).to_dataframe()
+    if 'temp' not in full.columns:
+        assert len(dut) == 0
+        return
+    expected = full.loc[full['temp'].notna() & (full['timestamp'] >= start),
+                        ['temp', 'water', 'timestamp', 'dataType']]
+    if len(expected) == 0:
+        assert len(dut) == 0
+        return
+    assert np.array_equal(dut['temp'], expected['temp'])
+    assert np.array_equal(dut['timestamp'], expected['timestamp'])
+    assert list(dut.columns) == list(expected.columns)
+
+
+def test_decode_resync(ensemble: Callable[..., bytes]):
+    """Resync mode recovers the ensembles around random byte damage, streamed
+    or not
+
+    Args:
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    rng = random.Random(0)
+    packet = b''
+    damage = []
+    for count in range(3000):
+        if count % 50 == 25:
+            # Replace this ensemble with random bytes
+            damage.append(len(packet))
+            packet += rng.randbytes(rng.randint(1, 40))
+            continue
+        packet += ensemble(0x01, count * 5, 'hb', rng.randint(-4000, 4000),
+                           rng.randint(0, 1))
+    dut = decode_columns(packet, resync=True)
+    good = (dut.data_type == 1) & (dut.timestamp_ds % 5 == 0)
+    assert good.sum() >= 0.98 * (3000 - len(damage))
+    assert len(dut) - good.sum() <= 3
+    assert np.all(np.diff(dut.timestamp_ds[good].astype(np.int64)) > 0)
+    assert len(dut.skipped) >= 0.9 * len(damage)
+    assert np.isin(damage, dut.skipped[:, 0]).mean() >= 0.9
+
+    chunks = [packet[idx:idx + 97] for idx in range(0, len(packet), 97)]
+    streamed = ColumnarEnsembles.concat(decode_stream(chunks, resync=True))
+    assert np.array_equal(streamed.offsets, dut.offsets)
+    pd.testing.assert_frame_equal(streamed.to_dataframe(),
+                                  dut.to_dataframe())
@@ -0,0 +1,97 @@
+'''Tests the ensemble encoder
+'''
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.common import DECODERS, Encoding
+from smartfin_tools.container import read_sfp
+from smartfin_tools.encoder import (columns_from_dataframe,
+                                    columns_from_tables, encode_columns,
+                                    pack_records, write_session)
+from smartfin_tools.records import load_records
+from smartfin_tools.schema import TEXT_DATA_TYPE
+from smartfin_tools.sfGenerate import generate_session
+from smartfin_tools.tables import SessionTables
+
+
+def test_round_trip():
+    """Decoded sessions re-encode to the same ensembles from every columnar
+    form
+    """
+    session = generate_session(3000, mix={0x01: 1, 0x06: 1, 0x07: 1,
+                                          0x09: 2, TEXT_DATA_TYPE: 0.2})
+    expected = scd.decode_packet(session.packet)
+    ensembles = scd.decode_columns(session.packet)
+    packet = encode_columns(ensembles)
+    assert scd.decode_packet(packet) == expected
+    assert b''.join(pack_records(ensembles)) == session.packet
+
+    df = pd.DataFrame(expected)
+    assert encode_columns(columns_from_dataframe(df)) == packet
+    assert encode_columns(columns_from_dataframe(scd.convert_to_si(df))) \
+        == packet
+
+    tables = SessionTables.from_ensembles(ensembles)
+    assert encode_columns(columns_from_tables(
+        {**tables.tables, TEXT_DATA_TYPE: tables.text})) == packet
+    shuffled = {data_type: table.sample(frac=1, random_state=0)
+                for data_type, table in tables.tables.items()}
+    assert encode_columns(columns_from_tables(
+        {**shuffled, TEXT_DATA_TYPE: tables.text})) == packet
+    assert scd.decode_packet(encode_columns(columns_from_tables(
+        {data_type: table.drop(columns='ensemble')
+         for data_type, table in shuffled.items()}))) == \
+        [ensemble for ensemble in expected
+         if ensemble['dataType'] != TEXT_DATA_TYPE]
+    assert encode_columns(scd.ColumnarEnsembles.empty()) == b''
+
+
+@pytest.mark.parametrize('suffix', ['.sfp', '.sfr', '.sfz'])
+def test_write_session(tmp_path: Path, suffix: str):
+    """Sessions are written in every format and encoding
+
+    Args:
+        tmp_path (Path): Temporary directory
+        suffix (str): Output format
+    """
+    session = generate_session(500)
+    ensembles = scd.decode_columns(session.packet)
+    expected = scd.decode_packet(session.packet)
+    path = tmp_path / f'session{suffix}'
+    if suffix == '.sfr':
+        for encoding in Encoding:
+            write_session(ensembles, path, encoding=encoding)
+            packet = load_records(path, DECODERS[encoding]).data
+            assert packet == session.packet
+    else:
+        write_session(ensembles, path)
+        assert scd.decode_packet(read_sfp(path)) == expected
+
+
+def test_invalid():
+    """Values the ensembles cannot hold are rejected
+    """
+    df = pd.DataFrame({'dataType': [0x01], 'timestamp': [0.1],
+                       'temp': [70000], 'water': [1]})
+    with pytest.raises(ValueError):
+        columns_from_dataframe(df)
+    with pytest.raises(ValueError):
+        columns_from_dataframe(df.drop(columns='water'))
+    with pytest.raises(ValueError):
+        columns_from_dataframe(df.assign(temp=1, timestamp=0.15))
+
+    ensembles = columns_from_dataframe(df.assign(temp=1))
+    ensembles.data_type[:] = 0x0E
+    with pytest.raises(ValueError):
+        encode_columns(ensembles)
+    ensembles.data_type[:] = 0x01
+    ensembles.timestamp_ds[:] = 1 << 20
+    with pytest.raises(ValueError):
+        encode_columns(ensembles)
+    ensembles.timestamp_ds[:] = 0
+    assert np.array_equal(scd.decode_columns(encode_columns(ensembles))
+                          .tables[0x01]['temp'], [1])
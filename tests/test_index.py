@@ -0,0 +1,65 @@
+'''Tests the sidecar ensemble index
+'''
+import base64
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from smartfin_tools.common import Encoding
+from smartfin_tools.decoder import build_index, decode_columns
+from smartfin_tools.index import (index_path, load_index, read_index,
+                                  read_window)
+from smartfin_tools.sfConvert import sf_convert
+
+
+def test_read_window(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Windowed reads decode the same ensembles as a full decode
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(0, 2000, 5):
+        packet += ensemble(0x01, timestamp, 'hb', timestamp, 1)
+        packet += ensemble(0x07, timestamp, 'H', timestamp)
+        packet += b'\x00\x00'
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet)
+
+    window = read_window(sfp_path, data_types=[7], start=10, end=20)
+    assert index_path(sfp_path).is_file()
+    assert len(load_index(sfp_path)) == 800
+
+    full = decode_columns(packet)
+    mask = (full.data_type == 7) & (full.timestamp >= 10) & \
+        (full.timestamp < 20)
+    assert np.array_equal(window.offsets, full.offsets[mask])
+    assert np.array_equal(window.tables[7]['battery'],
+                          np.arange(100, 200, 5))
+
+
+def test_index_from_conversion(tmp_path: Path,
+                               ensemble: Callable[..., bytes]):
+    """Converting records to packets writes the index alongside
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''.join(ensemble(0x01, timestamp, 'hb', timestamp, 1) +
+                      ensemble(0x0F, timestamp, 'B2s', 2, b'hi')
+                      for timestamp in range(1000))
+    sfr_path = tmp_path / 'session.sfr'
+    with open(sfr_path, 'w', encoding='utf-8') as handle:
+        # Records bridge ensembles
+        for idx in range(0, len(packet), 50):
+            record = base64.urlsafe_b64encode(packet[idx:idx + 50])
+            handle.write(record.decode() + '\n')
+    sfp_path = tmp_path / 'session.sfp'
+    sf_convert(sfr_path, None, sfp_path, None, Encoding.BASE64URL)
+
+    index = read_index(index_path(sfp_path), sfp_path)
+    assert index is not None and len(index) == 2000
+    assert np.array_equal(index, build_index(sfp_path.read_bytes()))
@@ -0,0 +1,86 @@
+'''Tests the ingestion service
+'''
+import json
+from pathlib import Path
+
+from smartfin_tools.profiling import profile
+from smartfin_tools.sfIngest import Ingester
+from smartfin_tools.storage import read_table
+from tests.test_convert import write_session
+
+
+def test_ingest(tmp_path: Path):
+    """New and changed sessions are ingested once they settle
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    output_dir = tmp_path / 'ingest'
+    write_session(data_dir / 'session0.sfr', 50)
+    (data_dir / 'broken.sfr').write_text('not base64!\n', encoding='utf-8')
+
+    ingester = Ingester(data_dir, output_dir, settle_time=60)
+    # Files are only ready once unchanged for the settle time
+    assert ingester.scan() == []
+    ingester.run(once=True)
+    assert len(read_table(output_dir / 'tables' / 'session0.npz')) == 50
+    assert (output_dir / 'sfp' / 'session0.sfp').stat().st_size == 300
+    assert (output_dir / 'plots' / 'session0' / 'Temperature.png').exists()
+    assert not (output_dir / 'tables' / 'broken.npz').exists()
+
+    # Done and failed sessions are not retried until they change
+    assert ingester.scan(settled=False) == []
+    write_session(data_dir / 'session1.sfr', 20)
+    assert ingester.scan(settled=False) == [data_dir / 'session1.sfr']
+
+    # A restarted service picks up where it left off
+    restarted = Ingester(data_dir, output_dir, settle_time=0)
+    assert restarted.scan() == [data_dir / 'broken.sfr',
+                                data_dir / 'session1.sfr']
+
+
+def test_ingest_subdirectories(tmp_path: Path):
+    """Same-named sessions in different subdirectories keep separate outputs
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    data_dir = tmp_path / 'data'
+    output_dir = tmp_path / 'ingest'
+    for fin, count in (('fin1', 30), ('fin2', 40)):
+        (data_dir / fin).mkdir(parents=True)
+        write_session(data_dir / fin / 'session.sfr', count)
+
+    Ingester(data_dir, output_dir, plots=False, settle_time=0).run(once=True)
+    for fin, count in (('fin1', 30), ('fin2', 40)):
+        assert len(read_table(output_dir / 'tables' / fin /
+                              'session.npz')) == count
+        assert (output_dir / 'sfp' / fin / 'session.sfp').stat().st_size == \
+            6 * count
+
+
+def test_ingest_decodes_once(tmp_path: Path):
+    """A session is decoded once for all outputs, which are all recorded
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    output_dir = tmp_path / 'ingest'
+    write_session(data_dir / 'session.sfr', 50)
+
+    report_path = tmp_path / 'profile.json'
+    with profile(report_path):
+        Ingester(data_dir, output_dir, settle_time=0).run(once=True)
+    stages = json.loads(report_path.read_text(encoding='utf-8'))['stages']
+    assert stages['decode_records']['items'] == 5
+    assert stages['gather_ensembles']['items'] == 50
+
+    # Losing any output, not just the SFP, rebuilds the session
+    restarted = Ingester(data_dir, output_dir, settle_time=0)
+    assert restarted.scan() == []
+    (output_dir / 'tables' / 'session.npz').unlink()
+    assert restarted.scan() == [data_dir / 'session.sfr']
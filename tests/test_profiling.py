@@ -0,0 +1,42 @@
+'''Tests stage profiling
+'''
+import json
+from pathlib import Path
+
+from smartfin_tools import profiling
+from smartfin_tools.common import Encoding
+from smartfin_tools.sfConvert import sf_convert
+from smartfin_tools.sfGenerate import generate_session
+
+
+def test_profile(tmp_path: Path):
+    """Stages are recorded while profiling and ignored otherwise
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    sfr_path = tmp_path / 'session.sfr'
+    generate_session(2000).write(sfr_path)
+    report_path = tmp_path / 'profile.json'
+
+    assert profiling.active() is None
+    with profiling.stage('ignored') as timer:
+        timer.add(items=1, nbytes=1)
+
+    with profiling.profile(report_path) as profiler:
+        assert profiling.active() is profiler
+        sf_convert(sfr_path, None, tmp_path / 'session.csv', None,
+                   Encoding.BASE64URL)
+    assert profiling.active() is None
+
+    report = json.loads(report_path.read_text(encoding='utf-8'))
+    stages = report['stages']
+    assert 'ignored' not in stages
+    for name in ('convert', 'decode_records', 'scan_headers',
+                 'gather_ensembles', 'build_dataframe', 'convert_to_si',
+                 'write_csv'):
+        assert stages[name]['calls'] > 0
+    assert stages['convert']['bytes'] == sfr_path.stat().st_size
+    assert stages['write_csv']['items'] == 2000
+    assert stages['gather_ensembles']['items'] == 2000
+    assert report['wall_seconds'] >= stages['convert']['seconds']
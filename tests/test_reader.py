@@ -0,0 +1,92 @@
+'''Tests the memory-mapped SFP reader
+'''
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import smartfin_tools.index
+from smartfin_tools.decoder import decode_columns
+from smartfin_tools.index import index_path, load_index
+from smartfin_tools.reader import SfpFile
+from smartfin_tools.sfConvert import sfp_to_csv
+
+
+def test_lazy_columns(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Lazily decoded columns match a full decode
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(300):
+        packet += ensemble(0x01, timestamp, 'hb', -timestamp, 0)
+        packet += ensemble(0x04, timestamp, 'hbbbb', timestamp, 1, 2, 3, 4)
+        packet += ensemble(0x0F, timestamp, 'B5s', 5, b'hello')
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet)
+    expected = decode_columns(packet).to_dataframe()
+
+    with SfpFile(sfp_path) as reader:
+        assert len(reader) == 900
+        assert reader.data_types == [1, 4, 15]
+        temp = reader['temp']
+        assert temp.dtype == np.int16
+        assert np.array_equal(temp, expected['temp'].dropna().astype(int))
+        assert np.array_equal(reader.by_type(4)['rawZAcc'], np.full(300, 4))
+        assert list(reader['text']) == ['hello'] * 300
+        pd.testing.assert_frame_equal(reader.decode().to_dataframe(),
+                                      expected)
+
+
+def test_read_only_sidecar(tmp_path: Path, ensemble: Callable[..., bytes],
+                           monkeypatch: pytest.MonkeyPatch):
+    """Files whose sidecar cannot be written are still read
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+        monkeypatch (pytest.MonkeyPatch): Patches the index writer
+    """
+    def read_only(path: Path, *_) -> None:
+        raise PermissionError(f'Read-only file system: {path}')
+    monkeypatch.setattr(smartfin_tools.index, 'write_index', read_only)
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(b''.join(ensemble(0x07, timestamp, 'H', timestamp)
+                                  for timestamp in range(10)))
+
+    with SfpFile(sfp_path) as reader:
+        assert len(reader) == 10
+    assert len(load_index(sfp_path)) == 10
+    assert not index_path(sfp_path).exists()
+
+
+def test_truncated(tmp_path: Path, ensemble: Callable[..., bytes],
+                   caplog: pytest.LogCaptureFixture):
+    """A truncated trailing ensemble is dropped with a warning
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+        caplog (pytest.LogCaptureFixture): Captures the warning
+    """
+    packet = b''.join(ensemble(0x01, timestamp, 'hb', timestamp, 0)
+                      for timestamp in range(10))
+    sfp_path = tmp_path / 'session.sfp'
+    sfp_path.write_bytes(packet + ensemble(0x01, 10, 'hb', 10, 0)[:4])
+
+    for _ in range(2):
+        # Built index, then the saved sidecar
+        caplog.clear()
+        with SfpFile(sfp_path) as reader:
+            assert len(reader) == 10
+        assert 'Ignoring 4 bytes of truncated ensemble at index 60' in \
+            caplog.text
+
+    caplog.clear()
+    sfp_to_csv(sfp_path, tmp_path / 'session.csv')
+    assert len(pd.read_csv(tmp_path / 'session.csv')) == 10
+    assert 'Ignoring 4 bytes of truncated ensemble' in caplog.text
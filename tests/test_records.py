@@ -0,0 +1,143 @@
+'''Tests parallel SFR decoding
+'''
+import base64
+import random
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from smartfin_tools.decoder import ColumnarEnsembles, decode_stream
+from smartfin_tools.records import (decode_records, decode_sfr, iter_records,
+                                    record_ranges)
+
+
+def test_decode_sfr(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Parallel decoding matches serial decoding with ensembles bridged
+    across records and ranges
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    rng = random.Random(0)
+    packet = b''
+    for timestamp in range(2000):
+        kind = rng.random()
+        if kind < 0.4:
+            packet += ensemble(0x01, timestamp, 'hb',
+                               rng.randint(-4000, 4000), 1)
+        elif kind < 0.8:
+            packet += ensemble(0x02, timestamp, 'bbb',
+                               *(rng.randint(-128, 127) for _ in range(3)))
+        elif kind < 0.9:
+            text = bytes(rng.choice(b'abcdef')
+                         for _ in range(rng.randint(0, 255)))
+            packet += ensemble(0x0F, timestamp, 'B', len(text)) + text
+        else:
+            packet += bytes(rng.randint(1, 20))
+    records = []
+    idx = 0
+    while idx < len(packet):
+        length = rng.choice([1, 2, 7, 60, 300, 1200])
+        records.append(packet[idx:idx + length])
+        idx += length
+    sfr_path = tmp_path / 'session.sfr'
+    sfr_path.write_text(
+        ''.join(base64.urlsafe_b64encode(record).decode() + '\n'
+                for record in records),
+        encoding='utf-8')
+
+    ranges = record_ranges(sfr_path, 50)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == sfr_path.stat().st_size
+    assert all(left[1] == right[0] for left, right in zip(ranges, ranges[1:]))
+
+    chunks = list(iter_records(sfr_path, chunk_size=500))
+    assert len(chunks) > 1
+    assert [record for packets in chunks for record in packets] == records
+
+    expected = ColumnarEnsembles.concat(decode_stream(records))
+    for workers, range_size in ((1, 1000), (2, 16), (2, 1000), (2, 10000)):
+        dut = decode_sfr(sfr_path, workers=workers, range_size=range_size)
+        assert np.array_equal(dut.offsets, expected.offsets)
+        pd.testing.assert_frame_equal(dut.to_dataframe(),
+                                      expected.to_dataframe())
+
+
+def test_decode_sfr_text(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """Text is decoded strictly, although ranges may start misaligned
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    # Read from its first byte, this text is a text header followed by half
+    # of a two byte character
+    text = '\x0f\x00\x00\x01\u00e9'.encode()
+    packet = b''
+    splits = []
+    for timestamp in range(0, 4000, 2):
+        packet += ensemble(0x01, timestamp, 'hb', timestamp, 1)
+        packet += ensemble(0x0F, timestamp + 1, 'B', len(text))
+        # Records, and so ranges, start at the text
+        splits.append(len(packet))
+        packet += text
+    records = [packet[begin:end]
+               for begin, end in zip([0, *splits], [*splits, len(packet)])]
+
+    def write(records: List[bytes]) -> Path:
+        sfr_path = tmp_path / 'session.sfr'
+        sfr_path.write_text(
+            ''.join(base64.urlsafe_b64encode(record).decode() + '\n'
+                    for record in records),
+            encoding='utf-8')
+        return sfr_path
+
+    sfr_path = write(records)
+    expected = ColumnarEnsembles.concat(decode_stream(records))
+    for workers, range_size in ((1, 64), (2, 64), (2, 8000)):
+        dut = decode_sfr(sfr_path, workers=workers, range_size=range_size)
+        assert np.array_equal(dut.offsets, expected.offsets)
+        pd.testing.assert_frame_equal(dut.to_dataframe(),
+                                      expected.to_dataframe())
+
+    # Invalid text on the true chain raises, as it does serially
+    records[len(records) // 2] = b'\xff' + records[len(records) // 2][1:]
+    sfr_path = write(records)
+    with pytest.raises(UnicodeDecodeError):
+        ColumnarEnsembles.concat(decode_stream(records))
+    for workers, range_size in ((1, 64), (2, 64), (2, 8000)):
+        with pytest.raises(UnicodeDecodeError):
+            decode_sfr(sfr_path, workers=workers, range_size=range_size)
+
+
+@pytest.mark.parametrize('encode,decode', [
+    (base64.b64encode, base64.b64decode),
+    (base64.urlsafe_b64encode, base64.urlsafe_b64decode),
+    (base64.b85encode, base64.b85decode),
+])
+def test_decode_records(encode, decode):
+    """Bulk decoding matches decoding each record
+
+    Args:
+        encode (Callable[[bytes], bytes]): Record encoder
+        decode (Callable[[str], bytes]): Record decoder
+    """
+    rng = random.Random(0)
+    records = [rng.randbytes(rng.choice([0, 1, 2, 3, 4, 5, 60, 61, 62]))
+               for _ in range(500)]
+    text = b''.join(encode(record) + rng.choice([b'\n', b'\r\n'])
+                    for record in records)
+    packets = decode_records(text, decode)
+    assert list(packets) == records
+    assert packets.data == b''.join(records)
+    assert len(packets) == len(records)
+
+    # Records the bulk path cannot take fall back to the decoder
+    text = encode(b'abc') + b'\n \t' + encode(b'de') + b'  \n'
+    assert list(decode_records(text, decode)) == [b'abc', b'de']
+    with pytest.raises(ValueError):
+        decode_records(encode(b'abc') + b'\nQUJ"\n', decode)
@@ -0,0 +1,101 @@
+'''Tests the session report
+'''
+import base64
+import binascii
+import struct
+from pathlib import Path
+
+import pytest
+
+from smartfin_tools.container import write_sfz
+from smartfin_tools.report import session_report
+
+
+def ensemble(data_type: int, timestamp_ds: int, payload: bytes) -> bytes:
+    """Builds an ensemble
+
+    Args:
+        data_type (int): Data type
+        timestamp_ds (int): Header timestamp (ds)
+        payload (bytes): Payload
+
+    Returns:
+        bytes: Ensemble
+    """
+    return struct.pack('<BH', data_type | ((timestamp_ds & 0xF) << 4),
+                       timestamp_ds >> 4) + payload
+
+
+@pytest.mark.parametrize('suffix', ['.sfp', '.sfr', '.sfz'])
+def test_session_report(tmp_path: Path, suffix: str):
+    """The report accounts for every byte of a session, across chunks
+
+    Args:
+        tmp_path (Path): Temporary directory
+        suffix (str): Session format
+    """
+    temperature = struct.pack('<hb', 2000, 1)
+    packet = b''.join(ensemble(0x01, ds, temperature) for ds in range(100))
+    packet += bytes(5)
+    packet += ensemble(0x0E, 100, b'') + ensemble(0x0D, 100, b'')
+    packet += ensemble(0x0F, 101, b'\x05hello')
+    # 50 s gap, then a step back
+    packet += b''.join(ensemble(0x01, ds, temperature)
+                       for ds in range(600, 700))
+    packet += ensemble(0x07, 650, struct.pack('<H', 3700))
+    packet += bytes(2)
+    packet += ensemble(0x01, 651, temperature)
+
+    path = tmp_path / f'session{suffix}'
+    if suffix == '.sfr':
+        records = [packet[idx:idx + 100] for idx in range(0, len(packet), 100)]
+        path.write_bytes(b''.join(base64.urlsafe_b64encode(record) + b'\n'
+                                  for record in records))
+    elif suffix == '.sfz':
+        write_sfz(packet, path, block_size=128)
+    else:
+        path.write_bytes(packet)
+
+    report = session_report(path, chunk_size=64)
+    assert report['sfp_crc32'] == f'{binascii.crc32(packet):08X}'
+    assert report['sfp_bytes'] == len(packet)
+    if suffix == '.sfz':
+        assert report['file_crc32'] is None
+    else:
+        assert report['file_crc32'] == \
+            f'{binascii.crc32(path.read_bytes()):08X}'
+    assert report['ensembles'] == 203
+    assert report['ensembles_by_type'] == {'1': 201, '7': 1, '15': 1}
+    assert report['padding_bytes'] == 7
+    assert report['padding_runs'] == 2
+    assert report['unknown_by_type'] == {'13': 1, '14': 1}
+    assert report['unknown_spans'] == [[605, 611]]
+    assert report['trailing_bytes'] == 0
+    assert report['text'] == [{'offset': 611, 'timestamp_s': 10.1,
+                               'text': 'hello'}]
+    assert report['text_undecodable'] == 0
+    time = report['time']
+    assert time['duration_s'] == 69.9
+    assert time['gaps'] == [{'offset': 620, 'start_s': 10.1,
+                             'duration_s': 49.9}]
+    assert time['covered_s'] == pytest.approx(20)
+    assert [rollback['step_s'] for rollback in time['rollbacks']] == [-4.9]
+    assert time['utc_start'] is None
+
+
+def test_session_report_undecodable_text(tmp_path: Path):
+    """Text that is not valid UTF-8 is counted instead of failing the report
+
+    Args:
+        tmp_path (Path): Temporary directory
+    """
+    packet = ensemble(0x0F, 1, b'\x02ok') + ensemble(0x0F, 2, b'\x02\xff\xfe')
+    packet += ensemble(0x01, 3, struct.pack('<hb', 2000, 1))
+    path = tmp_path / 'session.sfp'
+    path.write_bytes(packet)
+
+    report = session_report(path)
+    assert report['ensembles'] == 3
+    assert report['text_undecodable'] == 1
+    assert [message['text'] for message in report['text']] == \
+        ['ok', '\ufffd\ufffd']
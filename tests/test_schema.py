@@ -0,0 +1,94 @@
+'''Tests the ensemble schema registry
+'''
+import struct
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from smartfin_tools.decoder import decode_columns, decode_packet
+from smartfin_tools.encoder import encode_columns
+from smartfin_tools.schema import (get_schema, register_schema,
+                                   struct_to_dtype, unregister_schema,
+                                   valid_types)
+
+
+@pytest.fixture(name='custom_type')
+def fixture_custom_type() -> Iterator[int]:
+    """Provides a free data type, unregistered again afterwards
+
+    Yields:
+        Iterator[int]: Data type
+    """
+    yield 0x0D
+    unregister_schema(0x0D)
+
+
+def test_builtin_compiled():
+    """Built-in schemas compile to matching struct and dtype layouts
+    """
+    schema = get_schema(8)
+    assert schema.size == struct.calcsize('<hbI') == schema.dtype.itemsize
+    assert schema.si_labels == ('Temperature (C)', 'Water Detect', None)
+    assert schema.si_divisors[0] == 128
+
+
+def test_register_custom_type(custom_type: int):
+    """Custom data types decode without changing the library
+
+    Args:
+        custom_type (int): Free data type
+    """
+    register_schema(custom_type, '<hH', ['depth', 'pressure'])
+    packet = struct.pack('<BHhH', 0x10 | custom_type, 0, -5, 1013)
+    assert decode_packet(packet) == [
+        {'depth': -5, 'pressure': 1013, 'timestamp': 0.1,
+         'dataType': custom_type}]
+    table = decode_columns(packet).tables[custom_type]
+    assert np.array_equal(table['pressure'], [1013])
+
+    with pytest.raises(ValueError):
+        register_schema(custom_type, '<h', ['depth'])
+    with pytest.raises(ValueError):
+        register_schema(0x0F, '<h', ['depth'])
+
+    unregister_schema(custom_type)
+    assert not valid_types()[custom_type]
+    register_schema(custom_type, '<h', ['depth'])
+
+
+def test_float_schema(custom_type: int):
+    """Repeat counts, float fields and pad bytes compile, decode and encode
+
+    Args:
+        custom_type (int): Free data type
+    """
+    fmt = '<2fx?3se'
+    names = ['lat', 'lon', 'fix', 'mode', 'hdop']
+    dtype = struct_to_dtype(fmt, names)
+    assert dtype.itemsize == struct.calcsize(fmt)
+    assert dtype['lat'] == np.float32 and dtype['hdop'] == np.float16
+    with pytest.raises(ValueError):
+        struct_to_dtype('<2f', ['lat'])
+    with pytest.raises(ValueError):
+        struct_to_dtype('<3p', ['name'])
+
+    register_schema(custom_type, fmt, names)
+    fields = (32.875, -117.25, True, b'3D ', 1.5)
+    packet = b''.join(struct.pack('<BH', (timestamp << 4) | custom_type, 0) +
+                      struct.pack(fmt, *fields)
+                      for timestamp in range(4))
+    assert decode_packet(packet)[0] == {
+        **dict(zip(names, fields)), 'timestamp': 0.0,
+        'dataType': custom_type}
+    ensembles = decode_columns(packet)
+    assert np.array_equal(ensembles.tables[custom_type]['lon'],
+                          np.full(4, -117.25, dtype=np.float32))
+    compact = ensembles.to_dataframe(compact=True)
+    assert compact['lat'].dtype == np.float32
+    assert compact['fix'].dtype == bool
+    pd.testing.assert_frame_equal(ensembles.to_dataframe(),
+                                  pd.DataFrame(decode_packet(packet)))
+
+    assert encode_columns(ensembles) == packet
@@ -0,0 +1,79 @@
+'''Tests columnar session storage
+'''
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import pytest
+
+from smartfin_tools.common import Encoding, FileFormats
+from smartfin_tools.decoder import convert_to_si, decode_columns
+from smartfin_tools.sfConvert import sf_convert
+from smartfin_tools.storage import read_table, write_table
+from tests.conftest import pack_ensemble
+
+
+def make_session() -> pd.DataFrame:
+    """Builds a session with partial, text and SI columns
+
+    Returns:
+        pd.DataFrame: Compact session DataFrame
+    """
+    packet = b''
+    for timestamp in range(100):
+        packet += pack_ensemble(0x01, timestamp, 'hb', -timestamp,
+                                timestamp & 1)
+        packet += pack_ensemble(0x04, timestamp, 'hbbbb', timestamp,
+                                1, 2, 3, 4)
+        if timestamp % 10 == 0:
+            packet += pack_ensemble(0x0F, timestamp, 'B5s', 5, b'hello')
+    return convert_to_si(decode_columns(packet).to_dataframe(compact=True))
+
+
+@pytest.mark.parametrize('file_format', [FileFormats.NPZ,
+                                         FileFormats.PARQUET,
+                                         FileFormats.FEATHER])
+@pytest.mark.parametrize('mmap', [False, True])
+def test_round_trip(tmp_path: Path, file_format: FileFormats, mmap: bool):
+    """Columnar files reload with identical values and dtypes
+
+    Args:
+        tmp_path (Path): Temporary directory
+        file_format (FileFormats): Columnar format
+        mmap (bool): Memory-map on read
+    """
+    if file_format != FileFormats.NPZ:
+        pytest.importorskip('pyarrow')
+    df = make_session()
+    path = tmp_path / f'session{file_format.value}'
+    write_table(df, path)
+    pd.testing.assert_frame_equal(read_table(path, mmap=mmap), df)
+    write_table(df.iloc[:0], path)
+    pd.testing.assert_frame_equal(read_table(path, mmap=mmap), df.iloc[:0])
+
+
+def test_convert_to_npz(tmp_path: Path, ensemble: Callable[..., bytes]):
+    """NPZ output holds the same values as CSV output
+
+    Args:
+        tmp_path (Path): Temporary directory
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    sfp_path = tmp_path / 'session.sfp'
+    packet = b''
+    for timestamp in range(100):
+        packet += ensemble(0x01, timestamp, 'hb', -timestamp, timestamp & 1)
+    sfp_path.write_bytes(packet)
+    sf_convert(sfp_path, None, tmp_path / 'session.csv', None,
+               Encoding.BASE64URL)
+    sf_convert(sfp_path, None, tmp_path / 'session.npz', None,
+               Encoding.BASE64URL)
+    expected = pd.read_csv(tmp_path / 'session.csv', index_col=0)
+    dut = read_table(tmp_path / 'session.npz')
+    assert dut['temp'].dtype == 'int16'
+    assert dut['timestamp_ds'].dtype == 'uint32'
+    dut['timestamp_ds'] = dut['timestamp_ds'] / 10
+    dut = dut.rename(columns={'timestamp_ds': 'timestamp'})
+    assert list(dut.columns) == list(expected.columns)
+    for column in expected.columns:
+        assert (dut[column].to_numpy() == expected[column].to_numpy()).all()
@@ -0,0 +1,51 @@
+'''Tests per data type session tables
+'''
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+import smartfin_tools.decoder as scd
+from smartfin_tools.tables import SessionTables
+
+
+def test_session_tables(ensemble: Callable[..., bytes]):
+    """Dense tables hold the same values as the wide frame
+
+    Args:
+        ensemble (Callable[..., bytes]): Ensemble packer
+    """
+    packet = b''
+    for timestamp in range(300):
+        if timestamp % 3 == 0:
+            packet += ensemble(0x01, timestamp, 'hb', timestamp * 16,
+                               timestamp & 1)
+        elif timestamp % 3 == 1:
+            packet += ensemble(0x07, timestamp, 'H', 3700 + timestamp)
+        else:
+            packet += ensemble(0x09, timestamp, '9h',
+                               *range(timestamp, timestamp + 9))
+        if timestamp % 100 == 0:
+            packet += ensemble(0x0F, timestamp, 'B2s', 2, b'hi')
+    ensembles = scd.decode_columns(packet)
+    session = SessionTables.from_ensembles(ensembles)
+    wide = scd.convert_to_si(pd.DataFrame(scd.decode_packet(packet)))
+
+    assert session.data_types == [1, 7, 9]
+    temperatures = session[1]
+    assert len(temperatures) == 100
+    assert temperatures['temp'].dtype == np.int16
+    assert not temperatures.isna().any().any()
+    assert list(session[9].columns[:3]) == ['ensemble', 'xAcc', 'yAcc']
+    assert list(session.text['text']) == ['hi'] * 3
+
+    # Every table shares the timestamp index and decode order positions
+    for table in (*session.tables.values(), session.text):
+        assert table.index.name == 'timestamp'
+        np.testing.assert_array_equal(
+            table.index, wide['timestamp'].iloc[table['ensemble']])
+    for column in ('Temperature (C)', 'battery', 'Z Acceleration (m/s^2)'):
+        np.testing.assert_array_equal(session.column(column),
+                                      wide[column].dropna())
+    assert len(session.column('missing')) == 0
+    pd.testing.assert_frame_equal(session.wide, wide)
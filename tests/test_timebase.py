@@ -0,0 +1,45 @@
+'''Tests time reconstruction
+'''
+import struct
+
+import numpy as np
+import pandas as pd
+
+from smartfin_tools.decoder import decode_columns
+from smartfin_tools.timebase import (COUNTER_PERIOD_DS, unwrap_timestamps,
+                                     utc_time, with_time_index)
+
+
+def test_unwrap_rollover():
+    """Counter rollovers are unwrapped, small steps back are kept
+    """
+    raw = np.array([COUNTER_PERIOD_DS - 20, COUNTER_PERIOD_DS - 10, 0, 5, 3])
+    assert np.array_equal(
+        unwrap_timestamps(raw),
+        raw + np.array([0, 0, 1, 1, 1]) * COUNTER_PERIOD_DS)
+
+
+def test_anchor_to_type_8():
+    """Type 8 readings anchor every ensemble across a rollover
+    """
+    start = 1_700_000_000
+    packet = b''
+    for elapsed_ds in range(0, 600, 5):
+        counter = (COUNTER_PERIOD_DS - 300 + elapsed_ds) % COUNTER_PERIOD_DS
+        header = ((counter & 0xF) << 4, counter >> 4)
+        packet += struct.pack('<BHH', header[0] | 0x07, header[1], 4000)
+        if elapsed_ds % 100 == 0:
+            packet += struct.pack('<BHhbI', header[0] | 0x08, header[1],
+                                  0, 0, start + elapsed_ds // 10)
+    ensembles = decode_columns(packet)
+    times = utc_time(ensembles)
+    expected = pd.Timestamp(start, unit='s', tz='UTC') + \
+        pd.to_timedelta(np.arange(0, 600, 5) * 100, unit='ms')
+    battery = ensembles.data_type == 7
+    assert (times[battery] == expected).all()
+
+    df = with_time_index(ensembles.to_dataframe(), ensembles)
+    assert df.index.is_monotonic_increasing
+    window = df.loc[pd.Timestamp(start, unit='s', tz='UTC'):
+                    pd.Timestamp(start + 1, unit='s', tz='UTC')]
+    assert list(window['dataType']) == [7, 8, 7, 7]